@@ -0,0 +1,92 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+"""Per-row costs of the Python aggregates in :mod:`recsql.sqlfunctions`.
+
+Run from the top level of the source tree::
+
+   python benchmarks/bench_aggregates.py [N]
+
+Each aggregate is timed twice: calling ``step()`` directly from Python
+(the cost of the aggregate itself) and through SQLite (``SELECT agg(x)``).
+"""
+from __future__ import print_function
+
+import os.path
+import sys
+import timeit
+
+import numpy
+
+# use the source tree that contains this script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from recsql import SQLarray, sqlfunctions
+
+repeat = 3
+
+class Noop(object):
+    """Reference: cost of calling step() at all."""
+    def step(self, *args):
+        pass
+    def finalize(self):
+        return None
+
+class NaiveStdev(object):
+    """Reference: sum-of-squares standard deviation (recsql <= 0.7.11)."""
+    def __init__(self):
+        self.x2 = 0
+        self.x = 0
+        self.n = 0
+    def step(self,x):
+        try:
+            x = float(x)
+            self.x2 += x*x
+            self.x  += x
+            self.n  += 1
+        except TypeError:
+            pass
+    def finalize(self):
+        if self.n<2: return 0.0
+        return numpy.sqrt((self.n*self.x2 - self.x*self.x)/(self.n*(self.n-1)))
+
+def step_cost(cls, rows):
+    """Best time (s) per row for stepping *cls* through *rows* (tuples)."""
+    def run():
+        agg = cls()
+        for row in rows:
+            agg.step(*row)
+        return agg.finalize()
+    return min(timeit.repeat(run, number=1, repeat=repeat))/len(rows)
+
+def sql_cost(T, expression):
+    """Best time (s) per row for ``SELECT expression FROM T``."""
+    def run():
+        return T.sql("SELECT %s FROM __self__" % expression, asrecarray=False, cache=False)
+    return min(timeit.repeat(run, number=1, repeat=repeat))/len(T)
+
+def report(label, seconds):
+    print("%-40s %8.3f us/row" % (label, 1e6 * seconds))
+
+#: aggregates that are compared: label -> (class, SQL expression, columns)
+#: (classes that are not in recsql.sqlfunctions are only stepped in Python)
+AGGREGATES = [
+    ("no-op", Noop, None, ("x",)),
+    ("std (naive sum of squares)", NaiveStdev, None, ("x",)),
+    ("std", sqlfunctions._Stdev, "std(x)", ("x",)),
+    ("histogram", sqlfunctions._NumpyHistogram, "histogram(x, 100, 1e9-5, 1e9+5)",
+     ("x", 100, 1e9-5, 1e9+5)),
+    ]
+
+if __name__ == "__main__":
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    x = 1e9 + numpy.random.RandomState(1).randn(N)   # large offset
+    T = SQLarray('bench', records=[(float(v),) for v in x], columns=['x'])
+    print("N = %d rows, exact std(x) = %.6f" % (N, numpy.std(x, ddof=1)))
+    for label, cls, expression, columns in AGGREGATES:
+        rows = list(zip(*[x if c == "x" else [c] * N for c in columns]))
+        agg = cls()
+        for row in rows:
+            agg.step(*row)
+        print("%-40s result = %.60r" % (label, agg.finalize()))
+        report("  step() from Python", step_cost(cls, rows))
+        if expression is not None:
+            report("  SELECT %s" % expression, sql_cost(T, expression))
@@ -0,0 +1,59 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+"""Compression ratio and throughput of compressed NumpyArray BLOBs.
+
+Run from the top level of the source tree::
+
+   python benchmarks/bench_compression.py [N]
+
+For typical array payloads of N values (a smooth trajectory, histogram
+counts and random noise) each compression spec is timed for encoding
+(adapter) and decoding (converter). Throughput is given in MB/s of raw
+array data.
+"""
+from __future__ import print_function
+
+import os.path
+import sys
+import timeit
+
+import numpy
+
+# use the source tree that contains this script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from recsql import sqlutil
+
+repeat = 3
+
+def best_time(func, number=10):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+def payloads(N):
+    r = numpy.random.RandomState(1)
+    t = numpy.linspace(0, 10, N)
+    return [("trajectory", numpy.cumsum(r.randn(N) * 0.01).round(3) + numpy.sin(t)),
+            ("counts", r.poisson(20, N).astype(numpy.int64)),
+            ("noise", r.randn(N))]
+
+def specs():
+    yield None
+    for codec in sorted(sqlutil.CODECS):
+        yield codec
+        yield codec + "+shuffle"
+
+if __name__ == "__main__":
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print("N = %d values per array" % N)
+    print("%-12s %-14s %8s %14s %14s" % ("data", "spec", "ratio", "encode (MB/s)", "decode (MB/s)"))
+    for label, a in payloads(N):
+        MB = a.nbytes / 1e6
+        for spec in specs():
+            if spec is None:
+                adapt = lambda: sqlutil.adapt_numpyarray(a)
+            else:
+                adapt = lambda: sqlutil.adapt_compressed(sqlutil.Compressed(a, spec))
+            blob = str(adapt())
+            encode = best_time(adapt)
+            decode = best_time(lambda: sqlutil.convert_numpyarray(blob))
+            print("%-12s %-14s %8.2f %14.1f %14.1f" % (label, spec or "none", a.nbytes / float(len(blob)),
+                                                       MB / encode, MB / decode))
@@ -0,0 +1,39 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+"""Computed columns: SQL functions per row versus :meth:`SQLarray.compute`.
+
+Run from the top level of the source tree::
+
+   python benchmarks/bench_compute.py [N]
+"""
+from __future__ import print_function
+
+import os.path
+import sys
+import timeit
+
+import numpy
+
+# use the source tree that contains this script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from recsql import SQLarray
+
+repeat = 3
+
+if __name__ == "__main__":
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    r = numpy.random.RandomState(1)
+    T = SQLarray('t', records=zip(r.randn(N).tolist(), r.randn(N).tolist(),
+                                  r.uniform(-720, 720, N).tolist()), columns=['x', 'y', 'phi'])
+    # (label, SQL fields, compute() expressions)
+    cases = [("sqrt(x*x+y*y)", "sqrt(x*x+y*y)", {'r': 'sqrt(x**2+y**2)'}),
+             ("periodic(phi)", "periodic(phi)", {'phi': 'periodic(phi)'}),
+             ("both", "sqrt(x*x+y*y), periodic(phi)",
+              {'r': 'sqrt(x**2+y**2)', 'phi': 'periodic(phi)'})]
+    print("N = %d" % N)
+    print("%-16s %10s %12s %10s" % ("expression", "SQL (s)", "compute (s)", "speedup"))
+    for label, fields, expressions in cases:
+        sql = min(timeit.repeat(lambda: T.sql("SELECT %s FROM __self__" % fields, asrecarray=False, cache=False),
+                                number=1, repeat=repeat))
+        fast = min(timeit.repeat(lambda: T.compute(expressions), number=1, repeat=repeat))
+        print("%-16s %10.3f %12.3f %10.1f" % (label, sql, fast, sql/fast))
@@ -0,0 +1,41 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+"""Grouped aggregates: SQL ``GROUP BY`` versus the numpy engine of :meth:`SQLarray.groupby`.
+
+Run from the top level of the source tree::
+
+   python benchmarks/bench_groupby.py [N] [GROUPS]
+"""
+from __future__ import print_function
+
+import os.path
+import sys
+import timeit
+
+import numpy
+
+# use the source tree that contains this script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from recsql import SQLarray
+
+repeat = 3
+
+if __name__ == "__main__":
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    ngroups = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    r = numpy.random.RandomState(1)
+    T = SQLarray('t', records=zip(r.randint(0, ngroups, N).tolist(), r.randn(N).tolist()),
+                 columns=['g', 'x'])
+    cases = [("avg", {'a': 'avg(x)'}),
+             ("std", {'s': 'std(x)'}),
+             ("median", {'m': 'median(x)'}),
+             ("histogram", {'h': 'histogram(x, 50, -3, 3)'}),
+             ("avg+std+median", {'a': 'avg(x)', 's': 'std(x)', 'm': 'median(x)'})]
+    print("N = %d, groups = %d" % (N, ngroups))
+    print("%-16s %10s %10s %10s" % ("aggregates", "SQL (s)", "numpy (s)", "speedup"))
+    for label, aggregates in cases:
+        sql = min(timeit.repeat(lambda: T.groupby('g').agg(aggregates, engine='sql'),
+                                number=1, repeat=repeat))
+        fast = min(timeit.repeat(lambda: T.groupby('g').agg(aggregates, engine='numpy'),
+                                 number=1, repeat=repeat))
+        print("%-16s %10.3f %10.3f %10.1f" % (label, sql, fast, sql/fast))
@@ -0,0 +1,53 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+"""Histograms: the Python ``histogram()`` aggregate versus counting bins with an index.
+
+:meth:`SQLarray.histogram` counts the rows in each bin with range queries
+if the column has an index. For comparison, a ``GROUP BY`` on the bin index
+computed by SQLite is also timed: it avoids the Python call per row but
+SQLite sorts all rows to group them, which makes it 5-20 times slower than
+the range counts.
+
+Each range query costs about as much as aggregating 5 rows (about 7 us per
+query), so the range counts only pay off for bins < N/5 and take longer than
+the aggregate for many bins over a small table; hence
+:attr:`SQLarray.histogram_index_bins` = 256 (break even at N = 1000).
+
+Run from the top level of the source tree::
+
+   python benchmarks/bench_histogram.py [N] [BINS]
+"""
+from __future__ import print_function
+
+import os.path
+import sys
+import timeit
+
+import numpy
+
+# use the source tree that contains this script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from recsql import SQLarray
+
+repeat = 3
+
+if __name__ == "__main__":
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    bins = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    r = numpy.random.RandomState(1)
+    T = SQLarray('t', records=[(v,) for v in r.randn(N).tolist()], columns=['x'])
+    edges = numpy.histogram([], bins=bins, range=(-3, 3))[1]
+    aggregate = lambda: T.sql('SELECT histogram(x, %d, -3.0, 3.0) AS "h [Object]" FROM __self__' % bins,
+                              asrecarray=False, cache=False)
+    groupby = lambda: T.sql("SELECT CAST((x + 3.0) * %r AS INTEGER) AS b, count(*) FROM __self__ "
+                            "WHERE x >= -3.0 AND x <= 3.0 GROUP BY b" % (bins / 6.),
+                            asrecarray=False, cache=False)
+    ranges = lambda: T._histogram_ranges('x', edges, None, ())
+    print("N = %d, bins = %d" % (N, bins))
+    t_aggregate = min(timeit.repeat(aggregate, number=1, repeat=repeat))
+    print("%-28s %8.3f s" % ("histogram() aggregate", t_aggregate))
+    t = min(timeit.repeat(groupby, number=1, repeat=repeat))
+    print("%-28s %8.3f s  %5.1fx" % ("GROUP BY bin index (SQL)", t, t_aggregate/t))
+    T.sql_index('x_index', ['x'], unique=False)
+    t = min(timeit.repeat(ranges, number=1, repeat=repeat))
+    print("%-28s %8.3f s  %5.1fx" % ("range counts (index on x)", t, t_aggregate/t))
@@ -0,0 +1,38 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+"""Thread-parallel analysis of fetched columns (the *threads* arguments, see :mod:`recsql.parallel`).
+
+Run from the top level of the source tree::
+
+   python benchmarks/bench_parallel.py [N] [THREADS]
+"""
+from __future__ import print_function
+
+import os.path
+import sys
+import timeit
+
+import numpy
+
+# use the source tree that contains this script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from recsql import sqlfunctions, parallel
+
+repeat = 3
+
+if __name__ == "__main__":
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 10000000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else parallel.nthreads(True)
+    r = numpy.random.RandomState(1)
+    x, y = r.uniform(0, 1, N), r.randn(N)
+    cases = [("regularized mean", lambda t: sqlfunctions.regularized_function(x, y, numpy.mean, bins=1000,
+                                                                              range=(0, 1), threads=t)),
+             ("regularized median", lambda t: sqlfunctions.regularized_function(x, y, numpy.median, bins=1000,
+                                                                                range=(0, 1), threads=t)),
+             ("describe", lambda t: sqlfunctions.describe(y, threads=t))]
+    print("N = %d, threads = %d (CPUs: %d)" % (N, threads, parallel.nthreads(True)))
+    print("%-20s %10s %10s %8s" % ("function", "1 (s)", "%d (s)" % threads, "speedup"))
+    for label, func in cases:
+        serial = min(timeit.repeat(lambda: func(None), number=1, repeat=repeat))
+        threaded = min(timeit.repeat(lambda: func(threads), number=1, repeat=repeat))
+        print("%-20s %10.3f %10.3f %8.1f" % (label, serial, threaded, serial/threaded))
@@ -0,0 +1,42 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+"""Vectorized reductions in :func:`recsql.sqlfunctions.regularized_function`.
+
+Run from the top level of the source tree::
+
+   python benchmarks/bench_regularized_function.py [N [NBINS]]
+
+Compares the vectorized fast path with the per-bin loop that is used for
+arbitrary callables (forced by wrapping the function in a lambda). The median
+always uses the per-bin loop, so its speedup should be about 1.
+"""
+from __future__ import print_function
+
+import os.path
+import sys
+import timeit
+
+import numpy
+
+# use the source tree that contains this script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from recsql.sqlfunctions import regularized_function
+
+repeat = 3
+
+def best_time(func, x, y, bins):
+    return min(timeit.repeat(lambda: regularized_function(x, y, func, bins=bins, range=(0, 1)),
+                             number=1, repeat=repeat))
+
+if __name__ == "__main__":
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    nbins = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    r = numpy.random.RandomState(1)
+    x, y = r.rand(N), r.randn(N)
+    print("N = %d, nbins = %d" % (N, nbins))
+    print("%-10s %12s %12s %10s" % ("func", "per-bin (s)", "vector (s)", "speedup"))
+    for func in (len, numpy.sum, numpy.mean, numpy.std, numpy.min, numpy.max, numpy.median):
+        # per-bin callable: NaN for empty bins (numpy.min/max raise for them)
+        slow = best_time(lambda v: func(v) if len(v) else numpy.nan, x, y, nbins)
+        fast = best_time(func, x, y, nbins)
+        print("%-10s %12.4f %12.4f %10.1f" % (func.__name__, slow, fast, slow/fast))
@@ -0,0 +1,46 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+"""Startup costs: importing recsql and constructing SQLarray instances.
+
+Run from the top level of the source tree::
+
+   python benchmarks/bench_startup.py
+
+Import times are measured in fresh interpreters (best of *repeat* runs).
+"""
+from __future__ import print_function
+
+import os.path
+import subprocess
+import sys
+import timeit
+
+# use the source tree that contains this script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+repeat = 5
+
+def import_time(statement, repeat=repeat):
+    """Best wall-clock time (s) for running *statement* in a fresh interpreter."""
+    code = ("import sys; sys.path[:0] = %r; "
+            "import time; t0 = time.time(); %s; "
+            "sys.stdout.write(repr(time.time() - t0))" % (sys.path[:1], statement))
+    return min(float(subprocess.check_output([sys.executable, "-c", code]))
+               for i in range(repeat))
+
+def construction_time(setup, statement, number=1000):
+    """Best time (s) per call of *statement*."""
+    return min(timeit.repeat(statement, setup=setup, number=number, repeat=repeat))/number
+
+if __name__ == "__main__":
+    print("import recsql                        %8.2f ms" %
+          (1e3 * import_time("import recsql")))
+    print("import recsql; recsql.SQLarray       %8.2f ms" %
+          (1e3 * import_time("import recsql; recsql.SQLarray")))
+    print("SQLarray() (new connection)          %8.1f us" %
+          (1e6 * construction_time("from recsql import SQLarray",
+                                   "SQLarray('t', records=[(1, 2)], columns=['a', 'b'])")))
+    print("SQLarray() (shared connection)       %8.1f us" %
+          (1e6 * construction_time("from recsql import SQLarray\n"
+                                   "T = SQLarray('t', records=[(1, 2)], columns=['a', 'b'])",
+                                   "SQLarray('t', connection=T.connection)")))
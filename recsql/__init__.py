@@ -92,9 +92,9 @@ Note that the SQL database that is used as the backend for
 to the `standard SQL available in sqlite`_. These can be used in
 ``SELECT`` statements and often avoid post-processing of record arrays
 in python. It is relatively straightforward to add new functions (see
-the source code and in particular the
-:meth:`recsql.sqlarray.SQLarray._init_sql_functions` method; the
-functions themselves are defined in the module :mod:`recsql.sqlfunctions`).
+the source code and in particular the registry used by
+:func:`recsql.sqlfunctions.register`; the functions themselves are defined
+in the module :mod:`recsql.sqlfunctions`).
 
 .. _standard SQL available in sqlite: http://www.sqlite.org/lang.html
 
@@ -112,17 +112,30 @@ Expression              SQL equivalent
 
 Additional simple functions have been defined:
 
-======================   ===============================================
-Simple SQL f()           description
-======================   ===============================================
-sqr(x)                   square x*x
-sqrt(x)                  square root :func:`numpy.sqrt`
-pow(x,y)                 power x**y
-periodic(x)              wrap angle in degree between -180º and +180º
-regexp(pattern,string)   string REGEXP pattern
-match(pattern,string)    string MATCH pattern   (anchored REGEXP)
-fformat(format,x)        string formatting of a single value format % x
-======================   ===============================================
+============================   =================================================
+Simple SQL f()                 description
+============================   =================================================
+sqr(x)                         square x*x
+sqrt(x)                        square root :func:`numpy.sqrt`
+pow(x,y)                       power x**y
+periodic(x)                    wrap angle in degree between -180º and +180º
+regexp(pattern,string)         string REGEXP pattern
+match(pattern,string)          string MATCH pattern   (anchored REGEXP)
+fformat(format,x)              string formatting of a single value format % x
+array_len(a)                   number of elements of the NumpyArray a
+array_sum(a)                   sum of all elements of a
+array_mean(a)                  mean of a (NULL for an empty array)
+array_min(a)                   minimum of a (NULL for an empty array)
+array_max(a)                   maximum of a (NULL for an empty array)
+array_get(a,i)                 element a[i] of the flattened array (NULL if out
+                               of range; negative i count from the end)
+array_slice(a,start,stop)      NumpyArray a[start:stop]
+histogram_counts(h)            NumpyArray of the counts of a histogram() Object
+histogram_edges(h)             NumpyArray of the bin edges of a histogram
+histogram_total(h)             sum of all counts of a histogram
+histogram_at(h,x)              count in the bin of histogram h that contains x
+hllsketch_count(s)             distinct count of a hllsketch() Object
+============================   =================================================
 
 
 Aggregate SQL functions
@@ -140,19 +153,43 @@ Expression              SQL equivalent
 For completeness, the table also lists sqlite built-in aggregate
 functions:
 
-=====================   ===============================================
-Simple aggregate f()     description
-=====================   ===============================================
-avg(x)                   mean [sqlite builtin]
-std(x)                   standard deviation (using N-1 variance)
-
-stdN(x)                  standard deviation (using N variance),
-                         sqrt(<(X - <X>)**2>)
-
-median(x)                median of the data (see :func:`numpy.median`)
-min(x)                   minimum [sqlite builtin]
-max(x)                   maximum [sqlite builtin]
-=====================   ===============================================
+============================   ===============================================
+Simple aggregate f()           description
+============================   ===============================================
+avg(x)                         mean [sqlite builtin]
+std(x)                         standard deviation (using N-1 variance);
+                               numerically stable (Chan/Welford update)
+
+stdN(x)                        standard deviation (using N variance),
+                               sqrt(<(X - <X>)**2>)
+
+median(x)                      median of the data (see :func:`numpy.median`)
+quantile(x,q)                  q-quantile (0 <= q <= 1), interpolated as in
+                               :func:`numpy.percentile`
+percentile(x,p)                p-percentile (0 <= p <= 100)
+iqr(x)                         interquartile range Q(0.75) - Q(0.25)
+approx_quantile(x,q[,k])       approximate quantile in bounded memory with a
+                               guaranteed rank error (see
+                               :class:`recsql.sketches.QuantileSketch`)
+approx_percentile(x,p[,k])     approximate percentile
+approx_iqr(x[,k])              approximate interquartile range
+approx_count_distinct(x[,p])   approximate number of distinct values with a
+                               HyperLogLog sketch of 2**p bytes (p=4..16,
+                               default 12); relative standard error
+                               1.04/sqrt(2**p), i.e. 1.6% for p=12 (see
+                               :class:`recsql.sketches.HyperLogLog`)
+moving_mean(x)                 mean; window aggregate with O(1) cost per row,
+                               e.g. ``moving_mean(x) OVER (ORDER BY t ROWS
+                               100 PRECEDING)`` (only defined if the sqlite
+                               module has window functions, Python >= 3.11;
+                               otherwise use :meth:`SQLarray.moving`)
+moving_std(x)                  standard deviation (N-1); window aggregate
+moving_median(x)               median; window aggregate, O(log w) per row
+moving_zscore(x)               (x - <x>)/std(x) of the current (last) row;
+                               window aggregate
+min(x)                         minimum [sqlite builtin]
+max(x)                         maximum [sqlite builtin]
+============================   ===============================================
 
 
 PyAggregate SQL functions
@@ -181,15 +218,60 @@ functions that have been defined:
 ===============  ==============  ==============================================================
 PyAggregate      type            signature; description
 ===============  ==============  ==============================================================
-array             NumpyArray     array(x);
-                                 a standard :func:`numpy.array`
+array             NumpyArray     array(x[,dtype]);
+                                 a standard :func:`numpy.array` (of type dtype, e.g. 'f4');
+                                 collected in a compact typed buffer
+
+quantilesketch    Object         quantilesketch(x[,k]);
+                                 mergeable :class:`recsql.sketches.QuantileSketch`
+
+hllsketch         Object         hllsketch(x[,p]);
+                                 mergeable :class:`recsql.sketches.HyperLogLog`;
+                                 count with hllsketch_count(s)
+
+hllsketch_union   Object         hllsketch_union(s);
+                                 merge of hllsketch() Objects (e.g. of groups,
+                                 shards or time partitions)
+
+topk              NumpyArray     topk(x,k);
+                                 the k largest values in descending order
+                                 (bounded heap: O(k) memory)
+
+bottomk           NumpyArray     bottomk(x,k);
+                                 the k smallest values in ascending order
+
+argtopk           NumpyArray     argtopk(id,x,k);
+                                 the ids of the rows with the k largest x (descending x)
+
+argbottomk        NumpyArray     argbottomk(id,x,k);
+                                 the ids of the rows with the k smallest x (ascending x)
+
+describe          Object         describe(x);
+                                 summary record (n, avg, stdev, xmin, q25, median, q75, xmax)
+                                 in a single pass (see :meth:`recsql.SQLarray.describe`)
 
 histogram         Object         histogram(x,nbins,xmin,xmax);
                                  histogram x in nbins evenly spaced bins between xmin and xmax
+                                 (streaming: O(nbins) memory)
 
 distribution      Object         distribution(x,nbins,xmin,xmax);
                                  normalized histogram whose integral gives 1
 
+whistogram        Object         whistogram(x,w,nbins,xmin,xmax);
+                                 weighted histogram: sum of the weights w in each bin
+                                 (streaming: O(nbins) memory)
+
+wmeanhistogram    Object         wmeanhistogram(x,y,w,nbins,xmin,xmax);
+                                 weighted mean sum(w*y)/sum(w) of y in each bin
+                                 (streaming: O(nbins) memory)
+
+histogram2d       Object         histogram2d(x,y,nx,xmin,xmax,ny,ymin,ymax);
+                                 2D histogram (H, xedges, yedges) as from :func:`numpy.histogram2d`
+                                 (streaming: O(nx*ny) memory)
+
+distribution2d    Object         distribution2d(x,y,nx,xmin,xmax,ny,ymin,ymax);
+                                 normalized 2D histogram whose integral gives 1
+
 meanhistogram     Object         meanhistogram(x,y,nbins,xmin,xmax);
                                  histogram data points y along x and average all y in each bin
 
@@ -239,6 +321,19 @@ but when using a PyAggregate the type *must* be declared::
    a.sql('SELECT histogram(x,10,0.0,1.5) as "hist [Object]" FROM __self__')
 
 
+User-defined aggregates
+=======================
+
+New aggregates can be written as a numpy function of whole arrays and are
+then available in all tables (see :func:`recsql.sqlfunctions.register_aggregate`)::
+
+   import recsql
+   recsql.register_aggregate('rms', lambda x: numpy.sqrt(numpy.mean(x*x)))
+   recsql.register_aggregate('wsum', lambda x, w: numpy.dot(x, w), nargs=2,
+                             merge=lambda a, b: a + b)
+   a.SELECT('rms(x), wsum(x, w)')
+
+
 Other approaches to interfacing SQLite and NumPy
 ================================================
 
@@ -258,13 +353,15 @@ If you do not have to rely on SQL then also look at PyTables_.
 """
 from __future__ import absolute_import
 
-__all__ = ['SQLarray', 'SQLarray_fromfile']
+import sys
+import types
+import importlib
+
+__all__ = ['SQLarray', 'SQLarray_fromfile', 'register_aggregate']
 
 VERSION = 0,7,12
 RELEASE = False
 
-from .sqlarray import SQLarray, SQLarray_fromfile
-
 if not RELEASE:
     VERSION = VERSION[:-1] + (str(VERSION[-1]) + "-dev", )
 
@@ -276,3 +373,34 @@ def get_version_tuple():
     """Return current package version as a (MAJOR,MINOR,PATCHLEVEL)."""
     return tuple(VERSION)
 
+
+
+# Lazy loading of the public names: importing the package is cheap and numpy
+# and the submodules are only imported when one of the names is first used.
+
+#: public names and the submodules that provide them
+_lazy_attributes = {'SQLarray': 'sqlarray',
+                    'SQLarray_fromfile': 'sqlarray',
+                    'register_aggregate': 'sqlfunctions',
+                    }
+
+class _LazyPackage(types.ModuleType):
+    """Package module that imports :data:`_lazy_attributes` on first access."""
+    def __getattr__(self, name):
+        try:
+            submodule = _lazy_attributes[name]
+        except KeyError:
+            raise AttributeError("module %r has no attribute %r" % (self.__name__, name))
+        value = getattr(importlib.import_module("." + submodule, self.__name__), name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(_lazy_attributes))
+
+_package = _LazyPackage(__name__, __doc__)
+_package.__dict__.update(dict((k, v) for k, v in globals().items() if k != '__doc__'))
+# keep the original module alive (Python 2 clears the globals of a module
+# object when it is deleted, and the functions above still use them)
+_package._module = sys.modules[__name__]
+sys.modules[__name__] = _package
@@ -0,0 +1,200 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+# RecSQL -- a simple mash-up of sqlite and numpy.recsql
+# Copyright (C) 2007-2016 Oliver Beckstein <orbeckst@gmail.com>
+# Released under the GNU Public License, version 3 or higher (your choice)
+
+"""
+:mod:`recsql.compute` --- Computed columns evaluated with numpy
+===============================================================
+
+Element-wise expressions such as ``sqrt(x**2 + y**2)`` can be evaluated
+in SQL (``SELECT sqrt(x*x+y*y) FROM ...``) but then the Python functions in
+:mod:`recsql.sqlfunctions` are called once for every row. :func:`compute`
+instead fetches the columns that appear in the expressions once and
+evaluates the expressions on whole numpy arrays. It is used by
+:meth:`recsql.SQLarray.compute`.
+
+Expressions use Python syntax and may contain column names, numbers, the
+operators ``+ - * / % **`` and the functions in :data:`FUNCTIONS`. All
+values are converted to floating point numbers (NULL becomes NaN and ``/``
+is always a true division). Any expression that is not of this form (e.g.
+one that uses SQL functions such as ``fformat()``, the ``||`` operator or
+``CASE``) is handed to SQLite in the same query and evaluated there.
+
+.. autofunction:: compute
+.. autoclass:: Expression
+   :members:
+.. autodata:: FUNCTIONS
+
+"""
+from __future__ import absolute_import
+
+import ast
+try:
+    from pysqlite2 import dbapi2 as sqlite
+except ImportError:
+    from sqlite3 import dbapi2 as sqlite
+
+import numpy
+
+from .sqlarray import _where_clause
+
+def _periodic(x):
+    """Wrap angles in degree between -180 and +180 (see ``periodic()``)."""
+    x = numpy.mod(x, 360.)
+    return numpy.where(x > 180, x - 360., x)
+
+def _log(b, x=None):
+    """Logarithm as SQLite's ``log(x)`` (base 10) and ``log(b, x)`` (base b)."""
+    if x is None:
+        return numpy.log10(b)
+    return numpy.log(x) / numpy.log(b)
+
+#: functions that can be used in numpy expressions (SQL function names
+#: of :mod:`recsql.sqlfunctions` and of the sqlite math functions) as
+#: ``name: (function, number(s) of arguments)``; calls with other numbers
+#: of arguments are evaluated by SQLite
+FUNCTIONS = {
+    'sqrt': (numpy.sqrt, 1),
+    'sqr': (numpy.square, 1),
+    'pow': (numpy.power, 2),
+    'periodic': (_periodic, 1),
+    'abs': (numpy.abs, 1),
+    'exp': (numpy.exp, 1),
+    'log': (_log, (1, 2)),
+    'ln': (numpy.log, 1),
+    'log10': (numpy.log10, 1),
+    'sin': (numpy.sin, 1),
+    'cos': (numpy.cos, 1),
+    'tan': (numpy.tan, 1),
+    'asin': (numpy.arcsin, 1),
+    'acos': (numpy.arccos, 1),
+    'atan': (numpy.arctan, 1),
+    'atan2': (numpy.arctan2, 2),
+    'degrees': (numpy.degrees, 1),
+    'radians': (numpy.radians, 1),
+    'floor': (numpy.floor, 1),
+    'ceil': (numpy.ceil, 1),
+    }
+
+_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod, ast.Pow, ast.USub, ast.UAdd)
+
+
+class Expression(object):
+    """An expression that is evaluated with numpy if possible.
+
+    .. attribute:: columns
+
+       names of the columns that the numpy expression needs
+
+    .. attribute:: is_numpy
+
+       ``True`` if the expression can be evaluated with numpy, ``False``
+       if it has to be evaluated by SQLite
+
+    .. attribute:: unknown
+
+       names in a numpy expression that are not columns of the table
+       (the expression is then handed to SQLite, which may know them,
+       e.g. ``rowid``)
+    """
+    def __init__(self, expression, columns):
+        self.expression = expression
+        self.columns = set()
+        self.unknown = []
+        self.code = None
+        try:
+            tree = ast.parse(expression.strip(), mode='eval')
+            self._check(tree.body, set(columns))
+        except (SyntaxError, ValueError):
+            self.columns = set()
+            self.unknown = []
+        else:
+            if self.unknown:
+                self.columns = set()
+            else:
+                self.code = compile(tree, '<compute>', 'eval')
+
+    @property
+    def is_numpy(self):
+        return self.code is not None
+
+    def _check(self, node, columns):
+        """Collect the column names in *node*; raise ValueError if not supported."""
+        if isinstance(node, ast.Num):
+            return
+        elif isinstance(node, ast.Name):
+            if node.id not in columns:
+                self.unknown.append(node.id)
+            self.columns.add(node.id)
+        elif isinstance(node, ast.BinOp) and isinstance(node.op, _OPERATORS):
+            self._check(node.left, columns)
+            self._check(node.right, columns)
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, _OPERATORS):
+            self._check(node.operand, columns)
+        elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+              and node.func.id in FUNCTIONS and not node.keywords
+              and node.starargs is None and node.kwargs is None
+              and len(node.args) in numpy.atleast_1d(FUNCTIONS[node.func.id][1])):
+            for arg in node.args:
+                self._check(arg, columns)
+        else:
+            raise ValueError("not a numpy expression")
+
+    def evaluate(self, data, n):
+        """Evaluate with the column arrays in the dict *data* (*n* rows)."""
+        namespace = dict((name, function) for name, (function, nargs) in FUNCTIONS.items())
+        namespace.update(data)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            value = eval(self.code, {'__builtins__': {}}, namespace)
+        return numpy.zeros(n) + value       # broadcast constants
+
+
+def compute(table, expressions, where=None, parameters=None):
+    """Evaluate *expressions* for the rows of the :class:`~recsql.SQLarray` *table*.
+
+    :Arguments:
+       *table*
+          :class:`~recsql.SQLarray`
+       *expressions*
+          dict ``{name: expression}`` (results are ordered by name) or a
+          sequence of ``(name, expression)`` pairs
+       *where*
+          SQL condition that selects the rows (``WHERE`` is optional)
+       *parameters*
+          values for ``?`` place holders in *where* and in SQL expressions
+
+    :Returns: :class:`numpy.recarray` with one field per expression
+    """
+    if hasattr(expressions, 'items'):
+        expressions = sorted(expressions.items())
+    names = [name for name, expression in expressions]
+    parsed = [Expression(expression, table.columns) for name, expression in expressions]
+    columns = sorted(set().union(*[e.columns for e in parsed]))
+    fields = ['"%s"' % column for column in columns]
+    fields.extend(["(%s)" % e.expression for e in parsed if not e.is_numpy])
+    if not fields:
+        fields = ["1"]      # only constants: one value per row
+    SQL = "SELECT %s FROM __self__%s" % (", ".join(fields), _where_clause(where))
+    try:
+        rows = table.sql(SQL, parameters=parameters, asrecarray=False, cache=False)
+    except sqlite.OperationalError, err:
+        for e in parsed:
+            if e.unknown:
+                raise ValueError("unknown column(s) %s in expression %r (SQLite: %s)" %
+                                 (", ".join(e.unknown), e.expression, err))
+        raise
+    n = len(rows)
+    values = zip(*rows) if rows else [()] * len(fields)
+    data = dict((column, numpy.array(v, dtype=numpy.float64))
+                for column, v in zip(columns, values[:len(columns)]))
+    sql_values = iter(values[len(columns):])
+    results = []
+    for e in parsed:
+        if e.is_numpy:
+            results.append(e.evaluate(data, n))
+        else:
+            results.append(numpy.array(next(sql_values)))
+    return numpy.rec.fromarrays(results, names=names)
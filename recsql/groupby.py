@@ -0,0 +1,468 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+# RecSQL -- a simple mash-up of sqlite and numpy.recsql
+# Copyright (C) 2007-2016 Oliver Beckstein <orbeckst@gmail.com>
+# Released under the GNU Public License, version 3 or higher (your choice)
+
+"""
+:mod:`recsql.groupby` --- Grouped aggregates computed with numpy
+================================================================
+
+``SELECT g, median(x) FROM t GROUP BY g`` calls the Python aggregate's
+``step()`` once for every row. :class:`GroupBy` instead fetches the key and
+value columns in a single query, labels the groups with
+:func:`numpy.unique` and computes each aggregate for all groups at once
+with :func:`numpy.bincount`, :meth:`numpy.ufunc.at` and sorting. It is
+used by :meth:`recsql.SQLarray.groupby`::
+
+   r = T.groupby('g').agg({'m': 'median(x)', 's': 'std(x)', 'n': 'count(*)'})
+
+Aggregates are written as in SQL. The numpy engine knows the aggregates
+in :data:`AGGREGATES`, i.e. the statistics, the histograms and ``array()``
+of :mod:`recsql.sqlfunctions`; for any other aggregate (e.g. the ones that
+return sketches such as ``quantilesketch()``, ``describe()`` or ``topk()``)
+or for keys that are not plain column names the query is run with SQL
+``GROUP BY`` instead. The ``approx_*`` aggregates are computed exactly by
+the numpy engine (which is within any error bound).
+
+The result is a :class:`numpy.recarray` with the key columns followed by
+the aggregates, ordered by the keys as with ``ORDER BY``. Integer columns
+stay integers (``sum``, ``min``, ``max`` and ``array`` of an integer column
+are exact). Rows where a column of an aggregate is NULL are ignored by the
+aggregate (except for ``array()``, which keeps them as ``None``, as in
+SQL); aggregates without any values are NaN (instead of NULL).
+
+.. autoclass:: GroupBy
+   :members:
+.. autodata:: AGGREGATES
+
+"""
+from __future__ import absolute_import
+
+import re
+import itertools
+
+import numpy
+
+from . import sqlfunctions
+from .parallel import map_chunks
+from .sqlarray import _where_clause
+
+#: aggregates of the numpy engine ``name: (number of column arguments,
+#: number(s) of constant arguments)``
+AGGREGATES = {
+    'count': (1, 0), 'sum': (1, 0), 'total': (1, 0), 'avg': (1, 0), 'min': (1, 0), 'max': (1, 0),
+    'std': (1, 0), 'stdN': (1, 0), 'median': (1, 0), 'quantile': (1, 1), 'percentile': (1, 1),
+    'iqr': (1, 0),
+    'approx_quantile': (1, (1, 2)), 'approx_percentile': (1, (1, 2)), 'approx_iqr': (1, (0, 1)),
+    'approx_count_distinct': (1, (0, 1)),
+    'array': (1, (0, 1)),
+    'histogram': (1, 3), 'distribution': (1, 3), 'whistogram': (2, 3), 'wmeanhistogram': (3, 3),
+    'histogram2d': (2, 6), 'distribution2d': (2, 6),
+    'meanhistogram': (2, 3), 'stdhistogram': (2, 3), 'minhistogram': (2, 3),
+    'maxhistogram': (2, 3), 'medianhistogram': (2, 3), 'zscorehistogram': (2, 3),
+    }
+
+#: aggregates that are provided by SQLite itself (fast in SQL)
+_SQL_BUILTINS = ('count', 'sum', 'total', 'avg', 'min', 'max')
+
+#: aggregates that return (hist, edges...) objects
+_OBJECTS = ('histogram', 'distribution', 'whistogram', 'wmeanhistogram',
+            'histogram2d', 'distribution2d', 'meanhistogram', 'stdhistogram',
+            'minhistogram', 'maxhistogram', 'medianhistogram', 'zscorehistogram')
+
+#: aggregates that return arrays
+_ARRAYS = ('array', 'topk', 'bottomk', 'argtopk', 'argbottomk')
+
+#: function histograms: reduction of y in each bin of x
+_FUNCTION_HISTOGRAMS = {'meanhistogram': 'mean', 'stdhistogram': 'std', 'minhistogram': 'min',
+                        'maxhistogram': 'max', 'medianhistogram': 'median',
+                        'zscorehistogram': 'zscore'}
+
+#: aggregates of the numpy engine that also take columns that are not numbers
+_ANY_VALUES = ('count', 'approx_count_distinct')
+
+#: quantile(s) of the quantile aggregates as function of the constant arguments
+_QUANTILES = {'quantile': lambda args: args[0], 'percentile': lambda args: args[0]/100.,
+              'approx_quantile': lambda args: args[0],
+              'approx_percentile': lambda args: args[0]/100.,
+              'median': lambda args: 0.5, 'iqr': lambda args: [0.25, 0.75],
+              'approx_iqr': lambda args: [0.25, 0.75]}
+
+_AGGREGATE = re.compile(r'^\s*(?P<func>\w+)\s*\((?P<args>.*)\)\s*$')
+_COLUMN = re.compile(r'^\s*"?(?P<name>\w+)"?\s*$')
+
+
+class _Aggregate(object):
+    """Parsed aggregate expression "func(columns..., constants...)"."""
+    def __init__(self, name, expression, columns):
+        self.name = name
+        self.expression = expression
+        self.func = None
+        self.columns = []
+        self.args = ()
+        m = _AGGREGATE.match(expression)
+        if m is None:
+            return
+        args = [arg.strip() for arg in m.group('args').split(',')]
+        func = m.group('func')
+        if func not in AGGREGATES:
+            return
+        ncolumns, nargs = AGGREGATES[func]
+        if len(args) - ncolumns not in numpy.atleast_1d(nargs):
+            return
+        if args == ['*'] and func == 'count':
+            self.columns = ['*']
+        else:
+            for arg in args[:ncolumns]:
+                column = _COLUMN.match(arg)
+                if column is None or column.group('name') not in columns:
+                    self.columns = []
+                    return
+                self.columns.append(column.group('name'))
+        constants = []
+        for arg in args[ncolumns:]:
+            if len(arg) > 1 and arg[0] == arg[-1] == "'":
+                constants.append(arg[1:-1])
+            else:
+                try:
+                    constants.append(float(arg))
+                except ValueError:
+                    self.columns = []
+                    return
+        # only array() takes a (dtype) string
+        if any([isinstance(c, basestring) for c in constants]) != (func == 'array' and len(constants) > 0):
+            self.columns = []
+            return
+        self.args = tuple(constants)
+        self.func = func
+
+    @property
+    def column(self):
+        return self.columns[0] if self.columns else None
+
+    @property
+    def is_numpy(self):
+        return self.func is not None
+
+    @property
+    def sql(self):
+        func = self.func or self.expression.split('(')[0].strip()
+        if func in _OBJECTS:
+            return '%s AS "%s [Object]"' % (self.expression, self.name)
+        elif func in _ARRAYS:
+            return '%s AS "%s [NumpyArray]"' % (self.expression, self.name)
+        return '%s AS "%s"' % (self.expression, self.name)
+
+    def reduce(self, data, labels, ngroups, threads=None):
+        """Result for all groups; *data* maps column names to arrays."""
+        if self.column == '*':
+            return numpy.bincount(labels, minlength=ngroups)
+        func = self.func
+        if func == 'array':
+            return self._array(data[self.column], labels, ngroups)
+        columns = [data[column] for column in self.columns]
+        present = numpy.ones(len(labels), dtype=bool)
+        for values in columns:
+            if values.dtype.kind == 'f':
+                present &= ~numpy.isnan(values)
+            elif values.dtype.kind == 'O':
+                present &= numpy.array([v is not None for v in values], dtype=bool)
+        if not numpy.all(present):
+            columns = [values[present] for values in columns]
+            labels = labels[present]
+        if func in _OBJECTS:
+            return self._histogram(columns, labels, ngroups, threads)
+        values = columns[0]
+        if func == 'count':
+            return numpy.bincount(labels, minlength=ngroups)
+        if func == 'approx_count_distinct':
+            return _group_count_distinct(values, labels, ngroups)
+        if func in _QUANTILES:
+            result = _group_quantiles(values, labels, ngroups, _QUANTILES[func](self.args))
+            return result[1] - result[0] if func in ('iqr', 'approx_iqr') else result
+        if values.dtype.kind == 'i' and func in ('sum', 'min', 'max'):
+            # exact; integer columns have no NULLs, so no group is empty
+            ufunc = {'sum': numpy.add, 'min': numpy.minimum, 'max': numpy.maximum}[func]
+            order = numpy.argsort(labels, kind='mergesort')
+            starts = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(labels, minlength=ngroups))[:-1]))
+            return ufunc.reduceat(values[order], starts) if ngroups else values[:0]
+        counts = numpy.bincount(labels, minlength=ngroups)
+        if func == 'total':
+            return sqlfunctions._label_reduce('sum', values, labels, ngroups, threads=threads)
+        name = {'avg': 'mean', 'stdN': 'std', 'std': 'std'}.get(func, func)
+        result = sqlfunctions._label_reduce(name, values, labels, ngroups, threads=threads)
+        if func == 'sum':
+            result[counts == 0] = numpy.nan
+        elif func == 'std':
+            # N-1 variance; 0 for a single value (as the std() aggregate)
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                result = numpy.where(counts > 1, result * numpy.sqrt(counts / (counts - 1.)), 0.)
+            result[counts == 0] = numpy.nan
+        elif func == 'stdN':
+            result[counts == 1] = 0.
+        return result
+
+    def _array(self, values, labels, ngroups):
+        """Values of each group (in table order); NULL is kept as None."""
+        order = numpy.argsort(labels, kind='mergesort')
+        counts = numpy.bincount(labels, minlength=ngroups)
+        result = numpy.empty(ngroups, dtype=object)
+        for i, a in enumerate(numpy.split(values[order], numpy.cumsum(counts)[:-1])[:ngroups]):
+            if a.dtype.kind == 'f' and numpy.any(numpy.isnan(a)):
+                a = a.astype(object)
+                a[numpy.isnan(a.astype(numpy.float64))] = None
+            elif self.args:
+                a = a.astype(self.args[0])
+            result[i] = a
+        return result
+
+    def _histogram(self, columns, labels, ngroups, threads=None):
+        func, args = self.func, self.args
+        if func in ('histogram2d', 'distribution2d'):
+            (x, y), (nx, ny) = columns, (int(args[0]), int(args[3]))
+            xedges = numpy.histogram([], bins=nx, range=args[1:3])[1]
+            yedges = numpy.histogram([], bins=ny, range=args[4:6])[1]
+            keep = (x >= xedges[0]) & (x <= xedges[-1]) & (y >= yedges[0]) & (y <= yedges[-1])
+            xbins = sqlfunctions._bin_labels(x[keep], xedges, uniform=True, threads=threads)[0]
+            ybins = sqlfunctions._bin_labels(y[keep], yedges, uniform=True, threads=threads)[0]
+            hist = _group_bincount((labels[keep] * nx + xbins) * ny + ybins, ngroups * nx * ny,
+                                   threads=threads).reshape(ngroups, nx, ny).astype(numpy.float64)
+            edges = (xedges, yedges)
+            area = numpy.outer(numpy.diff(xedges), numpy.diff(yedges))
+        else:
+            nbins, xmin, xmax = int(args[0]), args[1], args[2]
+            edges = numpy.histogram([], bins=nbins, range=(xmin, xmax))[1]
+            bins, keep = sqlfunctions._bin_labels(columns[0], edges, uniform=True, threads=threads)
+            bins = labels[keep] * nbins + bins
+            size = ngroups * nbins
+            if func in ('histogram', 'distribution'):
+                hist = _group_bincount(bins, size, threads=threads)
+            elif func == 'whistogram':
+                hist = _group_bincount(bins, size, columns[1][keep], threads=threads)
+            elif func == 'wmeanhistogram':
+                y, w = columns[1][keep], columns[2][keep]
+                with numpy.errstate(invalid='ignore', divide='ignore'):
+                    hist = (_group_bincount(bins, size, w * y, threads=threads) /
+                            _group_bincount(bins, size, w, threads=threads))
+            else:
+                hist = sqlfunctions._label_reduce(_FUNCTION_HISTOGRAMS[func], columns[1][keep],
+                                                  bins, size, threads=threads)
+            hist = hist.reshape(ngroups, nbins)
+            edges = (edges,)
+            area = numpy.diff(edges[0])
+        result = numpy.empty(ngroups, dtype=object)
+        for i in range(ngroups):
+            h = hist[i]
+            if func in ('distribution', 'distribution2d'):
+                h = h / (float(h.sum()) * area)
+            result[i] = (h,) + edges
+        return result
+
+
+def _group_bincount(bins, size, weights=None, threads=None):
+    """Counts (or sums of *weights*) of *bins* (in parallel chunks)."""
+    if weights is None:
+        partial = map_chunks(lambda b: numpy.bincount(b, minlength=size), [bins], threads)
+    else:
+        partial = map_chunks(lambda b, w: numpy.bincount(b, w, minlength=size), [bins, weights], threads)
+    return numpy.sum(partial, axis=0)
+
+
+def _group_count_distinct(values, labels, ngroups):
+    """Number of distinct *values* in each group."""
+    if values.dtype.kind == 'O':
+        pairs = set(zip(labels.tolist(), values.tolist()))
+        return numpy.bincount([label for label, value in pairs], minlength=ngroups).astype(numpy.intp)
+    order = numpy.lexsort((values, labels))
+    values, labels = values[order], labels[order]
+    new = numpy.ones(len(labels), dtype=bool)
+    new[1:] = (labels[1:] != labels[:-1]) | (values[1:] != values[:-1])
+    return numpy.bincount(labels[new], minlength=ngroups)
+
+
+def _group_quantiles(values, labels, ngroups, q):
+    """Quantile(s) *q* of *values* in each group (as :func:`numpy.percentile`)."""
+    # sort by value, then (stable) by group: faster than numpy.lexsort
+    order = numpy.argsort(values)
+    order = order[numpy.argsort(labels[order], kind='mergesort')]
+    ordered = values[order]
+    counts = numpy.bincount(labels, minlength=ngroups)
+    starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+    nonempty = counts > 0
+    results = []
+    for qi in numpy.atleast_1d(q):
+        F = numpy.empty(ngroups)
+        F.fill(numpy.nan)
+        positions = qi * (counts[nonempty] - 1)
+        lo = numpy.floor(positions).astype(numpy.intp)
+        hi = numpy.minimum(lo + 1, counts[nonempty] - 1)
+        start = starts[nonempty]
+        F[nonempty] = ordered[start + lo] + (positions - lo) * (ordered[start + hi] - ordered[start + lo])
+        results.append(F)
+    return results if numpy.ndim(q) else results[0]
+
+
+def _columns(rows, ncolumns):
+    """Split *rows* into columns (arrays if all values are numbers).
+
+    Columns of integers become int64 arrays (exact, also above 2**53).
+    """
+    if rows and all([isinstance(v, (int, long, float)) for v in rows[0]]):
+        try:
+            a = numpy.fromiter(itertools.chain.from_iterable(rows), dtype=numpy.float64,
+                               count=len(rows) * ncolumns)
+        except (TypeError, ValueError):
+            pass     # NULL or text: slow path
+        else:
+            a = a.reshape(len(rows), ncolumns).T
+            columns = []
+            for i, (first, column) in enumerate(zip(rows[0], a)):
+                if isinstance(first, (int, long)):
+                    column = _integers(rows, i, column)
+                columns.append(column)
+            return columns
+    return zip(*rows) if rows else [()] * ncolumns
+
+
+def _values(column):
+    """Column (from :func:`_columns`) as float64 array (NULL is NaN) or,
+    if it contains values that are not numbers, as object array."""
+    if isinstance(column, numpy.ndarray):
+        return column
+    if all([v is None or isinstance(v, (int, long, float)) for v in column]):
+        return numpy.array(column, dtype=numpy.float64)
+    values = numpy.empty(len(column), dtype=object)
+    values[:] = column
+    return values
+
+
+class _NotNumeric(ValueError):
+    """A column of a numpy aggregate does not only contain numbers."""
+
+
+def _integers(rows, i, column):
+    """Column *i* of *rows* as int64 array if it only holds integers (else *column*)."""
+    if numpy.all(numpy.abs(column) < 2.0**53) and numpy.all(column == numpy.floor(column)):
+        return column.astype(numpy.int64)     # exact in float64
+    exact = numpy.array([row[i] for row in rows])
+    return exact if exact.dtype == numpy.int64 else column
+
+
+class GroupBy(object):
+    """Grouped aggregates over an :class:`~recsql.SQLarray`.
+
+    Created by :meth:`recsql.SQLarray.groupby`.
+
+    .. attribute:: min_rows
+
+       tables with fewer rows are always aggregated in SQL by ``engine='auto'``
+    """
+    min_rows = 1000
+
+    def __init__(self, table, keys):
+        self.table = table
+        if isinstance(keys, basestring):
+            keys = keys.split(',')
+        self.keys = [key.strip() for key in keys]
+
+    def agg(self, aggregates, where=None, parameters=None, engine='auto', threads=None):
+        """Compute *aggregates* for each group.
+
+        :Arguments:
+           *aggregates*
+              dict ``{name: "func(column, ...)"}`` (results ordered by name)
+              or a sequence of ``(name, expression)`` pairs
+           *where*
+              SQL condition that selects the rows (``WHERE`` is optional)
+           *parameters*
+              values for ``?`` place holders in *where*
+           *engine*
+              "numpy", "sql" or "auto": use numpy if all aggregates are
+              supported, at least one of them is a Python aggregate (the
+              SQLite builtins are fast) and the table has at least
+              :attr:`min_rows` rows; "auto" also uses SQL if a column
+              contains values that are not numbers (e.g. TEXT), which the
+              numpy engine only counts (``count()`` and
+              ``approx_count_distinct()``)
+           *threads*
+              the numpy engine aggregates chunks of large tables in parallel
+              threads (see :mod:`recsql.parallel`)
+
+        :Returns: :class:`numpy.recarray` with the keys and the aggregates
+        """
+        if hasattr(aggregates, 'items'):
+            aggregates = sorted(aggregates.items())
+        parsed = [_Aggregate(name, expression, self.table.columns) for name, expression in aggregates]
+        numpy_ok = (all([a.is_numpy for a in parsed]) and
+                    all([_COLUMN.match(key) and key.strip('"') in self.table.columns for key in self.keys]))
+        auto = engine == 'auto'
+        if auto:
+            engine = 'sql'
+            if numpy_ok and any([a.func not in _SQL_BUILTINS for a in parsed]) \
+                    and len(self.table) >= self.min_rows:
+                engine = 'numpy'
+        if engine == 'numpy':
+            if not numpy_ok:
+                raise ValueError("The numpy engine only supports %r of plain columns." %
+                                 sorted(AGGREGATES.keys()))
+            try:
+                return self._agg_numpy(parsed, where, parameters, threads)
+            except _NotNumeric:
+                if not auto:
+                    raise
+                return self._agg_sql(parsed, where, parameters)
+        elif engine == 'sql':
+            return self._agg_sql(parsed, where, parameters)
+        raise ValueError("engine must be 'auto', 'numpy' or 'sql', not %r" % engine)
+
+    def _agg_sql(self, parsed, where, parameters):
+        keys = ", ".join(self.keys)
+        SQL = "SELECT %s, %s FROM __self__%s GROUP BY %s ORDER BY %s" % (
+            keys, ", ".join([a.sql for a in parsed]), _where_clause(where), keys, keys)
+        rows = self.table.sql(SQL, parameters=parameters, asrecarray=False, cache=False)
+        names = [key.strip('"') for key in self.keys] + [a.name for a in parsed]
+        if not rows:
+            return numpy.rec.fromarrays([numpy.zeros(0)] * len(names), names=names)
+        columns = []
+        for values in zip(*rows):
+            column = numpy.empty(len(values), dtype=object)
+            column[:] = values
+            if not any([isinstance(v, (tuple, numpy.ndarray)) for v in values]):
+                column = numpy.array(list(values))
+            columns.append(column)
+        return numpy.rec.fromarrays(columns, names=names)
+
+    def _agg_numpy(self, parsed, where, parameters, threads=None):
+        keys = [key.strip('"') for key in self.keys]
+        columns = sorted(set([c for a in parsed for c in a.columns if c != '*']))
+        fields = ['"%s"' % name for name in keys + columns]
+        SQL = "SELECT %s FROM __self__%s" % (", ".join(fields), _where_clause(where))
+        rows = self.table.sql(SQL, parameters=parameters, asrecarray=False, cache=False)
+        values = _columns(rows, len(fields))
+        data = dict((name, _values(v)) for name, v in zip(columns, values[len(keys):]))
+        for a in parsed:
+            for column in a.columns:
+                if column != '*' and data[column].dtype.kind == 'O' and a.func not in _ANY_VALUES:
+                    raise _NotNumeric("The numpy engine only supports %s of column %r, which "
+                                      "contains values that are not numbers." %
+                                      (" and ".join(_ANY_VALUES), column))
+        # group labels from the sorted unique key (combinations)
+        uniques, inverses = [], []
+        for v in values[:len(keys)]:
+            u, inverse = numpy.unique(numpy.array(v), return_inverse=True)
+            uniques.append(u)
+            inverses.append(inverse)
+        if len(keys) == 1:
+            labels, group_keys = inverses[0], uniques
+        elif rows:
+            combined = numpy.ravel_multi_index(inverses, [len(u) for u in uniques])
+            groups, labels = numpy.unique(combined, return_inverse=True)
+            group_keys = [u[i] for u, i in zip(uniques, numpy.unravel_index(groups, [len(u) for u in uniques]))]
+        else:
+            labels = numpy.zeros(0, dtype=numpy.intp)
+            group_keys = [numpy.zeros(0) for key in keys]
+        ngroups = len(group_keys[0])
+        results = [a.reduce(data, labels, ngroups, threads) for a in parsed]
+        return numpy.rec.fromarrays(group_keys + results, names=keys + [a.name for a in parsed])
@@ -0,0 +1,128 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+# RecSQL -- a simple mash-up of sqlite and numpy.recsql
+# Copyright (C) 2007-2016 Oliver Beckstein <orbeckst@gmail.com>
+# Released under the GNU Public License, version 3 or higher (your choice)
+
+"""
+:mod:`recsql.parallel` --- Thread-parallel processing of array chunks
+=====================================================================
+
+Many numpy operations (arithmetic, comparisons, sorting, partitioning)
+release the GIL, so that large arrays can be processed by several threads
+at once. :func:`map_chunks` splits arrays into consecutive chunks, applies
+a function to each chunk in a thread pool and returns the partial results,
+which the caller merges (e.g. by adding histograms or with
+:meth:`recsql.sqlfunctions.Moments.merge`).
+
+It is used by the functions that analyze data after they have been fetched
+from the database, which take a *threads* argument:
+:func:`recsql.sqlfunctions.regularized_function`,
+:func:`recsql.sqlfunctions.describe`, :meth:`recsql.SQLarray.describe` and
+:meth:`recsql.groupby.GroupBy.agg`. *threads* can be
+
+``None`` (default), 0 or 1
+   no threads: the data are processed in one piece
+``True``
+   one thread per CPU (:func:`multiprocessing.cpu_count`)
+*n*
+   at most *n* threads
+
+The speed-up depends on how much of the work releases the GIL; some
+operations (e.g. :func:`numpy.bincount` and :meth:`numpy.ufunc.at` in older
+numpy versions) do not and then run one after the other. Not all of the
+work is split into chunks: :func:`~recsql.sqlfunctions.describe`, for
+instance, computes only the moments and extrema in parallel and the
+quartiles serially.
+
+The thread pools are shared. A function that runs in a pool (e.g. a
+callable *func* of :func:`~recsql.sqlfunctions.regularized_function`) may
+call :func:`map_chunks` (e.g. through :func:`~recsql.sqlfunctions.describe`
+with *threads*) but the nested call runs serially in the pool thread:
+waiting for pool threads that are busy with its caller would deadlock.
+
+.. autofunction:: map_chunks
+.. autofunction:: nthreads
+.. autodata:: MIN_CHUNKSIZE
+
+"""
+from __future__ import absolute_import
+
+import multiprocessing
+import threading
+from multiprocessing.pool import ThreadPool
+
+import numpy
+
+#: arrays are not split into chunks that are smaller than this
+MIN_CHUNKSIZE = 65536
+
+
+def nthreads(threads=None):
+    """Number of threads for the *threads* argument (see :mod:`recsql.parallel`)."""
+    if threads is None or threads is False:
+        return 1
+    if threads is True:
+        try:
+            return multiprocessing.cpu_count()
+        except NotImplementedError:
+            return 1
+    return max(1, int(threads))
+
+
+def map_chunks(func, arrays, threads=None, min_chunksize=None):
+    """Apply *func* to consecutive chunks of *arrays* in a thread pool.
+
+    :Arguments:
+       *func*
+          function ``func(chunk1, chunk2, ...)`` that is called with the
+          same slice of each array
+       *arrays*
+          sequence of arrays of the same length
+       *threads*
+          number of threads (see :func:`nthreads`)
+       *min_chunksize*
+          smallest chunk; shorter arrays are processed in one piece
+          [:data:`MIN_CHUNKSIZE`]
+
+    :Returns: list of the results of *func* for the chunks (in order); a
+              single result ``[func(*arrays)]`` if the arrays are not split
+
+    The thread pools are shared, so a call from inside a pool thread (i.e.
+    from *func* of another :func:`map_chunks`) is not split.
+    """
+    if min_chunksize is None:
+        min_chunksize = MIN_CHUNKSIZE
+    n = len(arrays[0])
+    nchunks = min(nthreads(threads), n // min_chunksize)
+    if nchunks <= 1 or getattr(_local, 'in_pool', False):
+        return [func(*arrays)]
+    bounds = numpy.linspace(0, n, nchunks + 1).astype(numpy.intp)
+    chunks = [[a[start:stop] for a in arrays] for start, stop in zip(bounds[:-1], bounds[1:])]
+    return _pool(nchunks).map(lambda chunk: _run(func, chunk), chunks)
+
+#: thread-local state: ``in_pool`` is set while a pool thread runs a chunk
+_local = threading.local()
+
+def _run(func, chunk):
+    """Call *func* with the arrays of *chunk* in a pool thread."""
+    _local.in_pool = True
+    try:
+        return func(*chunk)
+    finally:
+        _local.in_pool = False
+
+#: thread pools by number of threads (kept for reuse; the worker threads are
+#: daemon threads)
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _pool(nthreads):
+    """Return the shared :class:`~multiprocessing.pool.ThreadPool` with *nthreads* threads."""
+    with _pools_lock:
+        try:
+            return _pools[nthreads]
+        except KeyError:
+            pool = _pools[nthreads] = ThreadPool(nthreads)
+            return pool
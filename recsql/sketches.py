@@ -0,0 +1,324 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+# RecSQL -- a simple mash-up of sqlite and numpy.recsql
+# Copyright (C) 2007-2016 Oliver Beckstein <orbeckst@gmail.com>
+# Released under the GNU Public License, version 3 or higher (your choice)
+
+"""
+:mod:`recsql.sketches` --- Bounded-memory summaries of large data sets
+======================================================================
+
+Sketches summarize a stream of values in a fixed amount of memory and answer
+queries approximately, with a known error bound. Sketches of separate parts
+of the data (groups, shards, time partitions, parallel workers) can be
+merged into the sketch of the combined data.
+
+They are used by the approximate SQL aggregates in
+:mod:`recsql.sqlfunctions` and can be stored in the database as
+``Object`` columns.
+
+.. autoclass:: QuantileSketch
+   :members:
+.. autoclass:: HyperLogLog
+   :members:
+
+"""
+import array
+import hashlib
+import struct
+import numpy
+
+
+class QuantileSketch(object):
+    """Approximate quantiles with a deterministic rank error bound.
+
+    The sketch is a hierarchy of compactors: level *h* holds values that
+    represent 2**h input values each. When a level holds *k* values they are
+    sorted and every other value (alternating between odd and even
+    positions) is promoted to the next level. Memory is therefore about
+    ``k * log2(n/k)`` values for *n* input values.
+
+    Each compaction at level *h* changes the rank of any value by at most
+    2**h. The sketch adds up these bounds (plus the largest weight of a
+    stored value) so that :attr:`rank_error` is a guaranteed bound for the
+    rank of the values returned by :meth:`quantile`; in the worst case the
+    relative error ``rank_error/n`` is about ``log2(n/k)/k`` (and usually
+    much smaller).
+
+    Sketches are combined with :meth:`merge`; the merged sketch keeps a
+    guaranteed bound (the sum of both bounds plus any new compactions).
+
+    .. attribute:: n
+
+       number of values in the sketch
+
+    .. attribute:: compaction_error
+
+       sum of the rank errors of all compactions
+    """
+    def __init__(self, k=1024):
+        if k < 2:
+            raise ValueError("k must be at least 2")
+        self.k = int(k)
+        self.n = 0
+        self.compaction_error = 0
+        self.buffer = array.array('d')      # level 0 (weight 1)
+        self.levels = []                    # levels 1, 2, ... (weight 2**h)
+        self.compactions = []               # number of compactions per level
+
+    def update(self, x):
+        """Add a single value *x*."""
+        self.buffer.append(x)
+        self.n += 1
+        if len(self.buffer) >= self.k:
+            self._compress()
+
+    def update_many(self, values):
+        """Add all values in the sequence *values*."""
+        values = numpy.asarray(values, dtype=numpy.float64)
+        self.buffer.extend(values.tolist())
+        self.n += len(values)
+        if len(self.buffer) >= self.k:
+            self._compress()
+
+    def merge(self, other):
+        """Add all values from the :class:`QuantileSketch` *other* (in place)."""
+        self.buffer.extend(other.buffer)
+        for h, values in enumerate(other.levels):
+            self._set(h + 1, numpy.concatenate((self._get(h + 1), values)))
+        self.n += other.n
+        self.compaction_error += other.compaction_error
+        self._compress()
+        return self
+
+    def _get(self, h):
+        """Values at level *h* as an array."""
+        if h == 0:
+            return numpy.array(self.buffer, dtype=numpy.float64)
+        if h > len(self.levels):
+            return numpy.empty(0)
+        return self.levels[h - 1]
+
+    def _set(self, h, values):
+        if h == 0:
+            self.buffer = array.array('d', values.tolist())
+            return
+        while len(self.levels) < h:
+            self.levels.append(numpy.empty(0))
+        self.levels[h - 1] = values
+
+    def _compress(self):
+        """Compact all levels that hold at least k values."""
+        h = 0
+        while h <= len(self.levels):
+            values = self._get(h)
+            if len(values) >= self.k:
+                values = numpy.sort(values)
+                # keep the largest value back so that an even number is compacted
+                m = len(values) - len(values) % 2
+                # alternate the offset so that errors tend to cancel
+                offset = self.compactions[h] % 2 if h < len(self.compactions) else 0
+                promoted = values[offset:m:2]
+                self._set(h, values[m:])
+                self._set(h + 1, numpy.concatenate((self._get(h + 1), promoted)))
+                while len(self.compactions) <= h:
+                    self.compactions.append(0)
+                self.compactions[h] += 1
+                self.compaction_error += 2**h
+            h += 1
+
+    def _weighted(self):
+        """Sorted values and their cumulative weights."""
+        values = [self._get(h) for h in range(len(self.levels) + 1)]
+        weights = numpy.concatenate([numpy.repeat(2.0**h, len(v)) for h, v in enumerate(values)])
+        values = numpy.concatenate(values)
+        order = numpy.argsort(values, kind='mergesort')
+        return values[order], numpy.cumsum(weights[order])
+
+    def quantile(self, q):
+        """Return the approximate *q* quantile(s), 0 <= q <= 1.
+
+        The result is a value from the input whose rank is within
+        :attr:`rank_error` of ``q*n``. *q* can be a number or an array. For an
+        empty sketch ``nan`` is returned.
+        """
+        q = numpy.asarray(q, dtype=numpy.float64)
+        if numpy.any((q < 0) | (q > 1)):
+            raise ValueError("Quantiles must be in the range [0, 1].")
+        if self.n == 0:
+            return numpy.nan * q
+        values, cumweights = self._weighted()
+        positions = numpy.searchsorted(cumweights, numpy.maximum(q * self.n, 1), side='left')
+        return values[numpy.minimum(positions, len(values) - 1)]
+
+    @property
+    def rank_error(self):
+        """Guaranteed upper bound for the absolute rank error of :meth:`quantile`."""
+        return self.compaction_error + 2**len(self.levels)
+
+    @property
+    def epsilon(self):
+        """Guaranteed bound on the relative rank error, ``rank_error/n``."""
+        return float(self.rank_error) / self.n if self.n else 0.0
+
+    def __len__(self):
+        return self.n
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['buffer'] = self._get(0)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.buffer = array.array('d', state['buffer'].tolist())
+
+    def __repr__(self):
+        return "<QuantileSketch k=%d n=%d rank_error=%d>" % (self.k, self.n, self.rank_error)
+
+
+_MASK64 = 2**64 - 1
+
+def _splitmix64(z):
+    """Mix the 64-bit integer *z* into a well distributed 64-bit hash."""
+    z = (z + 0x9E3779B97F4A7C15) & _MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return z ^ (z >> 31)
+
+def _splitmix64_array(z):
+    """:func:`_splitmix64` for a uint64 array (arithmetic wraps around)."""
+    z = z + numpy.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> numpy.uint64(30))) * numpy.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> numpy.uint64(27))) * numpy.uint64(0x94D049BB133111EB)
+    return z ^ (z >> numpy.uint64(31))
+
+def hash64(x):
+    """Stable 64-bit hash of an int, float, string or BLOB *x*.
+
+    Numbers that compare equal in SQL (1 and 1.0) have the same hash;
+    strings and BLOBs are hashed with MD5, so that the hashes (and the
+    sketches built from them) do not depend on the process.
+    """
+    if isinstance(x, float):
+        if x == x and abs(x) < 2.0**63 and x == int(x):
+            x = int(x)
+        else:
+            x, = struct.unpack('<Q', struct.pack('<d', x))
+    if isinstance(x, (int, long)):
+        return _splitmix64(x & _MASK64)
+    if isinstance(x, unicode):
+        x = x.encode('utf-8')
+    return struct.unpack('<Q', hashlib.md5(x).digest()[:8])[0]
+
+def _hash64_array(values):
+    """Hashes (:func:`hash64`) of a numeric array as a uint64 array."""
+    if values.dtype.kind in 'iub':
+        bits = values.astype(numpy.int64).view(numpy.uint64)
+    else:
+        values = values.astype(numpy.float64)
+        integral = (numpy.abs(values) < 2.0**63) & (values == numpy.floor(values))
+        bits = values.view(numpy.uint64).copy()
+        bits[integral] = values[integral].astype(numpy.int64).view(numpy.uint64)
+    return _splitmix64_array(bits)
+
+def _bit_length(values):
+    """Number of significant bits of each element of a uint64 array."""
+    hi = (values >> numpy.uint64(32)).astype(numpy.float64)
+    lo = (values & numpy.uint64(0xffffffff)).astype(numpy.float64)
+    return numpy.where(hi > 0, 32 + numpy.frexp(hi)[1], numpy.frexp(lo)[1])
+
+
+class HyperLogLog(object):
+    """Approximate number of distinct values (HyperLogLog).
+
+    Each value is hashed to 64 bits (:func:`hash64`); the first *p* bits
+    select one of ``m = 2**p`` registers, which keeps the largest position
+    of the first 1-bit in the remaining bits. The sketch therefore needs
+    *m* bytes (4 KiB for the default precision ``p = 12``) regardless of
+    the number of values. Small cardinalities (up to ``2.5*m``) are
+    estimated by linear counting of the empty registers; this is more
+    precise but not exact because values collide in the registers (e.g.
+    100 distinct values may be counted as 97 for ``p = 12``).
+
+    The relative standard error of :meth:`count` is about
+    ``1.04/sqrt(m)`` (:attr:`relative_error`): 1.6% for ``p = 12``, 0.8%
+    for ``p = 14``, 0.4% for ``p = 16``. For small cardinalities (linear
+    counting) it is about ``1/sqrt(2*m)`` (1.1% for ``p = 12``). Estimates within two (three)
+    standard errors of the true value can be expected 95% (99%) of the
+    time.
+
+    Sketches with the same precision are combined with :meth:`merge`
+    (register-wise maximum); the merged sketch is identical to the sketch
+    of the combined data, so it has the same error bound. Sketches are
+    pickled compactly and can be stored as ``Object`` BLOBs.
+    """
+    def __init__(self, p=12):
+        p = int(p)
+        if not 4 <= p <= 16:
+            raise ValueError("precision p must be between 4 and 16")
+        self.p = p
+        self.registers = numpy.zeros(2**p, dtype=numpy.uint8)
+        self._shift = 64 - p
+        self._mask = 2**self._shift - 1
+
+    def update(self, x):
+        """Add a single value *x*."""
+        h = hash64(x)
+        i = h >> self._shift
+        rho = self._shift - (h & self._mask).bit_length() + 1
+        if rho > self.registers[i]:
+            self.registers[i] = rho
+
+    def update_many(self, values):
+        """Add all values in the sequence *values*."""
+        values = numpy.asarray(values)
+        if values.dtype.kind not in 'iufb':
+            for x in values.ravel().tolist():
+                self.update(x)
+            return
+        h = _hash64_array(values.ravel())
+        index = (h >> numpy.uint64(self._shift)).astype(numpy.intp)
+        rho = self._shift - _bit_length(h & numpy.uint64(self._mask)) + 1
+        numpy.maximum.at(self.registers, index, rho.astype(numpy.uint8))
+
+    def merge(self, other):
+        """Add all values from the :class:`HyperLogLog` *other* (in place)."""
+        if other.p != self.p:
+            raise ValueError("cannot merge sketches with precision %d and %d" % (self.p, other.p))
+        numpy.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    @property
+    def m(self):
+        """Number of registers, ``2**p``."""
+        return len(self.registers)
+
+    @property
+    def relative_error(self):
+        """Relative standard error of :meth:`count`, ``1.04/sqrt(m)``."""
+        return 1.04 / numpy.sqrt(self.m)
+
+    def count(self):
+        """Estimated number of distinct values."""
+        m = self.m
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate = alpha * m * m / numpy.sum(numpy.ldexp(1.0, -self.registers.astype(int)))
+        zeros = numpy.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros > 0:
+            estimate = m * numpy.log(float(m) / zeros)      # linear counting
+        return int(round(estimate))
+
+    def __len__(self):
+        return self.count()
+
+    def __getstate__(self):
+        return {'p': self.p, 'registers': self.registers.tostring()}
+
+    def __setstate__(self, state):
+        self.__init__(state['p'])
+        self.registers[:] = numpy.frombuffer(state['registers'], dtype=numpy.uint8)
+
+    def __repr__(self):
+        return "<HyperLogLog p=%d count=%d>" % (self.p, self.count())
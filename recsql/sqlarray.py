@@ -18,10 +18,36 @@ aggregate functions such as ``histogram``.
 
 A number of additional SQL functions are defined.
 
-:TODO:
-   * Make object saveable (i.e. store the database on disk instead of
-     memory or dump the memory db and provide a load() method
-   * Use hooks for the pickling protocol to make this transparent.
+The SQLite connection can be tuned with named performance profiles (see
+:data:`PROFILES` and :meth:`SQLarray.set_profile`), e.g. ::
+
+   T = SQLarray('data', records, dbfile='data.db', profile='bulkload')
+
+In-memory databases can be written to disk with :meth:`SQLarray.dump` and
+restored (back into memory) with :meth:`SQLarray.load`, e.g. ::
+
+   T.dump('data.db')
+   T = SQLarray.load('data.db')
+
+:class:`SQLarray` instances can be pickled (and hence be sent to
+:mod:`multiprocessing` workers): a file-backed table is pickled as its
+filename, an in-memory table as a compact SQLite image that only contains
+the table itself.
+
+Columns that hold numpy arrays or python objects can be stored compressed
+(see :class:`recsql.sqlutil.Compressed`), e.g. ::
+
+   T = SQLarray('traj', records, columns=['id', 'xyz'], compression={'xyz': 'zlib+shuffle'})
+
+Element-wise expressions over columns are evaluated much faster with numpy
+by :meth:`SQLarray.compute` than with Python SQL functions, e.g. ::
+
+   r = T.compute({'r': 'sqrt(x**2+y**2)', 'phi': 'periodic(phi)'})
+
+Grouped aggregates (:meth:`SQLarray.groupby`) and summary statistics of
+many columns (:meth:`SQLarray.describe`) are also computed with numpy in a
+single scan of the table. :meth:`SQLarray.describe` and
+:meth:`SQLarray.histogram` cache their results until the table changes.
 
 .. SeeAlso:: PyTables_ is a high-performance interface to table data.
 
@@ -35,7 +61,11 @@ Module content
 from __future__ import absolute_import
 
 import sys
+import os
 import os.path
+import tempfile
+import numbers
+import json
 import warnings
 import re
 try:
@@ -49,12 +79,9 @@ except ImportError:
 import numpy
 
 from .sqlutil import adapt_numpyarray, convert_numpyarray, adapt_object, convert_object
-from . import csv_table
-from . import rest_table
-from .rest_table import Table2array
-from .convert import irecarray_to_py
-
+from . import sqlutil
 from . import sqlfunctions
+# csv_table, rest_table and convert are imported when needed (faster startup)
 
 sqlite.register_adapter(numpy.ndarray,adapt_numpyarray)
 sqlite.register_adapter(numpy.recarray,adapt_numpyarray)
@@ -64,6 +91,71 @@ sqlite.register_adapter(list,adapt_object)
 sqlite.register_converter("NumpyArray", convert_numpyarray)
 sqlite.register_converter("Object", convert_object)
 
+#: Named performance profiles: sets of PRAGMA settings that are applied
+#: together to a connection (see :meth:`SQLarray.set_profile`). Negative
+#: values of *cache_size* are in KiB; *mmap_size* is in bytes. Note that
+#: *page_size* only takes effect for a new (empty) database or after a
+#: ``VACUUM`` (and never in WAL mode); journal modes other than ``MEMORY`` and
+#: ``OFF`` are ignored for in-memory databases.
+#:
+#: ``default``
+#:     SQLite's own defaults (rollback journal, full sync, ~2 MB cache)
+#: ``durable``
+#:     write-ahead log with full sync; safe against power loss
+#: ``bulkload``
+#:     in-memory journal, no sync, large cache and pages: fast ingestion but a
+#:     crash can corrupt an on-disk database
+#: ``readheavy``
+#:     write-ahead log, normal sync, large cache and memory-mapped I/O for
+#:     fast scans of large on-disk tables
+PROFILES = {
+    'default': {'page_size': 4096, 'journal_mode': 'DELETE', 'synchronous': 'FULL',
+                'cache_size': -2000, 'temp_store': 'DEFAULT', 'mmap_size': 0},
+    'durable': {'page_size': 4096, 'journal_mode': 'WAL', 'synchronous': 'FULL',
+                'cache_size': -8000, 'temp_store': 'DEFAULT', 'mmap_size': 0},
+    'bulkload': {'page_size': 65536, 'journal_mode': 'MEMORY', 'synchronous': 'OFF',
+                 'cache_size': -262144, 'temp_store': 'MEMORY', 'mmap_size': 0},
+    'readheavy': {'page_size': 16384, 'journal_mode': 'WAL', 'synchronous': 'NORMAL',
+                  'cache_size': -131072, 'temp_store': 'MEMORY', 'mmap_size': 2**30},
+    }
+
+#: PRAGMAs that make up a profile, in the order in which they are applied
+#: (*page_size* must come before *journal_mode*).
+PROFILE_PRAGMAS = ('page_size', 'journal_mode', 'synchronous', 'cache_size',
+                   'temp_store', 'mmap_size')
+
+
+def _unquote(name):
+    """Column *name* without SQL double quotes ('"a b"' -> 'a b')."""
+    if len(name) > 1 and name[0] == name[-1] == '"':
+        return name[1:-1].replace('""', '"')
+    return name
+
+
+def _quote(name):
+    """SQL identifier for *name* in double quotes ('a"b' -> '"a""b"')."""
+    return '"%s"' % name.replace('"', '""')
+
+
+def _where_clause(where):
+    """Return " WHERE *where*" for a SQL condition (``WHERE`` is optional) or ""."""
+    if where is None:
+        return ""
+    where = where.strip()
+    if not where.upper().startswith('WHERE'):
+        where = "WHERE " + where
+    return " " + where
+
+
+def _and_clause(where):
+    """Return " AND (*where*)" for a SQL condition (``WHERE`` is optional) or ""."""
+    if where is None:
+        return ""
+    where = where.strip()
+    if where.upper().startswith('WHERE'):
+        where = where[5:]
+    return " AND (%s)" % where
+
 
 class SQLarray(object):
     """A SQL table that returns (mostly) rec arrays.
@@ -94,7 +186,7 @@ class SQLarray(object):
 
     The class takes the following arguments:
 
-    .. method:: SQLarray([name[,records[,columns[,cachesize=5,connection=None,dbfile=":memory:"]]]])
+    .. method:: SQLarray([name[,records[,columns[,cachesize=5,connection=None,dbfile=":memory:",profile=None,compression=None]]]])
 
     :Arguments:
        *name*
@@ -111,7 +203,10 @@ class SQLarray(object):
           sequence of column names (only used if records does not have
           attribute dtype.names) [``None``]
        *cachesize*
-          number of (query, result) pairs that are cached [5]
+          number of (query, result) pairs that are cached [5]; also the
+          number of results of :meth:`describe` and the number of
+          selections and of histograms per selection that
+          :meth:`histogram` caches
        *connection*
           If not ``None``, reuse this connection; this adds a new table to the same
           database, which allows more complicated queries with cross-joins. The
@@ -123,6 +218,18 @@ class SQLarray(object):
           *connection* = ``None`` [":memory:"]
        *is_tmp*
           ``True``: create a tmp table; ``False``: regular table in db [``False``]
+       *profile*
+          name of a performance profile in :data:`PROFILES` (e.g. "bulkload",
+          "readheavy", "durable") or a dict of PRAGMA settings that is applied to
+          the connection before any data are loaded; ``None`` keeps the current
+          settings of the connection (see :meth:`SQLarray.set_profile`) [``None``]
+       *compression*
+          dict that maps column names to a compression spec such as "zlib",
+          "lzma:9" or "zlib+shuffle" (see :class:`recsql.sqlutil.Compressed`);
+          numpy arrays and python objects in these columns are stored
+          compressed when the table is created and in :meth:`merge`. The
+          setting is kept in the database and used again when an existing
+          table is opened. [``None``]
 
     :Bugs:
        * :exc:`InterfaceError`: *Error binding parameter 0 - probably unsupported type*
@@ -141,6 +248,7 @@ class SQLarray(object):
     """
 
     tmp_table_name = '__tmp_merge_table'  # reserved name (see merge())
+    master_table_name = 'sqlarray_master' # reserved name for book-keeping
 
     def __init__(self, name=None, records=None, filename=None, columns=None,
                  cachesize=5, connection=None, is_tmp=False, **kwargs):
@@ -148,9 +256,13 @@ class SQLarray(object):
         """
         # initialize query cache
         self.__cache = KRingbuffer(cachesize)
+        self.__summaries = KRingbuffer(cachesize)   # describe() results, see data_version
+        self.__histograms = KRingbuffer(cachesize)  # histogram() results, see data_version
         self.dbfile = kwargs.pop('dbfile', ':memory:')
+        profile = kwargs.pop('profile', None)
+        compression = kwargs.pop('compression', None)
         self.name = str(name)
-        self.master = "sqlarray_master"
+        self.master = self.master_table_name
         if self.name == self.tmp_table_name and not is_tmp or self.name == self.master:
             raise ValueError('name = %s is reserved, choose another one' % name)
         if connection is None:
@@ -159,10 +271,19 @@ class SQLarray(object):
             self._init_sqlite_functions()   # add additional functions to database
         else:
             self.connection = connection    # use existing connection
+            self._init_sqlite_functions()   # (no-op if the functions exist)
         self.cursor = self.connection.cursor()
-        # our own book-keeping table
-        self.cursor.execute("CREATE TABLE IF NOT EXISTS %(master)s (name PRIMARY KEY, value)" % vars(self))
-        self.cursor.execute("INSERT OR IGNORE INTO %(master)s (name, value) VALUES ('connection_counter', 0)" % vars(self))
+        self.is_tmp = is_tmp
+        self.profile = None
+        self.__profile_settings = None
+        if profile is not None:
+            self.set_profile(profile)
+        # our own book-keeping table (DDL commits a pending transaction of a
+        # shared connection, so only CREATE it if it does not exist yet)
+        self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (self.master,))
+        if self.cursor.fetchone() is None:
+            self.cursor.execute("CREATE TABLE %(master)s (name PRIMARY KEY, value)" % vars(self))
+        self.__book_keeping("INSERT OR IGNORE INTO %(master)s (name, value) VALUES ('connection_counter', 0)" % vars(self))
         # keep track of the number of connections (see close())
         self.__increment_connection_counter()
 
@@ -188,6 +309,9 @@ class SQLarray(object):
                     raise
             self.columns = tuple([x[0] for x in c.description])
             self.ncol = len(self.columns)
+            if compression is None:
+                compression = self._stored_compression()
+            self._set_compression(compression)
         else:   # got records
             # TODO: this should be cleaned up; see also SQLarray_fromfile()
             if records is None and not filename is None:
@@ -195,6 +319,7 @@ class SQLarray(object):
 
             if type(records) is str:
                 # maybe this is a reST table
+                from .rest_table import Table2array
                 P = Table2array(records, **kwargs)
                 P.parse()
                 records = P.records        # get the records and colnames instead of the numpy.recarray
@@ -209,6 +334,10 @@ class SQLarray(object):
                     raise TypeError('records must be a recarray or columns should be supplied')
                 self.columns = columns  # XXX: no sanity check
             self.ncol = len(self.columns)
+            self._set_compression(compression)
+
+            if self.compression and not is_tmp:
+                self._store_compression()
 
             # initialize table
             # * input is NOT sanitized and is NOT safe, don't use as CGI...
@@ -225,11 +354,12 @@ class SQLarray(object):
                 # The next can fail with 'InterfaceError: Error binding parameter 0 - probably unsupported type.'
                 # This means that the numpy array should be set up so that there are no data types
                 # such as numpy.int64/32(?) which are not compatible with sqlite (no idea why).
-                self.cursor.executemany(SQL,records)
+                self.cursor.executemany(SQL,self._compress_records(records))
             except Exception,err:
+                from .convert import irecarray_to_py
                 try:
                     # fall back: convert each record to pytypes
-                    self.cursor.executemany(SQL,irecarray_to_py(records))
+                    self.cursor.executemany(SQL,self._compress_records(irecarray_to_py(records)))
                 except Exception, err2:
                     sys.stderr.write(str(err2))
                     sys.stderr.write("ERROR: You are probably feeding a recarray; sqlite does not know how to \n"
@@ -246,11 +376,74 @@ class SQLarray(object):
         return self.sql("SELECT value FROM %(master)s WHERE name = 'connection_counter'" % vars(self),
                         cache=False, asrecarray=False)[0][0]
 
+    def __book_keeping(self, SQL, parameters=()):
+        """Execute *SQL* (on the book-keeping table).
+
+        For an on-disk db the statement runs in its own transaction on a
+        separate connection so that the db is not kept locked (other
+        connections, e.g. from unpickled copies in other processes, may want
+        to write to it) and a pending transaction on the (possibly shared)
+        connection is not committed. If the connection itself holds the
+        write lock then the statement becomes part of its transaction.
+        """
+        if self.dbfile == ":memory:":
+            return self.cursor.execute(SQL, parameters)
+        connection = sqlite.connect(self.dbfile, timeout=0)
+        try:
+            try:
+                with connection:
+                    connection.execute(SQL, parameters)
+            except sqlite.OperationalError, err:
+                if str(err).find('locked') == -1:
+                    raise
+                self.cursor.execute(SQL, parameters)
+        finally:
+            connection.close()
+
     def __add_connection_counter(self, increment):
-        return self.cursor.execute("""UPDATE %(master)s SET value =
+        return self.__book_keeping("""UPDATE %(master)s SET value =
                                           (SELECT value + ? FROM %(master)s WHERE name = 'connection_counter')
                                       WHERE name = 'connection_counter'""" % vars(self), (increment,))
 
+    def _set_compression(self, compression):
+        """Check and set the per-column compression specs (keys are unquoted column names)."""
+        self.compression = dict([(_unquote(column), spec) for column, spec in (compression or {}).items()])
+        unknown = set(self.compression) - set([_unquote(column) for column in self.columns])
+        if unknown:
+            raise ValueError("compression: unknown columns %r" % sorted(unknown))
+        for spec in self.compression.values():
+            sqlutil.parse_compression(spec)
+
+    def _store_compression(self):
+        # JSON so that any column name survives the round trip
+        spec = json.dumps(self.compression, sort_keys=True)
+        self.cursor.execute("INSERT OR REPLACE INTO %(master)s (name, value) VALUES (?, ?)" % vars(self),
+                            ('compression:' + self.name, spec))
+
+    def _stored_compression(self):
+        row = self.cursor.execute("SELECT value FROM %(master)s WHERE name = ?" % vars(self),
+                                  ('compression:' + self.name,)).fetchone()
+        if row is None or not row[0]:
+            return None
+        return dict([(str(column), str(spec)) for column, spec in json.loads(row[0]).items()])
+
+    def _compress_records(self, records):
+        """Wrap arrays and objects in compressed columns in :class:`sqlutil.Compressed`."""
+        if not self.compression:
+            return records
+        specs = [(i, self.compression[_unquote(column)]) for i, column in enumerate(self.columns)
+                 if _unquote(column) in self.compression]
+        def compress(value, spec):
+            if value is None or isinstance(value, (basestring, buffer, numbers.Number, numpy.generic)):
+                return value
+            return sqlutil.Compressed(value, spec)
+        def compressed(record):
+            record = list(record)
+            for i, spec in specs:
+                record[i] = compress(record[i], spec)
+            return record
+        return (compressed(record) for record in records)
+
     def __increment_connection_counter(self):
         return self.__add_connection_counter(1)
 
@@ -283,7 +476,8 @@ class SQLarray(object):
         len_before = len(self)
         #  CREATE TEMP TABLE in database
         tmparray = SQLarray(self.tmp_table_name, records=recarray, columns=columns,
-                            connection=self.connection, is_tmp=True)
+                            connection=self.connection, is_tmp=True,
+                            compression=self.compression)
         len_tmp = len(tmparray)
         # insert into main table
         SQL = """INSERT OR ABORT INTO __self__ SELECT * FROM %s""" % self.tmp_table_name
@@ -298,16 +492,225 @@ class SQLarray(object):
         """Commit changes to file.
 
         Only works if the SQLarray was created with they *dbfile* =
-        ``FILENAME`` keyword. There is currently no way to save a
-        in-memory db.
+        ``FILENAME`` keyword. Use :meth:`dump` to write an in-memory db
+        to a file.
 
         .. SeeAlso:: :meth:`aoft.DB.clone`
         """
         if self.dbfile == ":memory:":
             warnings.warn("In order to save the database to disk you MUST open it with "
-                          "the additional dbfile=FILENAME keyword argument.")
+                          "the additional dbfile=FILENAME keyword argument or use dump().")
         self.connection.commit()
 
+    def dump(self, filename, rows=-1, progress=None):
+        """Write a copy of the whole database to the file *filename*.
+
+        The database file is attached and all tables, indices, views and
+        triggers are copied with SQL (see :func:`recsql.sqlutil.copy_schema`),
+        incrementally in batches of *rows* rows. Any existing database in
+        *filename* is overwritten. The resulting file can be read with
+        :meth:`SQLarray.load` or as *dbfile*.
+
+        :Arguments:
+           *filename*
+              name of the SQLite database file
+           *rows*
+              number of rows to copy in each step; <= 0 copies each table in
+              a single step [-1]
+           *progress*
+              callable ``progress(status, remaining, total)`` that is called
+              after each step with the numbers of remaining and of all rows
+              [``None``]
+        """
+        if os.path.exists(filename):
+            os.remove(filename)
+        self.connection.commit()     # cannot ATTACH inside a transaction
+        self.cursor.execute("ATTACH DATABASE ? AS __dump", (filename,))
+        try:
+            sqlutil.copy_schema(self.connection, "main", "__dump", rows=rows, progress=progress)
+        finally:
+            self.cursor.execute("DETACH DATABASE __dump")
+        # the dumped db is not open anywhere
+        self._reset_connection_counter(filename)
+
+    @classmethod
+    def load(cls, filename, name=None, in_memory=True, rows=-1, progress=None, **kwargs):
+        """Create a :class:`SQLarray` from the database file *filename*.
+
+        With *in_memory* = ``True`` the whole database is copied into memory
+        (as in :meth:`dump`); otherwise the file is simply opened as
+        *dbfile*.
+
+        :Arguments:
+           *filename*
+              name of a SQLite database file, typically written with :meth:`dump`
+           *name*
+              table name; can be ``None`` if the database only contains a
+              single table [``None``]
+           *in_memory*
+              ``True``: load database into memory; ``False``: work on the file [``True``]
+           *rows*
+              number of rows to copy in each step [-1]
+           *progress*
+              callable ``progress(status, remaining, total)`` that is called
+              after each step [``None``]
+           *kwargs*
+              additional arguments for :class:`SQLarray` such as *cachesize* or
+              *profile*
+
+        :Returns: :class:`SQLarray`
+        """
+        if not os.path.exists(filename):
+            raise IOError("Database file %r does not exist." % filename)
+        if name is None:
+            source = sqlite.connect(filename)
+            try:
+                names = [row[0] for row in source.execute(
+                        "SELECT name FROM sqlite_master WHERE type='table' AND name != ?",
+                        (cls.master_table_name,))]
+            finally:
+                source.close()
+            if len(names) != 1:
+                raise ValueError("Database %r contains tables %r; choose one with the "
+                                 "name keyword." % (filename, names))
+            name = names[0]
+        if not in_memory:
+            return cls(name, dbfile=filename, **kwargs)
+        return cls(name, connection=cls._load_into_memory(filename, rows, progress), **kwargs)
+
+    @classmethod
+    def _load_into_memory(cls, filename, rows=-1, progress=None):
+        """Return a new in-memory connection that holds a copy of *filename*."""
+        connection = sqlite.connect(":memory:",
+                                    detect_types=sqlite.PARSE_DECLTYPES | sqlite.PARSE_COLNAMES)
+        connection.execute("ATTACH DATABASE ? AS __load", (filename,))
+        try:
+            sqlutil.copy_schema(connection, "__load", "main", rows=rows, progress=progress)
+        finally:
+            connection.execute("DETACH DATABASE __load")
+        cls._reset_connection_counter(connection)
+        return connection
+
+    @classmethod
+    def _reset_connection_counter(cls, db):
+        """Set connection counter to 0 in *db* (a connection or a filename)."""
+        connection = sqlite.connect(db) if isinstance(db, basestring) else db
+        try:
+            if connection.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+                                  (cls.master_table_name,)).fetchall():
+                connection.execute("UPDATE %s SET value = 0 WHERE name = 'connection_counter'"
+                                   % cls.master_table_name)
+                connection.commit()
+        finally:
+            if connection is not db:
+                connection.close()
+
+    def set_profile(self, profile):
+        """Apply a performance profile to the connection.
+
+        A profile sets the PRAGMAs listed in :data:`PROFILE_PRAGMAS` together.
+        Profiles can be switched at any time, e.g. "bulkload" while ingesting
+        data and "readheavy" afterwards::
+
+           T = SQLarray('data', records, dbfile='data.db', profile='bulkload')
+           T.merge(more_records)
+           T.set_profile('readheavy')
+
+        Because the settings belong to the connection they also affect all
+        other tables that share it.
+
+        :Arguments:
+           *profile*
+              name of a profile in :data:`PROFILES` or a dict with (a subset
+              of) the PRAGMAs in :data:`PROFILE_PRAGMAS` as keys
+
+        :Returns: dict with the resulting settings (see :meth:`pragmas`)
+
+        :Raises: :exc:`ValueError` for unknown profiles or PRAGMAs
+        """
+        if isinstance(profile, dict):
+            settings, name = dict(profile), 'custom'
+        else:
+            try:
+                settings, name = PROFILES[profile], profile
+            except KeyError:
+                raise ValueError("Unknown profile %r, choose one of %r" %
+                                 (profile, sorted(PROFILES.keys())))
+        unknown = [pragma for pragma in settings if pragma not in PROFILE_PRAGMAS]
+        if unknown:
+            raise ValueError("Only the PRAGMAs %r can be set in a profile, not %r" %
+                             (PROFILE_PRAGMAS, unknown))
+        for pragma, value in settings.items():
+            if not re.match(r'^-?\w+$', str(value)):
+                raise ValueError("Illegal value %r for PRAGMA %s" % (value, pragma))
+        # only change the connection once all settings are known to be valid
+        self.connection.commit()   # journal_mode cannot be changed inside a transaction
+        for pragma in PROFILE_PRAGMAS:
+            if pragma in settings:
+                self.connection.execute("PRAGMA %s = %s" % (pragma, settings[pragma])).fetchall()
+        self.profile = name
+        self.__profile_settings = settings
+        return self.pragmas()
+
+    def pragmas(self):
+        """Return the current values of the profile PRAGMAs as a dict.
+
+        The values are read back from the database so that one can see which
+        settings actually took effect (e.g. an in-memory database always
+        reports ``journal_mode = 'memory'`` and ``mmap_size = None``).
+        """
+        settings = {}
+        for pragma in PROFILE_PRAGMAS:
+            row = self.connection.execute("PRAGMA %s" % pragma).fetchone()
+            settings[pragma] = row[0] if row is not None else None
+        return settings
+
+    def __getstate__(self):
+        """Pickle the table as filename (on-disk) or as a db image (in-memory).
+
+        The image is a SQLite database that only contains this table (with
+        its indices) and not any other tables that share the connection. A
+        temporary table (*is_tmp*) is always pickled as an image and
+        restored as a regular table in memory.
+        """
+        profile = self.profile if self.profile in PROFILES else self.__profile_settings
+        state = {'name': self.name, 'cachesize': self.__cache.capacity,
+                 'profile': profile, 'compression': self.compression}
+        self.connection.commit()
+        if self.dbfile != ":memory:" and not self.is_tmp:
+            state['dbfile'] = self.dbfile
+            return state
+        fd, filename = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        try:
+            self.cursor.execute("ATTACH DATABASE ? AS __image", (filename,))
+            try:
+                sqlutil.copy_schema(self.connection, "temp" if self.is_tmp else "main",
+                                    "__image", tables=[self.name])
+            finally:
+                self.cursor.execute("DETACH DATABASE __image")
+            with open(filename, 'rb') as image:
+                state['image'] = image.read()
+        finally:
+            os.remove(filename)
+        return state
+
+    def __setstate__(self, state):
+        """Restore the table from the state created by :meth:`__getstate__`."""
+        kwargs = {'cachesize': state['cachesize'], 'profile': state['profile'],
+                  'compression': state.get('compression') or None}
+        if 'image' not in state:
+            self.__init__(state['name'], dbfile=state['dbfile'], **kwargs)
+            return
+        fd, filename = tempfile.mkstemp(suffix='.db')
+        try:
+            with os.fdopen(fd, 'wb') as image:
+                image.write(state['image'])
+            connection = self._load_into_memory(filename)
+        finally:
+            os.remove(filename)
+        self.__init__(state['name'], connection=connection, **kwargs)
+
     def merge_table(self,name):
         """Merge an existing table in the database with the __self__ table.
 
@@ -468,6 +871,302 @@ class SQLarray(object):
         (vmin,vmax), = self.SELECT('min(%(variable)s), max(%(variable)s)' % vars())
         return vmin,vmax
 
+    def compute(self, expressions, where=None, parameters=None):
+        """Evaluate element-wise expressions with numpy instead of SQL functions.
+
+        Example::
+
+           r = T.compute({'r': 'sqrt(x**2+y**2)', 'phi': 'periodic(phi)'}, where='x > 0')
+
+        The columns that appear in the expressions are fetched in a single
+        query and the expressions are evaluated on whole arrays, which is
+        much faster than calling Python SQL functions for every row.
+        Expressions that cannot be evaluated with numpy are evaluated by
+        SQLite in the same query. See :func:`recsql.compute.compute` for
+        the details.
+
+        :Returns: :class:`numpy.recarray` with one field per expression
+        """
+        from .compute import compute
+        return compute(self, expressions, where=where, parameters=parameters)
+
+    def groupby(self, keys):
+        """Grouped aggregates computed with numpy instead of SQL ``GROUP BY``.
+
+        Example::
+
+           r = T.groupby('resid').agg({'m': 'median(x)', 'n': 'count(*)'}, where='x > 0')
+
+        The key and value columns are fetched once and all groups are
+        aggregated together with numpy; queries that the numpy engine
+        cannot handle run as SQL ``GROUP BY``. See
+        :class:`recsql.groupby.GroupBy` for the details.
+
+        :Arguments:
+           *keys*
+              column name, comma-separated names or a list of names
+
+        :Returns: :class:`recsql.groupby.GroupBy`; call its
+                  :meth:`~recsql.groupby.GroupBy.agg` method
+        """
+        from .groupby import GroupBy
+        return GroupBy(self, keys)
+
+    @property
+    def data_version(self):
+        """Value that changes whenever the database may have been modified.
+
+        Combines the number of rows changed through this connection
+        (:attr:`sqlite3.Connection.total_changes`) with ``PRAGMA
+        data_version``, which changes when another connection commits to
+        the same database file (if supported by the SQLite library).
+        """
+        try:
+            version = self.connection.execute("PRAGMA data_version").fetchone()
+        except sqlite.DatabaseError:
+            version = None
+        return self.connection.total_changes, version
+
+    def describe(self, columns=None, where=None, parameters=None, threads=None):
+        """Summary statistics of the columns in a single pass over the table.
+
+        Example::
+
+           s = T.describe(['x', 'y'], where='t > 100')
+           print s[s.column == 'x'].median, s[s.column == 'x'].stdev
+
+        All columns are fetched with one query and the statistics in
+        :data:`recsql.sqlfunctions.DESCRIBE_FIELDS` (number of values,
+        mean, standard deviation, extrema and quartiles) are computed with numpy (see
+        :func:`recsql.sqlfunctions.describe`). NULL values are ignored. The
+        last *cachesize* results are cached until the database is modified
+        (see :attr:`data_version`). For a single column in SQL use the
+        aggregate ``describe(x) AS "s [Object]"``.
+
+        :Arguments:
+           *columns*
+              list of column names; by default all columns that contain
+              numbers
+           *where*
+              SQL condition that selects the rows (``WHERE`` is optional)
+           *parameters*
+              values for ``?`` place holders in *where*
+           *threads*
+              compute the moments and extrema of chunks of large columns in
+              parallel threads (see :mod:`recsql.parallel`); the quartiles
+              are computed serially
+
+        :Returns: :class:`numpy.recarray` with one record per column and the
+                  fields ``column`` and :data:`~recsql.sqlfunctions.DESCRIBE_FIELDS`
+        """
+        numeric_only = columns is None
+        if columns is None:
+            columns = self.columns
+        elif isinstance(columns, basestring):
+            columns = [columns]
+        key = (tuple(columns), where, None if parameters is None else tuple(parameters))
+        version = self.data_version
+        try:
+            cached_version, result = self.__summaries[key]
+        except KeyError:
+            pass
+        else:
+            if cached_version == version:
+                return result
+        SQL = "SELECT %s FROM __self__%s" % (", ".join(['"%s"' % column for column in columns]),
+                                             _where_clause(where))
+        rows = self.sql(SQL, parameters=parameters, asrecarray=False, cache=False)
+        values = zip(*rows) if rows else [()] * len(columns)
+        summaries = []
+        for column, v in zip(columns, values):
+            try:
+                v = numpy.array(v, dtype=numpy.float64)
+            except (TypeError, ValueError):
+                if numeric_only:
+                    continue
+                raise ValueError("column %r does not contain numbers" % column)
+            summaries.append((column,) + tuple(sqlfunctions.describe(v, threads=threads)))
+        result = numpy.rec.fromrecords(summaries, names=('column',) + sqlfunctions.DESCRIBE_FIELDS)
+        self.__summaries.append(key, (version, result))
+        return result
+
+    def moving(self, column, window, func='mean', order_by=None, where=None, parameters=None):
+        """Moving mean, standard deviation, median or z-score of a column.
+
+        Example::
+
+           smooth = T.moving('x', 100, order_by='t')
+
+        The value for each row is computed over the *window* rows up to and
+        including this row, as ``moving_mean(x) OVER (ORDER BY t ROWS 99
+        PRECEDING)`` would do in SQL. The column is fetched with one query
+        and the window is moved in Python with the window aggregates (see
+        :func:`recsql.sqlfunctions.moving`), so the cost per row is O(1)
+        (O(log w) for the median) and it works without window functions in
+        the sqlite module. NULL values are ignored.
+
+        :Arguments:
+           *column*
+              column name
+           *window*
+              number of rows in the window
+           *func*
+              "mean", "std" (N-1), "median" or "zscore" ["mean"]
+           *order_by*
+              SQL expression that orders the rows; by default the order in
+              which the rows were inserted (``rowid``) [``None``]
+           *where*
+              SQL condition that selects the rows (``WHERE`` is optional)
+           *parameters*
+              values for ``?`` place holders in *where*
+
+        :Returns: :class:`numpy.ndarray` with one value per selected row
+        """
+        SQL = 'SELECT "%s" FROM __self__%s ORDER BY %s' % (
+            column, _where_clause(where), "rowid" if order_by is None else order_by)
+        rows = self.sql(SQL, parameters=parameters, asrecarray=False, cache=False)
+        return sqlfunctions.moving([v for v, in rows], window, func)
+
+    #: largest number of bins for which :meth:`histogram` counts each bin
+    #: with a range query when the column has an index (each query costs
+    #: about as much as aggregating 5 rows, see ``benchmarks/bench_histogram.py``)
+    histogram_index_bins = 256
+
+    def histogram(self, column, bins=10, range=None, where=None, parameters=None):
+        """Histogram of *column* with *bins* evenly spaced bins (cached).
+
+        Example::
+
+           hist, edges = T.histogram('x', bins=100, range=(-5, 5), where='t > 100')
+
+        The result is the same as :func:`numpy.histogram` of the column (NULL
+        values are ignored). If *column* has an index (see :meth:`sql_index`)
+        then SQLite counts the rows in each bin with the index and no Python
+        code runs for each row, which is more than an order of magnitude
+        faster than the ``histogram()`` aggregate. Histograms are cached per *column*, *where* and
+        *parameters* until the database is modified (see
+        :attr:`data_version`); the last *cachesize* selections and the last
+        *cachesize* histograms of each selection are kept. A histogram with fewer bins over the same
+        range is derived from a cached finer histogram by adding neighbouring
+        bins (if the bin edges coincide) instead of scanning the table again.
+
+        :Arguments:
+           *column*
+              column name
+           *bins*
+              number of bins
+           *range*
+              ``(xmin, xmax)``; by default the minimum and maximum of the
+              selected data
+           *where*
+              SQL condition that selects the rows (``WHERE`` is optional)
+           *parameters*
+              values for ``?`` place holders in *where*
+
+        :Returns: ``(hist, edges)``
+        """
+        bins = int(bins)
+        if bins < 1:
+            raise ValueError("bins must be a positive integer")
+        key = (column, where, None if parameters is None else tuple(parameters))
+        version = self.data_version
+        cache = self.__histograms.get(key)
+        if cache is None or cache['version'] != version:
+            cache = {'version': version, 'limits': None,
+                     'histograms': KRingbuffer(self.__cache.capacity)}
+            self.__histograms.append(key, cache)
+        if range is None:
+            if cache['limits'] is None:
+                cache['limits'] = self._histogram_limits(column, where, parameters)
+            range = cache['limits']
+        range = (float(range[0]), float(range[1]))
+        hist_edges = self._cached_histogram(cache['histograms'], bins, range)
+        if hist_edges is None:
+            hist_edges = self._histogram_scan(column, bins, range, where, tuple(parameters or ()))
+            cache['histograms'].append((bins, range), hist_edges)
+        hist, edges = hist_edges
+        return hist.copy(), edges.copy()
+
+    def _histogram_scan(self, column, bins, range, where, parameters):
+        """Compute the histogram with SQLite.
+
+        With an index on *column* each bin is counted with a range query
+        (:meth:`_histogram_ranges`) so that only O(bins) rows are returned;
+        otherwise the streaming ``histogram()`` aggregate scans the rows.
+        """
+        edges = numpy.histogram([], bins=bins, range=range)[1]   # also checks range
+        if bins <= self.histogram_index_bins and self._has_index(column):
+            hist = self._histogram_ranges(column, edges, where, parameters)
+        else:
+            SQL = 'SELECT histogram(%s, ?, ?, ?) AS "h [Object]" FROM __self__%s' % (
+                _quote(column), _where_clause(where))
+            (hist_edges,), = self.sql(SQL, parameters=(bins,) + range + parameters,
+                                      asrecarray=False, cache=False)
+            if hist_edges is not None:      # NULL if no rows selected
+                hist = hist_edges[0]
+            else:
+                hist = numpy.zeros(bins, dtype=numpy.intp)
+        return hist, edges
+
+    def _histogram_ranges(self, column, edges, where, parameters):
+        """Count the values between the bin edges (fast with an index).
+
+        The (prepared) range query is executed directly with the cursor for
+        each bin, bypassing :meth:`sql` and its cache.
+        """
+        # numpy's bins are [e_i, e_i+1) and the last bin is closed
+        SQL, last = [('SELECT count(*) FROM __self__ WHERE %s >= ? AND %s %s ?' %
+                      (_quote(column), _quote(column), op) + _and_clause(where)).replace('__self__', self.name)
+                     for op in ('<', '<=')]
+        nbins = len(edges) - 1
+        hist = numpy.zeros(nbins, dtype=numpy.intp)
+        c = self.cursor
+        for i in xrange(nbins):
+            c.execute(SQL if i < nbins - 1 else last, (float(edges[i]), float(edges[i+1])) + parameters)
+            hist[i], = c.fetchone()
+        return hist
+
+    def _has_index(self, column):
+        """``True`` if a (complete) index starts with *column*."""
+        for index in self.sql('PRAGMA index_list(%s)' % _quote(self.name), asrecarray=False, cache=False):
+            if len(index) > 4 and index[4]:
+                continue        # partial index
+            info = self.sql('PRAGMA index_info(%s)' % _quote(index[1]), asrecarray=False, cache=False)
+            if info and info[0][2] == column:
+                return True
+        return False
+
+    def _histogram_limits(self, column, where, parameters):
+        """Default histogram range (as :func:`numpy.histogram`)."""
+        SQL = 'SELECT min(%s), max(%s) FROM __self__%s' % (_quote(column), _quote(column), _where_clause(where))
+        (xmin, xmax), = self.sql(SQL, parameters=parameters, asrecarray=False, cache=False)
+        if xmin is None:
+            return 0., 1.
+        if xmin == xmax:
+            return xmin - 0.5, xmax + 0.5
+        return xmin, xmax
+
+    @staticmethod
+    def _cached_histogram(histograms, bins, range):
+        """Return the cached histogram or derive it from a finer one (or ``None``)."""
+        try:
+            return histograms[(bins, range)]
+        except KeyError:
+            pass
+        edges = None
+        for (nbins, xrange), (hist, fine_edges) in sorted(histograms.items()):
+            if xrange != range or nbins % bins != 0:
+                continue
+            if edges is None:
+                edges = numpy.histogram([], bins=bins, range=range)[1]
+            factor = nbins // bins
+            if numpy.all(fine_edges[::factor] == edges):
+                # numpy bins with the edges: identical edges give identical counts
+                result = hist.reshape(bins, factor).sum(axis=1), edges
+                histograms.append((bins, range), result)
+                return result
+        return None
+
     def selection(self, SQL, parameters=None, **kwargs):
         """Return a new SQLarray from a SELECT selection.
 
@@ -551,27 +1250,8 @@ class SQLarray(object):
         return SQLarray(newname, None, dbfile=self.dbfile, connection=self.connection)
 
     def _init_sqlite_functions(self):
-        """additional SQL functions to the database"""
-
-        self.connection.create_function("sqrt", 1,sqlfunctions._sqrt)
-        self.connection.create_function("sqr", 1,sqlfunctions._sqr)
-        self.connection.create_function("periodic", 1,sqlfunctions._periodic)
-        self.connection.create_function("pow", 2,sqlfunctions._pow)
-        self.connection.create_function("match",2,sqlfunctions._match)
-        self.connection.create_function("regexp",2,sqlfunctions._regexp)
-        self.connection.create_function("fformat",2,sqlfunctions._fformat)
-        self.connection.create_aggregate("std",1,sqlfunctions._Stdev)
-        self.connection.create_aggregate("stdN",1,sqlfunctions._StdevN)
-        self.connection.create_aggregate("median",1,sqlfunctions._Median)
-        self.connection.create_aggregate("array",1,sqlfunctions._NumpyArray)
-        self.connection.create_aggregate("histogram",4,sqlfunctions._NumpyHistogram)
-        self.connection.create_aggregate("distribution",4,sqlfunctions._NormedNumpyHistogram)
-        self.connection.create_aggregate("meanhistogram",5,sqlfunctions._MeanHistogram)
-        self.connection.create_aggregate("stdhistogram",5,sqlfunctions._StdHistogram)
-        self.connection.create_aggregate("minhistogram",5,sqlfunctions._MinHistogram)
-        self.connection.create_aggregate("maxhistogram",5,sqlfunctions._MaxHistogram)
-        self.connection.create_aggregate("medianhistogram",5,sqlfunctions._MedianHistogram)
-        self.connection.create_aggregate("zscorehistogram",5,sqlfunctions._ZscoreHistogram)
+        """additional SQL functions to the database (see :func:`recsql.sqlfunctions.register`)"""
+        sqlfunctions.register(self.connection)
 
     def has_table(self, name):
         """Return ``True`` if the table *name* exists in the database."""
@@ -721,6 +1401,7 @@ def SQLarray_fromfile(filename, **kwargs):
             *autoncovert*.
     """
 
+    from . import csv_table, rest_table
     Table2array = {'rst': rest_table.Table2array,
                    'txt': rest_table.Table2array,
                    'csv': csv_table.Table2array,
@@ -14,29 +14,37 @@ can be used in the same way as the builtin functions.
 
 Example:
 
-  Add the functions to an existing connection in the following way (assuming
-  that the db connection is available in ``self.connection``)::
-
-     from sqlfunctions import *
-     self.connection.create_function("sqrt", 1, _sqrt)
-     self.connection.create_function("sqr", 1, _sqr)
-     self.connection.create_function("periodic", 1, _periodic)
-     self.connection.create_function("pow", 2, _pow)
-     self.connection.create_function("match", 2, _match)   # implements MATCH
-     self.connection.create_function("regexp", 2, _regexp) # implements REGEXP
-     self.connection.create_function("fformat",2,_fformat)
-     self.connection.create_aggregate("std",1,_Stdev)
-     self.connection.create_aggregate("stdN",1,_StdevN)
-     self.connection.create_aggregate("median",1,_Median)
-     self.connection.create_aggregate("array",1,_NumpyArray)
-     self.connection.create_aggregate("histogram",4,_NumpyHistogram)
-     self.connection.create_aggregate("distribution",4,_NormedNumpyHistogram)
-     self.connection.create_aggregate("meanhistogram",5,_MeanHistogram)
-     self.connection.create_aggregate("stdhistogram",5,_StdHistogram)
-     self.connection.create_aggregate("minhistogram",5,_MinHistogram)
-     self.connection.create_aggregate("maxhistogram",5,_MaxHistogram)
-     self.connection.create_aggregate("medianhistogram",5,_MedianHistogram)
-     self.connection.create_aggregate("zscorehistogram",5,_ZscoreHistogram)
+  All functions are added to an existing connection with :func:`register`::
+
+     from recsql import sqlfunctions
+     sqlfunctions.register(connection)
+
+  :class:`recsql.SQLarray` does this automatically for all connections that
+  it uses. The functions are listed in the registry that is used by
+  :func:`register` (see the source code); a function or aggregate is added
+  with, for instance, ::
+
+     _FUNCTIONS.append(("sqrt", 1, _sqrt))
+     _AGGREGATES.append(("std", 1, _Stdev))
+
+  REGEXP and MATCH keep a cache of compiled patterns for each connection.
+
+  The Python 2 sqlite module cannot mark functions as deterministic, so
+  the functions cannot be used in expression indexes such as ``CREATE
+  INDEX angle ON t (periodic(phi))``.
+
+.. autofunction:: register
+.. autofunction:: create_window_function
+.. autofunction:: register_aggregate
+.. autoclass:: Moments
+   :members:
+.. autofunction:: quantiles
+.. autofunction:: describe
+.. autodata:: DESCRIBE_FIELDS
+.. autofunction:: moving
+.. autodata:: MOVING
+.. autofunction:: regularized_function
+.. autofunction:: segment_reduce
 
 Module content
 --------------
@@ -44,12 +52,23 @@ Module content
 
 """
 from itertools import izip
+from collections import OrderedDict
 import re
+import array
+import bisect
+import copy
+import heapq
+try:
+    from pysqlite2 import dbapi2 as sqlite
+except ImportError:
+    from sqlite3 import dbapi2 as sqlite
 import numpy
 
 
 from sqlutil import adapt_numpyarray, convert_numpyarray,\
-    adapt_object, convert_object
+    adapt_object, convert_object, adapt_arrays
+from sketches import QuantileSketch, HyperLogLog
+from parallel import map_chunks
 
 
 def _sqrt(x):
@@ -79,176 +98,1072 @@ def _pow(x,y):
         return None
     return numpy.power(x,y)
 
-def _regexp(pattern, string):
-    """string REGEXP pattern == re.search(pattern, string)"""
-    return re.search(unicode(pattern), unicode(string)) != None
+def _regexp_functions(maxsize=256):
+    """Return REGEXP and MATCH functions that share a cache of compiled patterns.
 
-def _match(pattern, string):
-    """string MATCH pattern == re.match(pattern, string)"""
-    return re.match(unicode(pattern), unicode(string)) != None
+    The cache holds the *maxsize* most recently used patterns; the last
+    pattern is checked first because a query typically uses one pattern
+    for all rows.
+    """
+    cache = OrderedDict()
+    last = [None, None]         # pattern, compiled pattern
+    def compiled(pattern):
+        if pattern == last[0] and last[0] is not None:
+            return last[1]
+        try:
+            regex = cache.pop(pattern)
+        except KeyError:
+            regex = re.compile(pattern if isinstance(pattern, basestring) else unicode(pattern))
+            if len(cache) >= maxsize:
+                cache.popitem(last=False)
+        cache[pattern] = regex
+        last[:] = pattern, regex
+        return regex
+    def regexp(pattern, string):
+        """string REGEXP pattern == re.search(pattern, string)"""
+        if not isinstance(string, basestring):
+            string = unicode(string)
+        return compiled(pattern).search(string) is not None
+    def match(pattern, string):
+        """string MATCH pattern == re.match(pattern, string)"""
+        if not isinstance(string, basestring):
+            string = unicode(string)
+        return compiled(pattern).match(string) is not None
+    return regexp, match
+
+_regexp, _match = _regexp_functions()
 
 def _fformat(format,x):
     return unicode(format) % x
 
+# Functions on NumpyArray BLOBs (as produced by array() or stored in
+# NumpyArray columns). Arrays are decoded as read-only views of the BLOB
+# (see sqlutil.convert_numpyarray). Anything that is not a BLOB gives NULL.
+
+def _array(a):
+    """Decode the NumpyArray BLOB *a* as flat array or return ``None``."""
+    if not isinstance(a, (buffer, str)):
+        return None
+    return numpy.ravel(convert_numpyarray(a))
+
+def _array_len(a):
+    a = _array(a)
+    return len(a) if a is not None else None
+
+def _array_sum(a):
+    a = _array(a)
+    return a.sum().item() if a is not None else None
+
+def _array_reduction(reduce):
+    """Reduction that is NULL for empty arrays."""
+    def reduction(a):
+        a = _array(a)
+        if a is None or len(a) == 0:
+            return None
+        return reduce(a).item()
+    return reduction
+
+_array_mean = _array_reduction(numpy.mean)
+_array_min = _array_reduction(numpy.min)
+_array_max = _array_reduction(numpy.max)
+
+def _array_get(a, i):
+    """Element a[i] (negative i count from the end); NULL if out of range."""
+    a = _array(a)
+    if a is None or i is None or not -len(a) <= i < len(a):
+        return None
+    return a[int(i)].item()
+
+def _array_slice(a, start, stop):
+    """Array a[start:stop] (NULL for start/stop means beginning/end)."""
+    a = _array(a)
+    if a is None:
+        return None
+    start = int(start) if start is not None else None
+    stop = int(stop) if stop is not None else None
+    return adapt_numpyarray(a[start:stop])
+
+def _histogram_tuple(h):
+    """Decode a (hist, edges, ...) Object BLOB or return ``None``."""
+    if not isinstance(h, (buffer, str)):
+        return None
+    return convert_object(h)
+
+def _histogram_counts(h):
+    h = _histogram_tuple(h)
+    return adapt_numpyarray(numpy.asarray(h[0])) if h is not None else None
+
+def _histogram_edges(h):
+    h = _histogram_tuple(h)
+    return adapt_numpyarray(numpy.asarray(h[1])) if h is not None else None
+
+def _histogram_total(h):
+    h = _histogram_tuple(h)
+    return numpy.sum(h[0]).item() if h is not None else None
+
+def _histogram_at(h, x):
+    """Value of the bin of histogram *h* that contains *x* (NULL outside)."""
+    h = _histogram_tuple(h)
+    if h is None or x is None:
+        return None
+    hist, edges = numpy.ravel(h[0]), numpy.asarray(h[1])
+    if not edges[0] <= x <= edges[-1]:
+        return None
+    i = min(numpy.searchsorted(edges, x, side='right') - 1, len(hist) - 1)
+    return hist[i].item()
+
+class Moments(object):
+    """Count, mean and sum of squared deviations of a data set.
+
+    The moments are accumulated with the numerically stable pairwise update
+    of Chan et al.: each chunk of data is reduced with numpy and then merged
+    into the running totals. Because partial results can be combined with
+    :meth:`merge`, data can be processed in chunks or in parallel.
+
+    .. attribute:: n
+    .. attribute:: mean
+    .. attribute:: M2
+
+       sum of squared deviations from the mean, sum((x - mean)**2)
+    """
+    def __init__(self, n=0, mean=0.0, M2=0.0):
+        self.n = n
+        self.mean = mean
+        self.M2 = M2
+
+    def update(self, values):
+        """Add all *values* (an array or a sequence of numbers)."""
+        values = numpy.asarray(values, dtype=numpy.float64)
+        if len(values) > 0:
+            mean = values.mean()
+            self.merge(Moments(len(values), mean, numpy.sum((values - mean)**2)))
+        return self
+
+    def merge(self, other):
+        """Combine with the :class:`Moments` *other* (in place)."""
+        n = self.n + other.n
+        if n > 0:
+            delta = other.mean - self.mean
+            self.mean += delta * other.n / n
+            self.M2 += other.M2 + delta * delta * self.n * other.n / n
+            self.n = n
+        return self
+
+    def variance(self, ddof=0):
+        """Variance M2/(n - ddof); 0 if there are not enough data."""
+        if self.n - ddof <= 0:
+            return 0.0
+        return self.M2 / (self.n - ddof)
+
 class _Stdev(object):
     """Implement standard deviation of the sample as SQL aggregate function.
     (Uses N-1 variance.)
-    Do it in one pass (see eg
-    http://smallcode.weblogs.us/2006/11/27/calculate-standard-deviation-in-one-pass/
-    though we may run in an underflow by calculating N/N-1<X^2>-<X>^2>.).
 
-    Also, we don't check if our arguments are valid as numbers.
+    Values are collected in chunks of :attr:`chunksize` that are reduced with
+    numpy and combined with the stable update in :class:`Moments`, so that
+    the result is also correct for data with a large offset and memory use
+    is bounded. Partial aggregates can be combined with :meth:`merge`.
+
+    NULL values are ignored.
     """
+    chunksize = 4096
+    ddof = 1
     def __init__(self):
-        self.x2 = 0
-        self.x = 0
-        self.n = 0
+        self.moments = Moments()
+        self.data = []
+        self.append = self.data.append
     def step(self,x):
-        try:
-            x = float(x)
-            self.x2 += x*x
-            self.x  += x
-            self.n  += 1
-        except TypeError:
-            pass        # don't contribute to average
+        if x is not None:       # don't contribute to average
+            self.append(x)
+            if len(self.data) == self.chunksize:
+                self._flush()
+    def _flush(self):
+        self.moments.update(self.data)
+        del self.data[:]
+    def merge(self, other):
+        """Combine with the partial aggregate *other*."""
+        self._flush()
+        other._flush()
+        self.moments.merge(other.moments)
+        return self
     def finalize(self):
-        if self.n<2: return 0.0
-        return numpy.sqrt((self.n*self.x2 - self.x*self.x)/(self.n*(self.n-1)))
+        self._flush()
+        return numpy.sqrt(self.moments.variance(ddof=self.ddof))
 
 class _StdevN(_Stdev):
     """Implement standard deviation as SQL aggregate function.
-    (Uses N variance.)
-    Do it in one pass (see eg
-    http://smallcode.weblogs.us/2006/11/27/calculate-standard-deviation-in-one-pass/
-    though we may run in an underflow by calculating <X^2>-<X>^2>.).
+    (Uses N variance, sqrt(<(X - <X>)**2>).)
 
-    Also, we don't check if our arguments are valid as numbers.
+    See :class:`_Stdev` for details.
     """
-    def finalize(self):
-        X2 = self.x2/self.n
-        X = self.x/self.n
-        return numpy.sqrt(X2 - X**2)
+    ddof = 0
+
+def quantiles(values, q):
+    """Return the *q* quantiles of *values* (0 <= q <= 1).
+
+    Quantiles are linearly interpolated between data points in the same way
+    as :func:`numpy.percentile` but only the required order statistics are
+    found with the O(n) selection algorithm :func:`numpy.partition`.
+
+    :Arguments:
+       values
+          sequence or array of numbers
+       q
+          quantile or array of quantiles
+
+    :Returns: quantile(s); ``nan`` if there are no values
+    """
+    q = numpy.asarray(q, dtype=numpy.float64)
+    if numpy.any((q < 0) | (q > 1)):
+        raise ValueError("Quantiles must be in the range [0, 1].")
+    values = numpy.asarray(values, dtype=numpy.float64)
+    if len(values) == 0:
+        return numpy.nan * q
+    positions = q * (len(values) - 1)
+    lo = numpy.floor(positions).astype(numpy.intp)
+    hi = numpy.minimum(lo + 1, len(values) - 1)
+    partitioned = numpy.partition(values, numpy.unique(numpy.concatenate((lo.ravel(), hi.ravel()))))
+    return partitioned[lo] + (positions - lo) * (partitioned[hi] - partitioned[lo])
+
+class _Quantile(object):
+    """Exact quantile quantile(x, q) of the data, 0 <= q <= 1.
 
-class _Median(object):
+    Values are stored in a compact typed buffer (8 bytes per value) and
+    the quantile is computed with :func:`quantiles`. NULL values are
+    ignored.
+    """
     def __init__(self):
-        self.data = []
-    def step(self,x):
+        self.data = array.array('d')
+        self.q = None
+    def _append(self, x):
         try:
-            x = float(x)
             self.data.append(x)
         except TypeError:
-            pass        # don't contribute
+            try:
+                self.data.append(float(x))      # e.g. numbers stored as TEXT
+            except TypeError:
+                pass        # don't contribute
+    def step(self, x, q):
+        if self.q is None:
+            self.q = q
+        self._append(x)
     def finalize(self):
-        return numpy.median(self.data)
+        return float(quantiles(numpy.frombuffer(self.data), self.q))
 
-class _NumpyArray(object):
+class _Percentile(_Quantile):
+    """Exact percentile percentile(x, p) of the data, 0 <= p <= 100."""
+    def step(self, x, p):
+        if self.q is None:
+            self.q = p/100.
+        self._append(x)
+
+class _Median(_Quantile):
+    """Exact median of the data (see :func:`numpy.median`)."""
+    def step(self, x):
+        self._append(x)
+    def finalize(self):
+        return float(quantiles(numpy.frombuffer(self.data), 0.5))
+
+class _IQR(_Median):
+    """Exact interquartile range of the data, Q(0.75) - Q(0.25)."""
+    def finalize(self):
+        q25, q75 = quantiles(numpy.frombuffer(self.data), [0.25, 0.75])
+        return q75 - q25
+
+# Window aggregates: besides step() and finalize() they implement inverse()
+# (remove a value that left the window frame) and value() (result for the
+# current frame) so that a moving window costs O(1) or O(log w) per row.
+
+class _MovingMean(object):
+    """Moving mean moving_mean(x) as a window aggregate.
+
+    Count, mean and sum of squared deviations are updated when a value
+    enters (:meth:`step`) or leaves (:meth:`inverse`) the window, which
+    costs O(1) per row. NULL values are ignored.
+    """
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.M2 = 0.0
+        self.last = None
+    def step(self, x):
+        self.last = x
+        if x is None:
+            return
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.M2 += delta * (x - self.mean)
+    def inverse(self, x):
+        if x is None:
+            return
+        if self.n <= 1:
+            self.__init__()
+            return
+        self.n -= 1
+        delta = x - self.mean
+        self.mean -= delta / self.n
+        self.M2 = max(self.M2 - delta * (x - self.mean), 0.0)
+    def value(self):
+        return self.mean if self.n > 0 else None
+    def finalize(self):
+        return self.value()
+
+class _MovingStd(_MovingMean):
+    """Moving standard deviation moving_std(x) (N-1 variance) as a window aggregate."""
+    def _std(self):
+        return numpy.sqrt(self.M2 / (self.n - 1)) if self.n > 1 else 0.0
+    def value(self):
+        return self._std() if self.n > 0 else None
+
+class _MovingZscore(_MovingStd):
+    """Moving z-score moving_zscore(x) = (x - <x>)/std(x) as a window aggregate.
+
+    *x* is the value that was added last, i.e. the current row for frames
+    such as ``ROWS BETWEEN 100 PRECEDING AND CURRENT ROW``; mean and
+    standard deviation (N-1) are taken over the frame. 0 if the standard
+    deviation is 0; NULL if the current row is NULL.
+    """
+    def value(self):
+        if self.n == 0 or self.last is None:
+            return None
+        std = self._std()
+        return (self.last - self.mean) / std if std > 0 else 0.0
+
+class _MovingMedian(object):
+    """Moving median moving_median(x) as a window aggregate.
+
+    The values in the window are kept sorted; adding and removing a value
+    needs O(log w) comparisons (plus a memory move) for a window of w
+    values. NULL values are ignored.
+    """
     def __init__(self):
         self.data = []
-    def step(self,x):
-        self.data.append(x)
+    def step(self, x):
+        if x is not None:
+            bisect.insort(self.data, x)
+    def inverse(self, x):
+        if x is not None:
+            del self.data[bisect.bisect_left(self.data, x)]
+    def value(self):
+        n = len(self.data)
+        if n == 0:
+            return None
+        return 0.5 * (self.data[(n - 1) // 2] + self.data[n // 2])
+    def finalize(self):
+        return self.value()
+
+#: window aggregates for :func:`moving` by name
+MOVING = OrderedDict([('mean', _MovingMean), ('std', _MovingStd),
+                      ('median', _MovingMedian), ('zscore', _MovingZscore)])
+
+def moving(values, window, func='mean'):
+    """Moving *func* over the last *window* values (including the current one).
+
+    The result for value *i* is the same as ``moving_<func>(x) OVER
+    (ROWS window-1 PRECEDING)`` in SQL; it is computed in Python with the
+    window aggregates (one :meth:`step` and one :meth:`inverse` per value,
+    i.e. O(1) or O(log w) per value) so that it also works with sqlite
+    modules that lack window functions. NULL/``None`` values are ignored.
+
+    :Arguments:
+       *values*
+          sequence of numbers in window order
+       *window*
+          number of values in the window (>= 1)
+       *func*
+          "mean", "std", "median" or "zscore" (see :data:`MOVING`)
+
+    :Returns: :class:`numpy.ndarray`; NaN where the window contains no values
+    """
+    try:
+        agg = MOVING[func]()
+    except KeyError:
+        raise ValueError("func must be one of %r, not %r" % (MOVING.keys(), func))
+    window = int(window)
+    if window < 1:
+        raise ValueError("window must be at least 1")
+    if isinstance(values, numpy.ndarray):
+        values = values.tolist()
+    result = numpy.empty(len(values))
+    for i, x in enumerate(values):
+        agg.step(x)
+        if i >= window:
+            agg.inverse(values[i - window])
+        v = agg.value()
+        result[i] = v if v is not None else numpy.nan
+    return result
+
+class _ApproxQuantile(object):
+    """Approximate quantile approx_quantile(x, q[, k]) of the data.
+
+    Uses a :class:`recsql.sketches.QuantileSketch` with compactor size *k*
+    [1024], i.e. bounded memory of about ``k*log2(n/k)`` values and a
+    guaranteed rank error (see the sketch for details). Partial aggregates
+    can be combined with :meth:`merge`.
+    """
+    def __init__(self):
+        self.sketch = None
+        self.q = None
+    def _update(self, x, k):
+        if self.sketch is None:
+            self.sketch = QuantileSketch(k)
+        if x is not None:
+            self.sketch.update(x)
+    def step(self, x, q, k=1024):
+        if self.q is None:
+            self.q = q
+        self._update(x, k)
+    def merge(self, other):
+        """Combine with the partial aggregate *other* (in place)."""
+        if self.q is None:
+            self.q = other.q
+        if other.sketch is None:
+            return self
+        if self.sketch is None:
+            self.sketch = copy.deepcopy(other.sketch)
+        else:
+            self.sketch.merge(other.sketch)
+        return self
+    def finalize(self):
+        return float(self.sketch.quantile(self.q))
+
+class _ApproxPercentile(_ApproxQuantile):
+    """Approximate percentile approx_percentile(x, p[, k]), 0 <= p <= 100."""
+    def step(self, x, p, k=1024):
+        if self.q is None:
+            self.q = p/100.
+        self._update(x, k)
+
+class _ApproxIQR(_ApproxQuantile):
+    """Approximate interquartile range approx_iqr(x[, k])."""
+    def step(self, x, k=1024):
+        self._update(x, k)
+    def finalize(self):
+        q25, q75 = self.sketch.quantile([0.25, 0.75])
+        return q75 - q25
+
+class _QuantileSketch(_ApproxQuantile):
+    """The :class:`recsql.sketches.QuantileSketch` quantilesketch(x[, k]) as an Object."""
+    def step(self, x, k=1024):
+        self._update(x, k)
     def finalize(self):
-        return adapt_numpyarray(numpy.array(self.data))
+        return adapt_object(self.sketch)
+
+class _ApproxCountDistinct(object):
+    """Approximate number of distinct values approx_count_distinct(x[, p]).
+
+    Uses a :class:`recsql.sketches.HyperLogLog` sketch with precision *p*
+    [12], i.e. ``2**p`` bytes per group and a relative standard error of
+    ``1.04/sqrt(2**p)`` (1.6% for the default). NULL values are ignored.
+    """
+    def __init__(self):
+        self.sketch = None
+    def step(self, x, p=12):
+        if self.sketch is None:
+            self.sketch = HyperLogLog(p)
+        if x is not None:
+            self.sketch.update(x)
+    def merge(self, other):
+        """Combine with the partial aggregate *other* (in place)."""
+        if other.sketch is None:
+            return self
+        if self.sketch is None:
+            self.sketch = copy.deepcopy(other.sketch)
+        else:
+            self.sketch.merge(other.sketch)
+        return self
+    def finalize(self):
+        return self.sketch.count() if self.sketch is not None else 0
+
+class _HyperLogLog(_ApproxCountDistinct):
+    """The :class:`recsql.sketches.HyperLogLog` sketch hllsketch(x[, p]) as an Object."""
+    def finalize(self):
+        return adapt_object(self.sketch if self.sketch is not None else HyperLogLog())
+
+class _HyperLogLogUnion(object):
+    """Merge of the HyperLogLog Object BLOBs hllsketch_union(s) as an Object.
+
+    Combines sketches of groups, shards or time partitions (all with the
+    same precision); NULL entries are ignored.
+    """
+    def __init__(self):
+        self.sketch = None
+    def step(self, s):
+        if not isinstance(s, (buffer, str)):
+            return
+        sketch = convert_object(s)
+        if self.sketch is None:
+            self.sketch = sketch
+        else:
+            self.sketch.merge(sketch)
+    def finalize(self):
+        return adapt_object(self.sketch) if self.sketch is not None else None
+
+def _hllsketch_count(s):
+    """Distinct count hllsketch_count(s) of a HyperLogLog Object BLOB."""
+    if not isinstance(s, (buffer, str)):
+        return None
+    return convert_object(s).count()
+
+#: fields of the summary record of :func:`describe`: number of values,
+#: mean, standard deviation, minimum, quartiles and maximum (the names avoid
+#: the :class:`numpy.recarray` methods such as ``mean()`` and ``count()``)
+DESCRIBE_FIELDS = ('n', 'avg', 'stdev', 'xmin', 'q25', 'median', 'q75', 'xmax')
+
+def describe(values, threads=None):
+    """Return the summary statistics :data:`DESCRIBE_FIELDS` of *values*.
+
+    All statistics are computed from one array: n, mean and std (N-1
+    variance, 0 for a single value as for ``std()``) with :class:`Moments`,
+    the extrema and the quartiles (as :func:`quantiles`) from a single
+    :func:`numpy.partition`. Only the moments and extrema of chunks of the
+    data are computed in parallel by *threads* (see :mod:`recsql.parallel`);
+    the partition for the quartiles always runs over all values in the
+    calling thread. NaN values are ignored.
+
+    :Returns: :class:`numpy.record` with the fields in :data:`DESCRIBE_FIELDS`;
+              the statistics are NaN if there are no values
+    """
+    values = numpy.asarray(values, dtype=numpy.float64)
+    values = values[~numpy.isnan(values)]
+    n = len(values)
+    if n == 0:
+        stats = (0,) + (numpy.nan,) * (len(DESCRIBE_FIELDS) - 1)
+    else:
+        partial = map_chunks(lambda v: (Moments().update(v), v.min(), v.max()), [values], threads)
+        moments = reduce(Moments.merge, [p[0] for p in partial])
+        q25, median, q75 = quantiles(values, [0.25, 0.5, 0.75])
+        stats = (n, moments.mean, numpy.sqrt(moments.variance(ddof=1)),
+                 min([p[1] for p in partial]), q25, median, q75, max([p[2] for p in partial]))
+    return numpy.rec.fromrecords([stats], names=DESCRIBE_FIELDS)[0]
+
+class _Describe(_Median):
+    """Summary statistics describe(x) of the data (see :func:`describe`).
+
+    Values are stored in a compact typed buffer (8 bytes per value) so that
+    all statistics are computed in a single pass over the rows. NULL values
+    are ignored.
+    """
+    def finalize(self):
+        return adapt_object(describe(numpy.frombuffer(self.data)))
+
+#: :mod:`array` typecodes that can hold the values of the array() aggregate
+_ARRAY_TYPECODES = 'bBhHiIlLfd'
+
+class _NumpyArray(object):
+    """All values array(x[, dtype]) as a numpy array.
+
+    Values are appended to a compact typed buffer (:mod:`array`) whose
+    type is given by *dtype* (e.g. 'f4' or 'int32') or detected from the
+    first value (integers as :class:`numpy.int_`, numbers as float64); an
+    integer buffer is converted to float64 when the first float arrives.
+    Data that do not fit (NULL, strings, huge integers) are collected in a
+    list and converted with :func:`numpy.array` as before. The result is
+    emitted directly as a binary array BLOB.
+    """
+    def __init__(self):
+        self.data = None
+        self.dtype = None
+        self.step = self._step_first    # instance attribute: replaced by _step
+    def _step_first(self, x, dtype=None):
+        self._initialize(x, dtype)
+        self.step = self._step
+        self._step(x)
+    def _step(self, x, dtype=None):
+        try:
+            self._append(x)
+        except (TypeError, OverflowError):
+            self._promote(x)
+    def _initialize(self, x, dtype):
+        if dtype is not None:
+            self.dtype = numpy.dtype(str(dtype))
+            typecode = self.dtype.char
+        elif isinstance(x, float):
+            typecode = 'd'
+        elif isinstance(x, (int, long)) and not isinstance(x, bool):
+            typecode = numpy.dtype(numpy.int_).char
+        else:
+            typecode = None
+        if typecode is not None and typecode in _ARRAY_TYPECODES:
+            self.data = array.array(typecode)
+        else:
+            self.data = []
+        self._append = self.data.append
+    def _promote(self, x):
+        if self.dtype is None and self.data.typecode != 'd' and isinstance(x, float):
+            self.data = array.array('d', self.data)         # int -> float
+        else:
+            self.data = self.data.tolist()                  # fall back to a list
+        self._append = self.data.append
+        self._append(x)
+    def finalize(self):
+        if isinstance(self.data, array.array):
+            a = numpy.frombuffer(self.data, dtype=self.data.typecode) if len(self.data) \
+                else numpy.zeros(0, dtype=self.data.typecode)
+            if self.dtype is not None and a.dtype != self.dtype:
+                a = a.astype(self.dtype)                    # e.g. byte order
+        else:
+            a = numpy.array(self.data if self.data is not None else [], dtype=self.dtype)
+        return adapt_numpyarray(a)
+
+def _sort_key(x):
+    """Key that orders values as SQLite does: numbers < TEXT < BLOB."""
+    if isinstance(x, (int, long, float)):
+        return (0, x)
+    elif isinstance(x, basestring):
+        return (1, x)
+    return (2, str(x))          # BLOB (buffer)
+
+class _Reversed(object):
+    """Key with the reversed order of *key* (min-heap of the smallest values)."""
+    __slots__ = ('key',)
+    def __init__(self, key):
+        self.key = key
+    def __lt__(self, other):
+        return other.key < self.key
+    def __eq__(self, other):
+        return self.key == other.key
+    def __ne__(self, other):
+        return self.key != other.key
+
+class _TopK(object):
+    """The k largest values topk(x, k) in descending order.
+
+    A bounded heap of the k best rows is kept (O(k) memory); most rows
+    only cost a comparison with the smallest kept value. Of equal values
+    the earliest rows are kept. NULL values are ignored. Values of
+    different types are ordered as by SQLite (numbers < TEXT < BLOB). The
+    result is an array BLOB (an object array for mixed types).
+    """
+    reverse = False
+    def __init__(self):
+        self.heap = []
+        self.n = 0
+        self.k = None
+        self.threshold = None
+    def _push(self, key, value):
+        self.n += 1
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, (key, -self.n, value))
+            if len(self.heap) == self.k:
+                self.threshold = self.heap[0][0]
+        elif key > self.threshold:
+            heapq.heapreplace(self.heap, (key, -self.n, value))
+            self.threshold = self.heap[0][0]
+    def step(self, x, k):
+        if self.k is None:
+            self.k = max(int(k), 0)
+        if x is not None and self.k > 0:
+            self._push(self._key(x), x)
+    def _key(self, x):
+        key = _sort_key(x)
+        return _Reversed(key) if self.reverse else key
+    def finalize(self):
+        ordered = sorted(self.heap, reverse=True)     # best first, ties: earliest first
+        values = [value for key, n, value in ordered]
+        mixed = len(set([_sort_key(v)[0] for v in values])) > 1
+        return adapt_numpyarray(numpy.array(values, dtype=object if mixed else None))
+
+class _BottomK(_TopK):
+    """The k smallest values bottomk(x, k) in ascending order (see :class:`_TopK`)."""
+    reverse = True
+
+class _ArgTopK(_TopK):
+    """The ids of the rows with the k largest values argtopk(id, x, k) (see :class:`_TopK`).
+
+    The ids are ordered by descending x.
+    """
+    def step(self, id, x, k):
+        if self.k is None:
+            self.k = max(int(k), 0)
+        if x is not None and self.k > 0:
+            self._push(self._key(x), id)
+
+class _ArgBottomK(_ArgTopK):
+    """The ids of the rows with the k smallest values argbottomk(id, x, k)."""
+    reverse = True
 
 class _NumpyHistogram(object):
+    """Histogram histogram(x, nbins, xmin, xmax) in evenly spaced bins.
+
+    The histogram is accumulated while streaming: values are collected in
+    chunks of :attr:`chunksize` that are binned with :func:`numpy.histogram`
+    and only the counts are kept, so memory use is O(nbins) independent of
+    the number of rows. The result is the same as :func:`numpy.histogram`
+    for all data. Partial aggregates can be combined with :meth:`merge`.
+
+    NULL values are ignored.
+    """
+    chunksize = 65536
     def __init__(self):
         self.is_initialized = False
         self.data = []
     def step(self,x,bins,xmin,xmax):
         if not self.is_initialized:
-            self.bins = bins
-            self.range = (xmin,xmax)
-            self.is_initialized = True
-        self.data.append(x)
+            self._initialize(bins,xmin,xmax)
+        if x is not None:
+            self.data.append(x)
+            if len(self.data) == self.chunksize:
+                self._flush()
+    def _initialize(self,bins,xmin,xmax):
+        self.bins = bins
+        self.range = (xmin,xmax)
+        self.hist,self.edges = numpy.histogram([],bins=self.bins,range=self.range)
+        self.is_initialized = True
+    def _flush(self):
+        if self.data:
+            hist,edges = numpy.histogram(numpy.asarray(self.data,dtype=numpy.float64),
+                                         bins=self.bins,range=self.range)
+            self.hist += hist
+            del self.data[:]
+    def merge(self, other):
+        """Combine with the partial aggregate *other* (same bins and range)."""
+        self._flush()
+        other._flush()
+        self.hist += other.hist
+        return self
+    def _histogram(self):
+        self._flush()
+        return self.hist
     def finalize(self):
-        hist,edges = numpy.histogram1d(self.data,bins=self.bins,range=self.range,
-                                       normed=False)
-        return adapt_object((hist,edges))
+        if not self.is_initialized:
+            return None         # no rows: NULL
+        return adapt_arrays((self._histogram(),self.edges))
 
 class _NormedNumpyHistogram(_NumpyHistogram):
+    """Normalized histogram distribution(x, nbins, xmin, xmax) whose integral is 1."""
+    def _histogram(self):
+        hist = _NumpyHistogram._histogram(self)
+        return hist / (float(hist.sum()) * numpy.diff(self.edges))
+
+class _WeightedNumpyHistogram(_NumpyHistogram):
+    """Weighted histogram whistogram(x, w, nbins, xmin, xmax).
+
+    Each bin contains the sum of the weights w of its values x (as
+    :func:`numpy.histogram` with *weights*). Streaming like
+    :class:`_NumpyHistogram`; rows where x or w is NULL are ignored.
+    """
+    def __init__(self):
+        _NumpyHistogram.__init__(self)
+        self.weights = []
+    def step(self,x,w,bins,xmin,xmax):
+        if not self.is_initialized:
+            self._initialize(bins,xmin,xmax)
+        if x is not None and w is not None:
+            self.data.append(x)
+            self.weights.append(w)
+            if len(self.data) == self.chunksize:
+                self._flush()
+    def _initialize(self,bins,xmin,xmax):
+        _NumpyHistogram._initialize(self,bins,xmin,xmax)
+        self.hist = self.hist.astype(numpy.float64)
+    def _flush(self):
+        if self.data:
+            hist,edges = numpy.histogram(numpy.asarray(self.data,dtype=numpy.float64),
+                                         bins=self.bins,range=self.range,
+                                         weights=numpy.asarray(self.weights,dtype=numpy.float64))
+            self.hist += hist
+            del self.data[:]
+            del self.weights[:]
+
+class _WeightedMeanHistogram(_WeightedNumpyHistogram):
+    """Weighted mean wmeanhistogram(x, y, w, nbins, xmin, xmax) of y in each bin.
+
+    Only sum(w) and sum(w*y) are accumulated for each bin, so memory use is
+    O(nbins). The result is sum(w*y)/sum(w) (NaN for empty bins). Rows
+    where x, y or w is NULL are ignored.
+    """
+    def __init__(self):
+        _WeightedNumpyHistogram.__init__(self)
+        self.y = []
+    def step(self,x,y,w,bins,xmin,xmax):
+        if not self.is_initialized:
+            self._initialize(bins,xmin,xmax)
+        if x is not None and y is not None and w is not None:
+            self.data.append(x)
+            self.y.append(y)
+            self.weights.append(w)
+            if len(self.data) == self.chunksize:
+                self._flush()
+    def _initialize(self,bins,xmin,xmax):
+        _WeightedNumpyHistogram._initialize(self,bins,xmin,xmax)
+        self.wysum = self.hist.copy()
+    def _flush(self):
+        if self.data:
+            x = numpy.asarray(self.data,dtype=numpy.float64)
+            w = numpy.asarray(self.weights,dtype=numpy.float64)
+            wy = w * numpy.asarray(self.y,dtype=numpy.float64)
+            self.hist += numpy.histogram(x,bins=self.bins,range=self.range,weights=w)[0]
+            self.wysum += numpy.histogram(x,bins=self.bins,range=self.range,weights=wy)[0]
+            del self.data[:]
+            del self.y[:]
+            del self.weights[:]
+    def merge(self, other):
+        """Combine with the partial aggregate *other* (same bins and range)."""
+        _WeightedNumpyHistogram.merge(self, other)
+        self.wysum += other.wysum
+        return self
+    def _histogram(self):
+        self._flush()
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            return self.wysum / self.hist
+
+class _NumpyHistogram2D(object):
+    """2D histogram histogram2d(x, y, nx, xmin, xmax, ny, ymin, ymax).
+
+    Works like :class:`_NumpyHistogram` for pairs of values: chunks are
+    binned with :func:`numpy.histogram2d` and only the nx x ny counts are
+    kept. The result is ``(H, xedges, yedges)`` as from
+    :func:`numpy.histogram2d`; H[i,j] counts the pairs with x in bin i and y
+    in bin j.
+
+    Rows where x or y is NULL are ignored.
+    """
+    chunksize = 65536
+    def __init__(self):
+        self.is_initialized = False
+        self.x = []
+        self.y = []
+    def step(self,x,y,nx,xmin,xmax,ny,ymin,ymax):
+        if not self.is_initialized:
+            self._initialize(nx,xmin,xmax,ny,ymin,ymax)
+        if x is not None and y is not None:
+            self.x.append(x)
+            self.y.append(y)
+            if len(self.x) == self.chunksize:
+                self._flush()
+    def _initialize(self,nx,xmin,xmax,ny,ymin,ymax):
+        self.bins = (nx,ny)
+        self.range = [(xmin,xmax),(ymin,ymax)]
+        self.hist,self.xedges,self.yedges = numpy.histogram2d([],[],bins=self.bins,range=self.range)
+        self.is_initialized = True
+    def _flush(self):
+        if self.x:
+            hist,xedges,yedges = numpy.histogram2d(numpy.asarray(self.x,dtype=numpy.float64),
+                                                   numpy.asarray(self.y,dtype=numpy.float64),
+                                                   bins=self.bins,range=self.range)
+            self.hist += hist
+            del self.x[:]
+            del self.y[:]
+    def merge(self, other):
+        """Combine with the partial aggregate *other* (same bins and ranges)."""
+        self._flush()
+        other._flush()
+        self.hist += other.hist
+        return self
+    def _histogram(self):
+        self._flush()
+        return self.hist
     def finalize(self):
-        hist,edges = numpy.histogram1d(self.data,bins=self.bins,range=self.range,
-                                       normed=True)
-        return adapt_object((hist,edges))
+        return adapt_arrays((self._histogram(),self.xedges,self.yedges))
 
-class _FunctionHistogram(_NumpyHistogram):
+class _NormedNumpyHistogram2D(_NumpyHistogram2D):
+    """Normalized 2D histogram distribution2d(x, y, nx, xmin, xmax, ny, ymin, ymax).
+
+    The integral over both dimensions is 1.
+    """
+    def _histogram(self):
+        hist = _NumpyHistogram2D._histogram(self)
+        area = numpy.outer(numpy.diff(self.xedges), numpy.diff(self.yedges))
+        return hist / (float(hist.sum()) * area)
+
+class _FunctionHistogram(object):
     """Baseclass for histogrammed functions.
 
     A histogrammed function is created by applying a function
-    to all values y that have been accumulated in a bin x.
+    to all values y that have been accumulated in a bin x. Rows where x
+    or y is NULL are ignored.
     """
     def __init__(self):
-        _NumpyHistogram.__init__(self)
+        self.is_initialized = False
+        self.data = []
         self.y = []
     def step(self,x,y,bins,xmin,xmax):
-        _NumpyHistogram.step(self,x,bins,xmin,xmax)
-        self.y.append(y)
+        if not self.is_initialized:
+            self.bins = bins
+            self.range = (xmin,xmax)
+            self.is_initialized = True
+        if x is not None and y is not None:
+            self.data.append(x)
+            self.y.append(y)
     def finalize(self):
         raise NotImplementedError("_FunctionHistogram must be inherited from.")
-        # return adapt_object( (...,...,...) )
+        # return adapt_arrays( (...,...,...) )
 
 class _MeanHistogram(_FunctionHistogram):
     """Mean of the weights in each bin.
     Takes TWO column arguments: value and weight"""
     def finalize(self):
-        return adapt_object(regularized_function(\
-                self.data,self.y,numpy.mean,bins=self.bins,range=self.range))
+        return adapt_arrays(regularized_function(\
+                self.data,self.y,'mean',bins=self.bins,range=self.range))
 
 class _StdHistogram(_FunctionHistogram):
     """Standard deviation of the weights in each bin.
     Takes TWO column arguments: value and weight"""
     def finalize(self):
-        return adapt_object(regularized_function(\
-                self.data,self.y,numpy.std,bins=self.bins,range=self.range))
+        return adapt_arrays(regularized_function(\
+                self.data,self.y,'std',bins=self.bins,range=self.range))
 
 class _MinHistogram(_FunctionHistogram):
-    """Min value of the weights in each bin.
+    """Min value of the weights in each bin (NaN for empty bins).
     Takes TWO column arguments: value and weight"""
-    def _min(self,v):
-        try:
-            return numpy.min(v)
-        except ValueError:  # empty array
-            return numpy.nan
-
     def finalize(self):
-        return adapt_object(regularized_function(\
-                self.data,self.y,self._min,bins=self.bins,range=self.range))
+        return adapt_arrays(regularized_function(\
+                self.data,self.y,'min',bins=self.bins,range=self.range))
 
 class _MaxHistogram(_FunctionHistogram):
-    """Max value of the weights in each bin.
+    """Max value of the weights in each bin (NaN for empty bins).
     Takes TWO column arguments: value and weight"""
-    def _max(self,v):
-        try:
-            return numpy.max(v)
-        except ValueError:  # empty array
-            return numpy.nan
-
     def finalize(self):
-        return adapt_object(regularized_function(\
-                self.data,self.y,self._max,bins=self.bins,range=self.range))
+        return adapt_arrays(regularized_function(\
+                self.data,self.y,'max',bins=self.bins,range=self.range))
 
 class _MedianHistogram(_FunctionHistogram):
     """Median value of the weights in each bin.
     Takes TWO column arguments: value and weight"""
     def finalize(self):
-        return adapt_object(regularized_function(\
-                self.data,self.y,numpy.median,bins=self.bins,range=self.range))
+        return adapt_arrays(regularized_function(\
+                self.data,self.y,'median',bins=self.bins,range=self.range))
 
 class _ZscoreHistogram(_FunctionHistogram):
-    """Z-score of the weights in each bin abs(Y - <Y>)/std(Y).
+    """Z-score of the weights in each bin <abs(Y - <Y>)>/std(Y).
     Takes TWO column arguments: value and weight"""
-    def Zscore(self,v):
-        m = v.mean()
-        s = v.std()
-        return numpy.nan_to_num( numpy.mean(numpy.abs(v - m))/s )
-
     def finalize(self):
-        return adapt_object(\
-            regularized_function(self.data,self.y,self.Zscore,bins=self.bins,range=self.range))
+        return adapt_arrays(\
+            regularized_function(self.data,self.y,'zscore',bins=self.bins,range=self.range))
 
 
 # Helper functions
 
-def regularized_function(x,y,func,bins=None,range=None):
+#: reductions that are implemented in :func:`segment_reduce`
+_REDUCTION_NAMES = ('count', 'sum', 'mean', 'std', 'min', 'max', 'median', 'zscore')
+
+#: functions that are recognized by :func:`segment_reduce` as one of the
+#: :data:`_REDUCTION_NAMES`
+_REDUCTIONS = {len: 'count',
+               sum: 'sum', numpy.sum: 'sum',
+               numpy.mean: 'mean',
+               numpy.std: 'std',
+               min: 'min', numpy.min: 'min',
+               max: 'max', numpy.max: 'max',
+               numpy.median: 'median',
+               }
+
+def _reduction_name(func):
+    """Name of the vectorized reduction for *func* or ``None``."""
+    try:
+        return func if func in _REDUCTION_NAMES else _REDUCTIONS.get(func)
+    except TypeError:       # unhashable callable
+        return None
+
+def _label_reduce(name, values, labels, nseg, threads=None):
+    """Reduction *name* of *values* grouped by integer *labels* < *nseg*.
+
+    The values do not have to be ordered by label except for 'median'.
+    Except for the median, partial results for chunks of the data can be
+    computed by *threads* (see :func:`recsql.parallel.map_chunks`).
+    """
+    def binsum(weights):
+        partial = map_chunks(lambda l, w: numpy.bincount(l, weights=w, minlength=nseg),
+                             [labels, weights], threads)
+        return numpy.sum(partial, axis=0).astype(numpy.float64)
+    counts = numpy.sum(map_chunks(lambda l: numpy.bincount(l, minlength=nseg), [labels], threads),
+                       axis=0)
+    if name == 'count':
+        return counts.astype(numpy.float64)
+    if name == 'sum':
+        return binsum(values)
+    nonempty = counts > 0
+    F = numpy.empty(nseg)
+    F.fill(numpy.nan)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        if name in ('mean', 'std', 'zscore'):
+            n = counts.astype(numpy.float64)
+            mean = binsum(values) / n
+            if name == 'mean':
+                return mean
+            deviations = values - mean[labels]
+            std = numpy.sqrt(binsum(deviations**2) / n)
+            if name == 'std':
+                return std
+            return numpy.nan_to_num(binsum(numpy.abs(deviations)) / n / std)
+    if name in ('min', 'max'):
+        ufunc, initial = {'min': (numpy.minimum, numpy.inf), 'max': (numpy.maximum, -numpy.inf)}[name]
+        def extremum(l, v):
+            E = numpy.empty(nseg)
+            E.fill(initial)
+            ufunc.at(E, l, v)
+            return E
+        F[nonempty] = ufunc.reduce(map_chunks(extremum, [labels, values], threads))[nonempty]
+    elif name == 'median':
+        starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+        ordered = values[numpy.lexsort((values, labels))]
+        lo = (starts + (counts - 1) // 2)[nonempty]
+        hi = (starts + counts // 2)[nonempty]
+        F[nonempty] = 0.5 * (ordered[lo] + ordered[hi])
+    return F
+
+def segment_reduce(func, values, counts):
+    """Apply a reduction to consecutive segments of *values*, vectorized.
+
+    The first ``counts[0]`` values form the first segment, the next
+    ``counts[1]`` values the second, and so on. Instead of calling *func*
+    for each segment the result is computed for all segments at once with
+    :func:`numpy.bincount` and :meth:`numpy.ufunc.at`.
+
+    :Arguments:
+       func
+          a reduction: one of the names 'count', 'sum', 'mean', 'std' (N
+          variance), 'min', 'max', 'median', 'zscore'
+          (<abs(Y - <Y>)>/std(Y)) or the corresponding python/numpy function
+          (e.g. :func:`numpy.mean`)
+       values
+          array of values, ordered by segment
+       counts
+          number of values in each segment
+
+    :Returns: array with one result per segment; empty segments give 0 for
+              'count', 'sum' and 'zscore' and NaN otherwise
+
+    :Raises: :exc:`KeyError` if *func* has no vectorized implementation
+    """
+    name = _reduction_name(func)
+    if name is None:
+        raise KeyError(func)
+    values = numpy.asarray(values, dtype=numpy.float64)
+    counts = numpy.asarray(counts, dtype=numpy.intp)
+    labels = numpy.repeat(numpy.arange(len(counts)), counts)
+    return _label_reduce(name, values, labels, len(counts))
+
+def _bin_labels(x, bins, uniform=False, threads=None):
+    """Bin number of each value in *x* and the mask of values inside *bins*.
+
+    Bins are half-open ``[bins[i], bins[i+1])`` except for the last one,
+    which includes its right edge. For *uniform* bins the bin number is
+    computed arithmetically and corrected at the edges (as in
+    :func:`numpy.histogram`), otherwise the edges are searched. Chunks of
+    *x* can be binned by *threads*.
+    """
+    nbins = len(bins) - 1
+    def binning(x):
+        keep = (x >= bins[0]) & (x <= bins[-1])
+        x = x[keep]
+        if uniform:
+            labels = ((x - bins[0]) * (nbins / (bins[-1] - bins[0]))).astype(numpy.intp)
+            labels[labels >= nbins] = nbins - 1
+            labels[x < bins[labels]] -= 1
+            labels[(x >= bins[labels + 1]) & (labels != nbins - 1)] += 1
+        else:
+            labels = bins.searchsorted(x, 'right') - 1
+            labels[labels == nbins] = nbins - 1
+        return labels, keep
+    partial = map_chunks(binning, [x], threads)
+    if len(partial) == 1:
+        return partial[0]
+    return tuple([numpy.concatenate(parts) for parts in zip(*partial)])
+
+def regularized_function(x,y,func,bins=None,range=None,threads=None):
     """Compute func() over data aggregated in bins.
 
     (x,y) --> (x', func(Y'))  with Y' = {y: y(x) where x in x' bin}
@@ -262,15 +1177,25 @@ def regularized_function(x,y,func,bins=None,range=None):
        y
           ordinate values (func is applied)
        func
-          a numpy ufunc that takes one argument, func(Y')
+          a numpy ufunc that takes one argument, func(Y'); the reductions
+          known to :func:`segment_reduce` (such as :func:`numpy.mean` or
+          'median') are computed for all bins at once, any other callable
+          is applied to each bin separately
        bins
           number or array
        range
           limits (used with number of bins)
+       threads
+          process chunks of the data (or groups of bins) in parallel
+          threads (see :mod:`recsql.parallel`)
 
     :Returns:
        F,edges
           function and edges (midpoints = 0.5*(edges[:-1]+edges[1:]))
+
+    With *threads* a callable *func* runs inside the shared thread pool;
+    if it uses threads itself (e.g. :func:`describe` with *threads*) then
+    these nested calls run serially (see :mod:`recsql.parallel`).
     """
     _x = numpy.asarray(x)
     _y = numpy.asarray(y)
@@ -281,7 +1206,8 @@ def regularized_function(x,y,func,bins=None,range=None):
         if (mn > mx):
             raise ValueError('max must be larger than min in range parameter.')
 
-    if not numpy.iterable(bins):
+    uniform = not numpy.iterable(bins)
+    if uniform:
         if range is None:
             range = (_x.min(), _x.max())
         mn, mx = [float(mi) for mi in range]
@@ -294,6 +1220,17 @@ def regularized_function(x,y,func,bins=None,range=None):
         if (numpy.diff(bins) < 0).any():
             raise ValueError('bins must increase monotonically.')
 
+    # fast path: vectorized reduction over all bins, no sorting required
+    # (the median needs sorted bins and is faster with the loop below)
+    name = _reduction_name(func)
+    if name is not None and name != 'median':
+        labels, keep = _bin_labels(_x, bins, uniform=uniform, threads=threads)
+        F = _label_reduce(name, numpy.asarray(_y, dtype=numpy.float64)[keep],
+                          labels, len(bins)-1, threads=threads)
+        return F,bins
+    if name == 'median':
+        func = numpy.median
+
     sorting_index = numpy.argsort(_x)
     sx = _x[sorting_index]
     sy = _y[sorting_index]
@@ -309,5 +1246,285 @@ def regularized_function(x,y,func,bins=None,range=None):
     # general way to combine the chunks for different blocks, just think of
     # func=median
     F = numpy.zeros(len(bins)-1)  # final function
-    F[:] = [func(sy[start:stop]) for start,stop in izip(bin_index[:-1],bin_index[1:])]
+    def apply(starts, stops):
+        return [func(sy[start:stop]) for start,stop in izip(starts, stops)]
+    # threads handle groups of bins
+    F[:] = sum(map_chunks(apply, [bin_index[:-1], bin_index[1:]], threads, min_chunksize=1), [])
     return F,bins
+
+
+# Registry of all SQL functions
+
+#: simple SQL functions ``(name, number of arguments, function)``
+_FUNCTIONS = [
+    ("sqrt", 1, _sqrt),
+    ("sqr", 1, _sqr),
+    ("periodic", 1, _periodic),
+    ("pow", 2, _pow),
+    ("match", 2, _match),       # implements MATCH
+    ("regexp", 2, _regexp),     # implements REGEXP
+    ("fformat", 2, _fformat),
+    ("array_len", 1, _array_len),
+    ("array_sum", 1, _array_sum),
+    ("array_mean", 1, _array_mean),
+    ("array_min", 1, _array_min),
+    ("array_max", 1, _array_max),
+    ("array_get", 2, _array_get),
+    ("array_slice", 3, _array_slice),
+    ("histogram_counts", 1, _histogram_counts),
+    ("histogram_edges", 1, _histogram_edges),
+    ("histogram_total", 1, _histogram_total),
+    ("histogram_at", 2, _histogram_at),
+    ("hllsketch_count", 1, _hllsketch_count),
+    ]
+
+#: aggregate SQL functions ``(name, number of arguments, class)``
+_AGGREGATES = [
+    ("std", 1, _Stdev),
+    ("stdN", 1, _StdevN),
+    ("median", 1, _Median),
+    ("quantile", 2, _Quantile),
+    ("percentile", 2, _Percentile),
+    ("iqr", 1, _IQR),
+    ("approx_quantile", 2, _ApproxQuantile),
+    ("approx_quantile", 3, _ApproxQuantile),
+    ("approx_percentile", 2, _ApproxPercentile),
+    ("approx_percentile", 3, _ApproxPercentile),
+    ("approx_iqr", 1, _ApproxIQR),
+    ("approx_iqr", 2, _ApproxIQR),
+    ("quantilesketch", 1, _QuantileSketch),
+    ("quantilesketch", 2, _QuantileSketch),
+    ("approx_count_distinct", 1, _ApproxCountDistinct),
+    ("approx_count_distinct", 2, _ApproxCountDistinct),
+    ("hllsketch", 1, _HyperLogLog),
+    ("hllsketch", 2, _HyperLogLog),
+    ("hllsketch_union", 1, _HyperLogLogUnion),
+    ("describe", 1, _Describe),
+    ("topk", 2, _TopK),
+    ("bottomk", 2, _BottomK),
+    ("argtopk", 3, _ArgTopK),
+    ("argbottomk", 3, _ArgBottomK),
+    ("array", 1, _NumpyArray),
+    ("array", 2, _NumpyArray),
+    ("histogram", 4, _NumpyHistogram),
+    ("distribution", 4, _NormedNumpyHistogram),
+    ("whistogram", 5, _WeightedNumpyHistogram),
+    ("wmeanhistogram", 6, _WeightedMeanHistogram),
+    ("histogram2d", 8, _NumpyHistogram2D),
+    ("distribution2d", 8, _NormedNumpyHistogram2D),
+    ("meanhistogram", 5, _MeanHistogram),
+    ("stdhistogram", 5, _StdHistogram),
+    ("minhistogram", 5, _MinHistogram),
+    ("maxhistogram", 5, _MaxHistogram),
+    ("medianhistogram", 5, _MedianHistogram),
+    ("zscorehistogram", 5, _ZscoreHistogram),
+    ]
+
+#: window aggregates ``(name, number of arguments, class)``; only registered
+#: (as window functions) if the sqlite module supports them, see
+#: :func:`moving` and :meth:`recsql.SQLarray.moving` otherwise
+_WINDOW_AGGREGATES = [
+    ("moving_mean", 1, _MovingMean),
+    ("moving_std", 1, _MovingStd),
+    ("moving_median", 1, _MovingMedian),
+    ("moving_zscore", 1, _MovingZscore),
+    ]
+
+#: name of the SQL function that marks a connection as registered
+_REGISTERED = "recsql_functions"
+
+#: incremented by :func:`register_aggregate` so that :func:`register` adds
+#: new or redefined aggregates to connections that were already registered
+_generation = 0
+
+def _sql_value(value):
+    """Convert the result of a reducer to a value that SQLite can store."""
+    if isinstance(value, numpy.ndarray):
+        return adapt_numpyarray(value)
+    if isinstance(value, numpy.generic):
+        return value.item()
+    if value is None or isinstance(value, (int, long, float, basestring, buffer)):
+        return value
+    return adapt_object(value)
+
+class _VectorizedAggregate(object):
+    """Aggregate that calls a vectorized numpy *reducer* (see :func:`register_aggregate`).
+
+    The arguments of each row are appended to compact typed buffers
+    (:mod:`array`); rows with a NULL argument are skipped. Without a merge
+    function the reducer is called once in :meth:`finalize` with one numpy
+    array per argument. With a merge function every :attr:`chunksize` rows
+    are reduced and the partial results are combined with *merge*, so that
+    memory use is bounded; partial aggregates can be combined with
+    :meth:`merge`.
+    """
+    chunksize = 65536
+    reducer = None
+    merger = None
+    dtypes = (numpy.dtype(numpy.float64),)
+    def __init__(self):
+        self.data = [array.array(dtype.char) for dtype in self.dtypes]
+        self.partial = None
+    def step(self, *args):
+        if None in args:
+            return          # NULL: don't contribute
+        for buf, x in izip(self.data, args):
+            buf.append(x)
+        if self.merger is not None and len(self.data[0]) == self.chunksize:
+            self._flush()
+    def _arrays(self):
+        return [numpy.frombuffer(buf, dtype=dtype) if len(buf) else numpy.zeros(0, dtype=dtype)
+                for buf, dtype in izip(self.data, self.dtypes)]
+    def _combine(self, result):
+        self.partial = result if self.partial is None else self.merger(self.partial, result)
+    def _flush(self):
+        if len(self.data[0]) > 0:
+            self._combine(self.reducer(*[a.copy() for a in self._arrays()]))
+            for buf in self.data:
+                del buf[:]
+    def merge(self, other):
+        """Combine with the partial aggregate *other* (needs a merge function)."""
+        if self.merger is None:
+            raise TypeError("aggregate has no merge function")
+        self._flush()
+        other._flush()
+        if other.partial is not None:
+            self._combine(other.partial)
+        return self
+    def finalize(self):
+        if self.merger is not None:
+            self._flush()
+        if self.partial is None:
+            return _sql_value(self.reducer(*self._arrays()))
+        return _sql_value(self.partial)
+
+class _VectorizedAggregate1(_VectorizedAggregate):
+    """:class:`_VectorizedAggregate` with a single argument (less per-row overhead)."""
+    def __init__(self):
+        super(_VectorizedAggregate1, self).__init__()
+        self._buffer = self.data[0]
+        self._append = self._buffer.append
+    def step(self, x):
+        if x is not None:
+            self._append(x)
+
+class _ChunkedVectorizedAggregate1(_VectorizedAggregate1):
+    """:class:`_VectorizedAggregate1` that reduces chunks (with a merge function)."""
+    def step(self, x):
+        if x is not None:
+            self._append(x)
+            if len(self._buffer) == self.chunksize:
+                self._flush()
+
+def register_aggregate(name, reducer, nargs=1, dtype=numpy.float64, merge=None):
+    """Add the SQL aggregate *name* that is computed by a numpy function.
+
+    Example::
+
+       recsql.register_aggregate('rms', lambda x: numpy.sqrt(numpy.mean(x**2)))
+       T.SELECT('rms(x)')
+
+    The values of each argument are buffered in compact typed arrays and
+    *reducer* is called with one numpy array per argument, so that a
+    statistic runs at numpy speed instead of calling Python for every row.
+    Rows in which any argument is NULL are skipped.
+
+    The aggregate is added to all connections that :class:`~recsql.SQLarray`
+    opens from now on and to the connection of any existing table when the
+    next :class:`~recsql.SQLarray` is created for it (or when
+    :func:`register` is called). Registering an existing name again
+    replaces the aggregate with *nargs* arguments.
+
+    :Arguments:
+       *name*
+          SQL name of the aggregate
+       *reducer*
+          function ``reducer(x1, ..., xn)`` of *nargs* numpy arrays; the
+          result can be a number, a string, a numpy array (declare the
+          column as ``AS "y [NumpyArray]"``) or any other python object
+          (declare as ``AS "y [Object]"``)
+       *nargs*
+          number of arguments of the aggregate
+       *dtype*
+          numpy data type of the buffers (one for all arguments or a
+          sequence with one per argument); must be a type that
+          :mod:`array` supports such as float64, float32, int64 or int32
+       *merge*
+          function ``merge(result1, result2)`` that combines the results of
+          two parts of the data; if given, the data are reduced in chunks of
+          :attr:`_VectorizedAggregate.chunksize` rows (bounded memory) and
+          partial aggregates can be merged for parallel execution
+
+    :Raises: :exc:`ValueError` if *dtype* is not supported
+    """
+    global _generation
+    dtypes = dtype if isinstance(dtype, (list, tuple)) else [dtype] * nargs
+    dtypes = tuple([numpy.dtype(d) for d in dtypes])
+    if len(dtypes) != nargs:
+        raise ValueError("need one dtype per argument (nargs = %d)" % nargs)
+    for d in dtypes:
+        try:
+            array.array(d.char)
+        except (ValueError, TypeError):
+            raise ValueError("dtype %r cannot be buffered" % d)
+    attributes = {'reducer': staticmethod(reducer), 'dtypes': dtypes,
+                  'merger': None if merge is None else staticmethod(merge),
+                  '__doc__': getattr(reducer, '__doc__', None)}
+    if nargs != 1:
+        base = _VectorizedAggregate
+    elif merge is None:
+        base = _VectorizedAggregate1
+    else:
+        base = _ChunkedVectorizedAggregate1
+    cls = type(str(name), (base,), attributes)
+    _AGGREGATES[:] = [entry for entry in _AGGREGATES if entry[:2] != (name, nargs)]
+    _AGGREGATES.append((name, nargs, cls))
+    _generation += 1
+    return cls
+
+def create_window_function(connection, name, nargs, cls):
+    """Add the window aggregate *cls* as SQL function *name* to *connection*.
+
+    *cls* implements ``step()``, ``inverse()``, ``value()`` and
+    ``finalize()``. Nothing is added if the sqlite module cannot create
+    window functions (Python < 3.11, and hence always with the Python 2
+    sqlite3 module); use :func:`moving` or :meth:`recsql.SQLarray.moving`
+    instead.
+
+    :Returns: ``True`` if a window function was created
+    """
+    if hasattr(connection, 'create_window_function'):
+        try:
+            connection.create_window_function(name, nargs, cls)
+            return True
+        except sqlite.NotSupportedError:
+            pass            # SQLite < 3.25.0
+    return False
+
+def register(connection):
+    """Add all SQL functions and aggregates to *connection*.
+
+    Registration happens only once per connection: the connection is
+    marked with the SQL function ``recsql_functions()`` and calling
+    :func:`register` again for a marked connection costs a single query.
+
+    :Returns: ``True`` if the functions were added, ``False`` if the
+              connection already had them
+    """
+    nfuncs = len(_FUNCTIONS) + len(_AGGREGATES) + len(_WINDOW_AGGREGATES)
+    marker = "%d:%d" % (nfuncs, _generation)
+    try:
+        if connection.execute("SELECT %s()" % _REGISTERED).fetchone()[0] == marker:
+            return False
+    except Exception:
+        pass                # OperationalError: no such function
+    regexp, match = _regexp_functions()         # pattern cache per connection
+    per_connection = {'regexp': regexp, 'match': match}
+    for name, nargs, func in _FUNCTIONS:
+        connection.create_function(name, nargs, per_connection.get(name, func))
+    for name, nargs, cls in _AGGREGATES:
+        connection.create_aggregate(name, nargs, cls)
+    for name, nargs, cls in _WINDOW_AGGREGATES:
+        create_window_function(connection, name, nargs, cls)
+    connection.create_function(_REGISTERED, 0, lambda: marker)
+    return True
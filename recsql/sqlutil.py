@@ -21,29 +21,308 @@ How to use the sql converters and adapters:
 
       cur.execute('SELECT a as "a [NumpyArray]" from test')
 
+   Arrays are stored as BLOBs with a short header (dtype and shape)
+   followed by the raw data and are read back without copying the data
+   (the arrays are read-only). Arrays in the ascii pickle format of older
+   versions of RecSQL can still be read. Tuples of arrays, such as the
+   (counts, edges) results of the histogram aggregates, are stored in the
+   same binary format (:func:`adapt_arrays`) and read back as tuples by
+   the ``Object`` converter; older pickled tuples can still be read.
+
+   Arrays and objects wrapped in :class:`Compressed` are stored
+   compressed (zlib, bz2 or lzma, optionally byte-shuffled) and are
+   decompressed by the same converters.
+
+.. autoclass:: Compressed
+
 Module content
 --------------
 .. See the autogenerated content in the online docs or the source code.
 """
 
+import re
+import struct
+import zlib
+import bz2
 import cPickle
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None     # not available in python 2 without backports.lzma
+try:
+    from pysqlite2 import dbapi2 as sqlite
+except ImportError:
+    from sqlite3 import dbapi2 as sqlite
+import numpy
+
+# Binary format of NumpyArray BLOBs: a fixed header ARRAY_HEADER = (magic,
+# version, flags, length of the description), the description
+# "dtype.str;shape" (e.g. "<f8;3,4") and the raw data in C order. The
+# flags select the compression of the data (see Compressed). Compressed
+# Object BLOBs use the same header with OBJECT_MAGIC, an empty description
+# and the compressed pickle. A tuple of arrays (e.g. histogram and edges)
+# uses the header with ARRAYS_MAGIC and the number of arrays instead of the
+# length of the description, followed by the array BLOBs, each preceded by
+# its length (ARRAYS_LENGTH).
+ARRAY_MAGIC = '\x93RSQ'
+OBJECT_MAGIC = '\x93RSO'
+ARRAYS_MAGIC = '\x93RST'
+ARRAYS_LENGTH = struct.Struct('<Q')
+ARRAY_VERSION = 1
+ARRAY_HEADER = struct.Struct('<4sBBH')
+
+#: compression codecs ``name: (flag, compress(data, level), decompress, default level)``
+CODECS = {
+    'zlib': (1, zlib.compress, zlib.decompress, 6),
+    'bz2': (2, bz2.compress, bz2.decompress, 9),
+    }
+if lzma is not None:
+    CODECS['lzma'] = (3, lambda data, level: lzma.compress(data, preset=level),
+                      lzma.decompress, 6)
+_COMPRESS = dict((flag, compress) for flag, compress, decompress, level in CODECS.values())
+_DECOMPRESS = dict((flag, decompress) for flag, compress, decompress, level in CODECS.values())
+#: flag for byte-shuffled array data
+SHUFFLE = 0x10
+_CODEC_MASK = 0x0f
+
+def _array_description(s):
+    """Return (dtype, shape, flags, offset of the data) of an array BLOB *s*."""
+    magic, version, flags, length = ARRAY_HEADER.unpack_from(s)
+    if version > ARRAY_VERSION:
+        raise ValueError("NumpyArray BLOB version %d is not supported" % version)
+    start = ARRAY_HEADER.size
+    dtype, shape = str(s[start:start+length]).split(";")
+    shape = tuple([int(n) for n in shape.split(',') if n])
+    return numpy.dtype(dtype), shape, flags, start + length
+
+def is_array_blob(s):
+    """``True`` if *s* is a NumpyArray BLOB in the binary format."""
+    return s[:len(ARRAY_MAGIC)] == ARRAY_MAGIC
+
+def _decompress(flags, data):
+    try:
+        decompress = _DECOMPRESS[flags & _CODEC_MASK]
+    except KeyError:
+        raise ValueError("BLOB was compressed with unknown or unavailable codec %d" %
+                         (flags & _CODEC_MASK))
+    return decompress(str(data))
+
+def _shuffle(a):
+    """Bytes of *a*, grouped by byte position in the items (byte-shuffle)."""
+    return numpy.ascontiguousarray(a).view(numpy.uint8).reshape(-1, a.dtype.itemsize).T.tostring()
+
+def _unshuffle(data, itemsize):
+    return numpy.frombuffer(data, dtype=numpy.uint8).reshape(itemsize, -1).T.tostring()
+
+def _is_simple_array(a):
+    return type(a) is numpy.ndarray and a.dtype.fields is None and not a.dtype.hasobject
 
-# storing numpy arrays in the db as pickles
+def _pack_array(a, flags=0, level=None):
+    if flags & SHUFFLE and a.dtype.itemsize > 1:
+        data = _shuffle(a)
+    else:
+        flags &= ~SHUFFLE
+        data = numpy.ascontiguousarray(a).tostring()
+    if flags & _CODEC_MASK:
+        data = _COMPRESS[flags & _CODEC_MASK](data, level)
+    description = "%s;%s" % (a.dtype.str, ",".join([str(n) for n in a.shape]))
+    header = ARRAY_HEADER.pack(ARRAY_MAGIC, ARRAY_VERSION, flags, len(description))
+    return sqlite.Binary(header + description + data)
+
+# storing numpy arrays in the db as binary BLOBs
 def adapt_numpyarray(a):
-    """adapter: store numpy arrays in the db as ascii pickles"""
-    return cPickle.dumps(a,protocol=0)  # must use text protocol for use with sqlite
+    """adapter: store numpy arrays in the db as binary BLOBs
+
+    Arrays of simple dtypes are stored as a short header (dtype and shape)
+    followed by the raw data. Record arrays, arrays with fields or with
+    python objects are stored as binary pickles.
+    """
+    if not _is_simple_array(a):
+        return sqlite.Binary(cPickle.dumps(a, protocol=cPickle.HIGHEST_PROTOCOL))
+    return _pack_array(a)
 
 def convert_numpyarray(s):
-    """converter: retrieve numpy arrays from the db as ascii pickles"""
-    return cPickle.loads(s)
+    """converter: retrieve numpy arrays from the db
+
+    Binary BLOBs are read with :func:`numpy.frombuffer` without copying
+    the data, i.e. the array is read-only; compressed BLOBs are
+    decompressed first. Pickles (including the ascii pickles of older
+    versions of RecSQL) are unpickled.
+    """
+    if not is_array_blob(s):
+        return convert_object(s)
+    dtype, shape, flags, offset = _array_description(s)
+    if flags:
+        data = _decompress(flags, buffer(s, offset)) if flags & _CODEC_MASK else buffer(s, offset)
+        if flags & SHUFFLE:
+            data = _unshuffle(data, dtype.itemsize)
+        return numpy.frombuffer(data, dtype=dtype).reshape(shape)
+    return numpy.frombuffer(s, dtype=dtype, offset=offset).reshape(shape)
+
+def adapt_arrays(arrays):
+    """adapter: store a tuple of numpy arrays in the db as a binary BLOB
+
+    Each array is stored in the binary NumpyArray format (see
+    :func:`adapt_numpyarray`); the BLOB is read back as a tuple of arrays by
+    the ``Object`` converter. Tuples that contain other objects or arrays
+    that cannot be stored in the binary format are pickled.
+    """
+    arrays = tuple(arrays)
+    if not all([_is_simple_array(a) for a in arrays]):
+        return adapt_object(arrays)
+    parts = [ARRAY_HEADER.pack(ARRAYS_MAGIC, ARRAY_VERSION, 0, len(arrays))]
+    for a in arrays:
+        data = str(_pack_array(a))
+        parts.extend([ARRAYS_LENGTH.pack(len(data)), data])
+    return sqlite.Binary("".join(parts))
+
+def convert_arrays(s):
+    """converter: retrieve the tuple of arrays stored by :func:`adapt_arrays`
+
+    The arrays are read without copying the data (see
+    :func:`convert_numpyarray`).
+    """
+    magic, version, flags, n = ARRAY_HEADER.unpack_from(s)
+    if version > ARRAY_VERSION:
+        raise ValueError("NumpyArray BLOB version %d is not supported" % version)
+    arrays = []
+    offset = ARRAY_HEADER.size
+    for i in xrange(n):
+        length, = ARRAYS_LENGTH.unpack_from(s, offset)
+        offset += ARRAYS_LENGTH.size
+        arrays.append(convert_numpyarray(buffer(s, offset, length)))
+        offset += length
+    return tuple(arrays)
 
 def adapt_object(a):
-    """adapter: store python objects in the db as ascii pickles"""
-    return cPickle.dumps(a,protocol=0)  # must use text protocol for use with sqlite
+    """adapter: store python objects in the db as binary pickles"""
+    return sqlite.Binary(cPickle.dumps(a, protocol=cPickle.HIGHEST_PROTOCOL))
 
 def convert_object(s):
-    """convertor: retrieve python objects from the db as ascii pickles"""
-    return cPickle.loads(s)
+    """convertor: retrieve python objects from the db as pickles
+
+    Compressed objects, array BLOBs and tuples of arrays (see
+    :func:`adapt_arrays`) are also recognized.
+    """
+    magic = s[:len(OBJECT_MAGIC)]
+    if magic == OBJECT_MAGIC:
+        magic, version, flags, length = ARRAY_HEADER.unpack_from(s)
+        return cPickle.loads(_decompress(flags, buffer(s, ARRAY_HEADER.size + length)))
+    elif magic == ARRAY_MAGIC:
+        return convert_numpyarray(s)
+    elif magic == ARRAYS_MAGIC:
+        return convert_arrays(s)
+    return cPickle.loads(str(s))
+
+
+class Compressed(object):
+    """Wrapper that stores a numpy array or python object compressed.
+
+    A :class:`Compressed` value is stored as a compressed NumpyArray BLOB
+    (simple numpy arrays) or as a compressed Object BLOB (everything
+    else) and is read back transparently with the ``NumpyArray`` and
+    ``Object`` converters::
+
+       cur.execute("INSERT INTO test(a) values (?)", (Compressed(my_array, "zlib+shuffle"),))
+
+    :class:`recsql.SQLarray` wraps the values of compressed columns
+    automatically (see its *compression* argument).
+
+    *spec* is a codec name in :data:`CODECS` ("zlib", "bz2" and "lzma"
+    if the :mod:`lzma` module is available), optionally followed by
+    ":level" and "+shuffle", e.g. "zlib:9+shuffle". Byte-shuffling groups
+    the bytes of array elements by position, which often compresses
+    numerical data much better; it is ignored for objects.
+    """
+    __slots__ = ('value', 'codec', 'level', 'shuffle')
+    def __init__(self, value, spec="zlib"):
+        self.value = value
+        self.codec, self.level, self.shuffle = parse_compression(spec)
+
+    def __conform__(self, protocol):
+        return adapt_compressed(self)
+
+def parse_compression(spec):
+    """Return (codec, level, shuffle) for the compression *spec* "codec[:level][+shuffle]"."""
+    m = re.match(r'^(?P<codec>\w+)(?::(?P<level>\d+))?(?P<shuffle>\+shuffle)?$', str(spec))
+    if m is None:
+        raise ValueError("Compression must be 'codec[:level][+shuffle]', not %r" % spec)
+    codec = m.group('codec')
+    if codec not in CODECS:
+        raise ValueError("Unknown or unavailable compression codec %r; choose from %r" %
+                         (codec, sorted(CODECS.keys())))
+    level = int(m.group('level')) if m.group('level') is not None else None
+    return codec, level, m.group('shuffle') is not None
+
+def adapt_compressed(c):
+    """adapter: store a :class:`Compressed` value as compressed BLOB"""
+    flag, compress, decompress, default_level = CODECS[c.codec]
+    level = default_level if c.level is None else c.level
+    if _is_simple_array(c.value):
+        return _pack_array(c.value, flag | (SHUFFLE if c.shuffle else 0), level)
+    header = ARRAY_HEADER.pack(OBJECT_MAGIC, ARRAY_VERSION, flag, 0)
+    return sqlite.Binary(header + compress(cPickle.dumps(c.value, protocol=cPickle.HIGHEST_PROTOCOL), level))
+
+
+# copying whole databases (used by SQLarray.dump() and SQLarray.load())
+
+def copy_schema(connection, source, target, tables=None, rows=-1, progress=None):
+    """Copy all tables (with data), indices, views and triggers between schemas.
+
+    *source* and *target* are names of databases that are attached to
+    *connection* (e.g. "main" and a database attached with ``ATTACH
+    DATABASE``). The data of each table are copied in batches of *rows*
+    rows in rowid order (all rows at once for *rows* <= 0) and
+    ``progress(status, remaining, total)`` is called after each batch with
+    the number of rows that remain to be copied and the number of all rows.
+
+    If a list of table names is supplied in *tables* then only these
+    tables and their indices and triggers are copied.
+    """
+    entries = connection.execute(
+        "SELECT type, name, tbl_name, sql FROM %s.sqlite_master "
+        "WHERE sql NOT NULL AND name NOT LIKE 'sqlite_%%' "
+        "ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 ELSE 2 END" % source).fetchall()
+    if tables is not None:
+        entries = [entry for entry in entries if entry[0] != 'view' and entry[2] in tables]
+    tables = [name for objtype, name, tbl_name, sql in entries if objtype == 'table']
+    total = remaining = sum([connection.execute('SELECT count(*) FROM %s."%s"' % (source, name)).fetchone()[0]
+                             for name in tables])
+    for objtype, name, tbl_name, sql in entries:
+        sql = re.sub(r'^(CREATE\s+(?:UNIQUE\s+)?(?:TABLE|INDEX|VIEW|TRIGGER)\s+'
+                     r'(?:IF\s+NOT\s+EXISTS\s+)?)', r'\1%s.' % target, sql, count=1,
+                     flags=re.IGNORECASE)
+        connection.execute(sql)
+        if objtype == 'table':
+            for copied in _copy_rows(connection, source, target, name, rows):
+                remaining -= copied
+                if progress is not None:
+                    progress(0, remaining, total)
+    connection.commit()
+
+def _copy_rows(connection, source, target, name, rows):
+    """Copy the rows of table *name* in batches of *rows*; yield the number of copied rows."""
+    INSERT = 'INSERT INTO %s."%s" SELECT * FROM %s."%s"' % (target, name, source, name)
+    start = None
+    if rows > 0:
+        try:
+            start, = connection.execute('SELECT min(rowid) FROM %s."%s"' % (source, name)).fetchone()
+        except sqlite.OperationalError:
+            pass        # WITHOUT ROWID table: all at once
+    if start is None:
+        yield connection.execute(INSERT).rowcount
+        return
+    while start is not None:
+        stop = connection.execute('SELECT rowid FROM %s."%s" WHERE rowid >= ? ORDER BY rowid '
+                                  'LIMIT 1 OFFSET ?' % (source, name), (start, rows)).fetchone()
+        if stop is None:
+            yield connection.execute(INSERT + " WHERE rowid >= ?", (start,)).rowcount
+            return
+        yield connection.execute(INSERT + " WHERE rowid >= ? AND rowid < ?", (start, stop[0])).rowcount
+        start = stop[0]
 
 
 # Fake* not needed anymore since SQLarray takes an iterable + columns descriptors
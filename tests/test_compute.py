@@ -0,0 +1,94 @@
+# tests for recsql.compute and SQLarray.compute()
+
+import sqlite3
+
+import numpy
+from numpy.testing import assert_almost_equal, assert_equal
+import pytest
+
+from recsql import SQLarray
+from recsql.compute import Expression
+
+
+@pytest.fixture
+def table():
+    r = numpy.random.RandomState(2)
+    x, y, phi = r.randn(500), r.randn(500), r.uniform(-720, 720, 500)
+    T = SQLarray('t', records=[(float(a), float(b), float(c)) for a, b, c in zip(x, y, phi)],
+                 columns=['x', 'y', 'phi'])
+    return T, x, y, phi
+
+
+@pytest.mark.parametrize('expression,is_numpy', [('sqrt(x**2 + y**2)', True),
+                                                 ('-x % 3 / 2.', True),
+                                                 ('periodic(phi)', True),
+                                                 ("fformat('%.1f', x)", False),
+                                                 ('x || y', False),
+                                                 ('z + 1', False),
+                                                 ('__import__("os")', False),
+                                                 ('x.real', False),
+                                                 ('log(2, x)', True),
+                                                 ('atan2(x)', False),
+                                                 ('periodic(x, y)', False)])
+def test_expression(expression, is_numpy):
+    assert Expression(expression, ['x', 'y', 'phi']).is_numpy == is_numpy
+
+
+def test_compute(table):
+    T, x, y, phi = table
+    r = T.compute({'r': 'sqrt(x**2+y**2)', 'phi': 'periodic(phi)', 'c': '2'})
+    assert r.dtype.names == ('c', 'phi', 'r')
+    assert_almost_equal(r.r, numpy.sqrt(x**2 + y**2))
+    assert_equal(r.c, 2)
+    sql = T.sql("SELECT periodic(phi) FROM __self__", asrecarray=False)
+    assert_almost_equal(r.phi, [v for v, in sql])
+
+
+def test_where_and_sql_fallback(table):
+    T, x, y, phi = table
+    r = T.compute([('s', "fformat('%.1f', x)"), ('x2', 'x*x')], where='x > ?', parameters=(0.5,))
+    sel = x > 0.5
+    assert_almost_equal(r.x2, x[sel]**2)
+    assert list(r.s) == ['%.1f' % v for v in x[sel]]
+
+
+def test_empty(table):
+    T, x, y, phi = table
+    r = T.compute({'r': 'sqrt(x)'}, where='x > 100')
+    assert len(r) == 0
+
+
+def test_null():
+    T = SQLarray('t', records=[(1.,), (None,), (4.,)], columns=['x'])
+    r = T.compute({'s': 'sqrt(x)'})
+    assert_equal(r.s, [1., numpy.nan, 2.])
+
+
+def test_unknown_column(table):
+    T, x, y, phi = table
+    with pytest.raises(ValueError) as err:
+        T.compute({'r': 'x**2 + not_a_column'})
+    assert 'not_a_column' in str(err.value)
+    # names that only SQLite knows still work
+    r = T.compute({'i': 'rowid + 1'})
+    assert_equal(r.i, numpy.arange(len(x)) + 2)
+
+
+def test_log_as_sql():
+    T = SQLarray('t', records=[(100., 8.), (10., 2.), (0.5, None)], columns=['x', 'y'])
+    expressions = {'a': 'log(x)', 'b': 'log(2, y)', 'c': 'ln(x)', 'd': 'y'}
+    r = T.compute(expressions)
+    (a, b, c, d), = T.sql("SELECT log(x), log(2, y), ln(x), y FROM __self__ LIMIT 1", asrecarray=False)
+    assert_almost_equal([r.a[0], r.b[0], r.c[0], r.d[0]], [a, b, c, d])
+    assert_almost_equal(r.a, numpy.log10([100., 10., 0.5]))
+    assert_almost_equal(r.b, [3., 1., numpy.nan])
+    assert_equal(r.d, [8., 2., numpy.nan])       # y is not overwritten
+
+
+def test_bad_argument_count(table):
+    T = table[0]
+    # not a numpy expression: SQLite reports the error
+    for expression in ('atan2(x)', 'periodic(x, y)'):
+        with pytest.raises(sqlite3.OperationalError) as err:
+            T.compute({'a': expression})
+        assert 'wrong number of arguments' in str(err.value)
@@ -0,0 +1,169 @@
+# tests for recsql.groupby and SQLarray.groupby()
+
+import numpy
+from numpy.testing import assert_almost_equal, assert_equal
+import pytest
+
+from recsql import SQLarray
+
+
+@pytest.fixture
+def table():
+    r = numpy.random.RandomState(3)
+    g, h, x = r.randint(0, 5, 2000), r.randint(0, 2, 2000), r.randn(2000)
+    T = SQLarray('t', records=[(int(a), int(b), float(c)) for a, b, c in zip(g, h, x)],
+                 columns=['g', 'h', 'x'])
+    return T, g, h, x
+
+
+AGGREGATES = {'n': 'count(*)', 'c': 'count(x)', 's': 'sum(x)', 'a': 'avg(x)',
+              'lo': 'min(x)', 'hi': 'max(x)', 'sd': 'std(x)', 'sdN': 'stdN(x)',
+              'm': 'median(x)', 'q': 'quantile(x, 0.1)', 'p': 'percentile(x, 90)',
+              'iqr': 'iqr(x)'}
+
+
+@pytest.mark.parametrize('keys', ['g', 'g, h', ['h', 'g']])
+def test_numpy_matches_sql(table, keys):
+    T = table[0]
+    r = T.groupby(keys).agg(AGGREGATES, engine='numpy')
+    s = T.groupby(keys).agg(AGGREGATES, engine='sql')
+    assert r.dtype.names == s.dtype.names
+    for name in r.dtype.names:
+        assert_almost_equal(r[name], s[name], err_msg=name)
+
+
+def test_groups(table):
+    T, g, h, x = table
+    r = T.groupby('g').agg({'m': 'median(x)', 'n': 'count(*)'}, where='x > ?', parameters=(0,))
+    assert_equal(r.g, numpy.arange(5))
+    for key, m, n in r:
+        sel = (g == key) & (x > 0)
+        assert n == sel.sum()
+        assert_almost_equal(m, numpy.median(x[sel]))
+
+
+def test_histogram(table):
+    T, g, h, x = table
+    r = T.groupby('g').agg({'h': 'histogram(x, 10, -2, 2)', 'd': 'distribution(x, 10, -2, 2)'},
+                           engine='numpy')
+    s = T.groupby('g').agg({'h': 'histogram(x, 10, -2, 2)', 'd': 'distribution(x, 10, -2, 2)'},
+                           engine='sql')
+    for key in range(5):
+        hist, edges = numpy.histogram(x[g == key], bins=10, range=(-2, 2))
+        assert_equal(r.h[key][0], hist)
+        assert_almost_equal(r.h[key][1], edges)
+        assert_equal(s.h[key][0], hist)
+        assert_almost_equal(r.d[key][0], s.d[key][0])
+
+
+def test_null():
+    T = SQLarray('t', records=[(1, 1.), (1, None), (1, 3.), (2, None)], columns=['g', 'x'])
+    r = T.groupby('g').agg({'n': 'count(*)', 'c': 'count(x)', 'a': 'avg(x)', 'm': 'median(x)'},
+                           engine='numpy')
+    assert_equal(r.n, [3, 1])
+    assert_equal(r.c, [2, 0])
+    assert_equal(r.a, [2., numpy.nan])
+    assert_equal(r.m, [2., numpy.nan])
+
+
+def test_auto_engine(table):
+    T = table[0]
+    # falls back to SQL for aggregates that the numpy engine does not know
+    r = T.groupby('g').agg({'s': 'sum(x)*2', 'q': 'approx_quantile(x, 0.5)'})
+    assert len(r) == 5
+    with pytest.raises(ValueError):
+        T.groupby('g').agg({'s': 'sum(x)*2'}, engine='numpy')
+
+
+def test_empty(table):
+    T = table[0]
+    r = T.groupby('g').agg({'m': 'median(x)'}, where='x > 100', engine='numpy')
+    assert len(r) == 0
+
+
+BINNED = {'mh': 'meanhistogram(x, y, 8, -2, 2)', 'sh': 'stdhistogram(x, y, 8, -2, 2)',
+          'nh': 'minhistogram(x, y, 8, -2, 2)', 'xh': 'maxhistogram(x, y, 8, -2, 2)',
+          'dh': 'medianhistogram(x, y, 8, -2, 2)', 'zh': 'zscorehistogram(x, y, 8, -2, 2)',
+          'wh': 'whistogram(x, w, 8, -2, 2)', 'wm': 'wmeanhistogram(x, y, w, 8, -2, 2)',
+          'h2': 'histogram2d(x, y, 4, -2, 2, 3, -1, 1)', 'd2': 'distribution2d(x, y, 4, -2, 2, 3, -1, 1)',
+          'aq': 'approx_quantile(x, 0.25)', 'ap': 'approx_percentile(x, 75, 50)',
+          'ai': 'approx_iqr(x)'}
+
+
+def test_binned_numpy_matches_sql():
+    r = numpy.random.RandomState(5)
+    g, x, y, w = r.randint(0, 3, 1500), r.randn(1500), r.randn(1500), r.rand(1500)
+    records = [(int(a), float(b), float(c), float(d)) for a, b, c, d in zip(g, x, y, w)]
+    records += [(0, None, 1., 1.), (1, 0.5, None, 1.), (2, 1.5, 1., None)]
+    T = SQLarray('t', records=records, columns=['g', 'x', 'y', 'w'])
+    r = T.groupby('g').agg(BINNED, engine='numpy')
+    s = T.groupby('g').agg(BINNED, engine='sql')
+    for name, expression in sorted(BINNED.items()):
+        for a, b in zip(r[name], s[name]):
+            if isinstance(a, tuple):
+                assert len(a) == len(b)
+                for u, v in zip(a, b):
+                    assert_almost_equal(u, v, err_msg=expression)
+            elif expression.startswith('approx_'):
+                # exact in numpy: within the error of the sketch
+                assert abs(a - b) < 0.05, expression
+            else:
+                assert_almost_equal(a, b, err_msg=expression)
+
+
+def test_array_and_count_distinct():
+    T = SQLarray('t', records=[(1, 3), (2, 5), (1, 3), (1, 2), (2, 7)], columns=['g', 'x'])
+    aggregates = {'a': 'array(x)', 'f': "array(x, 'f4')", 'd': 'approx_count_distinct(x)'}
+    r = T.groupby('g').agg(aggregates, engine='numpy')
+    s = T.groupby('g').agg(aggregates, engine='sql')
+    for name in ('a', 'f'):
+        for a, b in zip(r[name], s[name]):
+            assert_equal(a, b)
+            assert a.dtype == b.dtype
+    assert_equal(r.d, [2, 2])
+    assert_equal(r.d, s.d)
+    T = SQLarray('u', records=[(1, 1.), (1, None)], columns=['g', 'x'])
+    assert list(T.groupby('g').agg({'a': 'array(x)'}, engine='numpy').a[0]) == [1., None]
+
+
+def test_large_integers():
+    big = 2**53 + 1
+    T = SQLarray('t', records=[(big, big), (big + 2, 1), (big, big + 2)], columns=['k', 'v'])
+    aggregates = {'s': 'sum(v)', 'lo': 'min(v)', 'hi': 'max(v)', 'a': 'array(v)'}
+    r = T.groupby('k').agg(aggregates, engine='numpy')
+    assert list(r.k) == [big, big + 2]
+    assert list(r.hi) == [big + 2, 1]
+    assert list(r.lo) == [big, 1]
+    assert list(r.s) == [2 * big + 2, 1]
+    assert list(r.a[0]) == [big, big + 2]
+    s = T.groupby('k').agg(aggregates, engine='sql')
+    for name in ('k', 's', 'lo', 'hi'):
+        assert list(r[name]) == list(s[name])
+
+
+def test_text_column():
+    r = numpy.random.RandomState(8)
+    g, x = r.randint(0, 4, 2000), r.randn(2000)
+    words = ['w%d' % i for i in r.randint(0, 30, 2000)]
+    T = SQLarray('t', records=[(int(a), float(b), w if i % 7 else None)
+                               for i, (a, b, w) in enumerate(zip(g, x, words))],
+                 columns=['g', 'x', 's'])
+    assert len(T) >= T.groupby('g').min_rows
+    for aggregates in ({'m': 'median(x)', 'c': 'count(s)'}, {'hi': 'max(s)'},
+                       {'d': 'approx_count_distinct(s)', 'm': 'median(x)'}):
+        r = T.groupby('g').agg(aggregates)
+        s = T.groupby('g').agg(aggregates, engine='sql')
+        for name in aggregates:
+            if name == 'd':
+                assert numpy.all(abs(r.d - s.d) <= 1)
+            elif name == 'hi':
+                assert list(r.hi) == list(s.hi)
+            else:
+                assert_almost_equal(r[name], s[name])
+    r = T.groupby('g').agg({'c': 'count(s)', 'd': 'approx_count_distinct(s)'}, engine='numpy')
+    for key, c, d in r:
+        sel = [w for i, (a, w) in enumerate(zip(g, words)) if a == key and i % 7]
+        assert c == len(sel)
+        assert d == len(set(sel))
+    with pytest.raises(ValueError):
+        T.groupby('g').agg({'hi': 'max(s)'}, engine='numpy')
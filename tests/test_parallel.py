@@ -0,0 +1,72 @@
+# tests for recsql.parallel and the threads arguments of the analysis functions
+
+import numpy
+from numpy.testing import assert_almost_equal, assert_equal
+import pytest
+
+from recsql import SQLarray, sqlfunctions, parallel
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(parallel, 'MIN_CHUNKSIZE', 100)
+
+
+@pytest.fixture
+def data():
+    r = numpy.random.RandomState(8)
+    return r.uniform(0, 1, 1000), r.randn(1000)
+
+
+@pytest.mark.parametrize('threads,nchunks', [(None, 1), (False, 1), (1, 1), (4, 4), (100, 10)])
+def test_map_chunks(small_chunks, threads, nchunks):
+    x = numpy.arange(1000)
+    partial = parallel.map_chunks(lambda a, b: (len(a), (a + b).sum()), [x, x], threads)
+    assert len(partial) == nchunks
+    assert sum([n for n, s in partial]) == 1000
+    assert sum([s for n, s in partial]) == 2 * x.sum()
+
+
+def test_nthreads():
+    assert parallel.nthreads() == 1
+    assert parallel.nthreads(True) >= 1
+    assert parallel.nthreads(3) == 3
+
+
+@pytest.mark.parametrize('func', ['count', 'sum', 'mean', 'std', 'min', 'max', 'median', 'zscore',
+                                  numpy.var])
+@pytest.mark.parametrize('bins', [10, numpy.array([0, 0.1, 0.5, 0.55, 1])])
+def test_regularized_function(small_chunks, data, func, bins):
+    x, y = data
+    F, edges = sqlfunctions.regularized_function(x, y, func, bins=bins, range=(0, 1))
+    Fp, edges_p = sqlfunctions.regularized_function(x, y, func, bins=bins, range=(0, 1), threads=4)
+    assert_almost_equal(Fp, F)
+    assert_equal(edges_p, edges)
+
+
+def test_nested(small_chunks, data):
+    # a callable that uses threads itself runs serially instead of deadlocking
+    x, y = numpy.tile(data[0], 4), numpy.tile(data[1], 4)
+    func = lambda v: sqlfunctions.describe(v, threads=2)['avg']
+    F, edges = sqlfunctions.regularized_function(x, y, func, bins=8, range=(0, 1), threads=2)
+    Fs, edges = sqlfunctions.regularized_function(x, y, numpy.mean, bins=8, range=(0, 1))
+    assert_almost_equal(F, Fs)
+
+
+def test_describe(small_chunks, data):
+    x, y = data
+    assert_almost_equal(list(sqlfunctions.describe(y, threads=3)), list(sqlfunctions.describe(y)))
+    T = SQLarray('t', records=zip(x.tolist(), y.tolist()), columns=['x', 'y'])
+    assert_almost_equal(T.describe(threads=3).tolist()[1][1:], list(sqlfunctions.describe(y)))
+
+
+def test_groupby(small_chunks, data):
+    x, y = data
+    T = SQLarray('t', records=zip((x * 10).astype(int).tolist(), y.tolist()), columns=['g', 'y'])
+    aggregates = {'m': 'avg(y)', 's': 'std(y)', 'lo': 'min(y)', 'h': 'histogram(y, 10, -2, 2)'}
+    r = T.groupby('g').agg(aggregates, engine='numpy')
+    rp = T.groupby('g').agg(aggregates, engine='numpy', threads=4)
+    for name in ('m', 's', 'lo'):
+        assert_almost_equal(rp[name], r[name])
+    for h, hp in zip(r.h, rp.h):
+        assert_equal(hp[0], h[0])
@@ -0,0 +1,339 @@
+# tests for recsql.sqlarray.SQLarray
+
+import pickle
+import sqlite3
+
+import numpy
+from numpy.testing import assert_equal
+import pytest
+
+from recsql import SQLarray
+from recsql.sqlarray import PROFILES
+
+
+@pytest.fixture
+def records():
+    return numpy.rec.fromrecords(numpy.arange(100.).reshape(25, 4), names='a,b,c,d')
+
+
+class TestProfiles(object):
+    def test_profile_on_construction(self, records, tmpdir):
+        T = SQLarray('t', records, dbfile=str(tmpdir.join('t.db')), profile='bulkload')
+        pragmas = T.pragmas()
+        assert T.profile == 'bulkload'
+        assert pragmas['journal_mode'] == 'memory'
+        assert pragmas['synchronous'] == 0
+        assert pragmas['cache_size'] == PROFILES['bulkload']['cache_size']
+        assert pragmas['page_size'] == PROFILES['bulkload']['page_size']
+        assert len(T) == 25
+
+    def test_switch_profile(self, records, tmpdir):
+        T = SQLarray('t', records, dbfile=str(tmpdir.join('t.db')), profile='bulkload')
+        pragmas = T.set_profile('readheavy')
+        assert T.profile == 'readheavy'
+        assert pragmas['journal_mode'] == 'wal'
+        assert pragmas['mmap_size'] == PROFILES['readheavy']['mmap_size']
+        assert_equal(T.recarray.a, records.a)
+
+    def test_custom_profile(self, records):
+        T = SQLarray('t', records)
+        assert T.profile is None
+        T.set_profile({'cache_size': -1024})
+        assert T.profile == 'custom'
+        assert T.pragmas()['cache_size'] == -1024
+
+    @pytest.mark.parametrize('profile', ['fast', {'foreign_keys': 1},
+                                         {'cache_size': '1; DROP TABLE t'}])
+    def test_bad_profile(self, records, profile):
+        T = SQLarray('t', records)
+        with pytest.raises(ValueError):
+            T.set_profile(profile)
+
+    def test_bad_profile_changes_nothing(self, records):
+        T = SQLarray('t', records)
+        before = T.pragmas()
+        with pytest.raises(ValueError):
+            T.set_profile({'cache_size': -1024, 'temp_store': 'MEMORY; DROP TABLE t'})
+        assert T.pragmas() == before
+        assert T.profile is None
+
+
+class TestDumpLoad(object):
+    def test_roundtrip(self, records, tmpdir):
+        filename = str(tmpdir.join('dump.db'))
+        T = SQLarray('t', records)
+        T.sql_index('idx_a', 'a')
+        calls = []
+        T.dump(filename, progress=lambda status, remaining, total: calls.append(remaining))
+        assert calls and calls[-1] == 0
+        L = SQLarray.load(filename)
+        assert L.name == 't'
+        assert L.dbfile == ':memory:'
+        assert L.connection_count == 1
+        assert_equal(L.recarray, T.recarray)
+        # SQL functions are available in the loaded db
+        assert L.SELECT('median(a) AS m').m[0] == numpy.median(records.a)
+
+    def test_batches(self, records, tmpdir):
+        filename = str(tmpdir.join('dump.db'))
+        T = SQLarray('t', records)
+        T.sql("DELETE FROM __self__ WHERE a % 3 = 0")
+        n = len(T)
+        calls = []
+        T.dump(filename, rows=7, progress=lambda status, remaining, total: calls.append((remaining, total)))
+        # all tables (including the book-keeping table) in batches of 7 rows
+        remaining, total = [r for r, t in calls], calls[0][1]
+        assert total >= n and remaining[-1] == 0
+        assert all([0 <= a - b <= 7 for a, b in zip([total] + remaining, remaining)])
+        assert len(calls) >= n // 7
+        calls = []
+        L = SQLarray.load(filename, 't', rows=5, progress=lambda *args: calls.append(args))
+        assert len(calls) > n // 5
+        assert_equal(L.recarray, T.recarray)
+
+    def test_dump_overwrites(self, records, tmpdir):
+        filename = str(tmpdir.join('dump.db'))
+        SQLarray('t', records).dump(filename)
+        SQLarray('t', records[:5]).dump(filename)
+        assert len(SQLarray.load(filename, 't')) == 5
+
+    def test_array_column(self, tmpdir):
+        filename = str(tmpdir.join('dump.db'))
+        T = SQLarray('t', records=[(1, numpy.arange(3.))], columns=['id', 'a'])
+        T.sql("CREATE TABLE arrays (a NumpyArray)")
+        T.sql("INSERT INTO arrays (a) VALUES (?)", (numpy.arange(5.),))
+        T.dump(filename)
+        A = SQLarray.load(filename, 'arrays')
+        (a,), = A.sql("SELECT a FROM __self__", asrecarray=False)
+        assert_equal(a, numpy.arange(5.))
+
+    def test_load_from_file(self, records, tmpdir):
+        filename = str(tmpdir.join('dump.db'))
+        SQLarray('t', records).dump(filename)
+        L = SQLarray.load(filename, in_memory=False)
+        assert L.dbfile == filename
+        assert_equal(L.recarray, records)
+
+    def test_load_ambiguous(self, records, tmpdir):
+        filename = str(tmpdir.join('dump.db'))
+        T = SQLarray('t', records)
+        T.selection('a < 10')
+        T.dump(filename)
+        with pytest.raises(ValueError):
+            SQLarray.load(filename)
+
+
+class TestPickle(object):
+    def test_in_memory(self, records):
+        T = SQLarray('t', records, cachesize=7)
+        T.selection('a < 10', name='other')
+        P = pickle.loads(pickle.dumps(T, pickle.HIGHEST_PROTOCOL))
+        assert P.name == 't'
+        assert P.dbfile == ':memory:'
+        assert_equal(P.recarray, records)
+        # image only contains the pickled table
+        assert not P.has_table('other')
+        assert P.SELECT('std(a) AS s').s[0] > 0
+
+    def test_on_disk(self, records, tmpdir):
+        filename = str(tmpdir.join('t.db'))
+        T = SQLarray('t', records, dbfile=filename, profile='readheavy')
+        state = T.__getstate__()
+        assert 'image' not in state
+        P = pickle.loads(pickle.dumps(T))
+        assert P.dbfile == filename
+        assert P.profile == 'readheavy'
+        assert_equal(P.recarray, records)
+
+    def test_tmp_table(self, records, tmpdir):
+        T = SQLarray('t', records, dbfile=str(tmpdir.join('t.db')), is_tmp=True)
+        P = pickle.loads(pickle.dumps(T))
+        assert P.dbfile == ':memory:'
+        assert_equal(P.recarray, records)
+
+    def test_custom_profile(self, records):
+        T = SQLarray('t', records, profile={'cache_size': -1234})
+        P = pickle.loads(pickle.dumps(T))
+        assert P.profile == 'custom'
+        assert P.pragmas()['cache_size'] == -1234
+
+    def test_close_keeps_transaction(self, records, tmpdir):
+        filename = str(tmpdir.join('t.db'))
+        T = SQLarray('t', records, dbfile=filename)
+        T.save()
+        U = SQLarray('t', connection=T.connection, dbfile=filename)
+        T.connection.execute("DELETE FROM t WHERE a < 40")
+        U.close()
+        T.connection.rollback()
+        assert len(T) == len(records)
+
+    def test_init_keeps_transaction(self, records, tmpdir):
+        filename = str(tmpdir.join('t.db'))
+        T = SQLarray('t', records, dbfile=filename)
+        T.save()
+        T.connection.execute("INSERT INTO t SELECT * FROM t WHERE a < 40")
+        U = SQLarray('t', connection=T.connection, dbfile=filename)
+        # the inserted rows are not committed
+        (n,), = sqlite3.connect(filename).execute("SELECT count(*) FROM t").fetchall()
+        assert n == len(records)
+        T.connection.rollback()
+        assert len(T) == len(records)
+        assert len(U) == len(records)
+
+
+class TestCompression(object):
+    @pytest.fixture
+    def arrays(self):
+        return [(i, numpy.linspace(0, i, 200), (i, 'x')) for i in range(5)]
+
+    def test_compressed_columns(self, arrays):
+        T = SQLarray('t', records=arrays, columns=['id', 'a', 'o'],
+                     compression={'a': 'zlib+shuffle', 'o': 'bz2'})
+        rows = T.sql('SELECT id, a AS "a [NumpyArray]", o AS "o [Object]", length(a) '
+                     'FROM __self__ ORDER BY id', asrecarray=False)
+        for (i, a, o, size), (j, b, p) in zip(rows, arrays):
+            assert i == j
+            assert_equal(a, b)
+            assert o == p
+            assert size < b.nbytes
+
+    def test_merge_and_reopen(self, arrays, tmpdir):
+        filename = str(tmpdir.join('t.db'))
+        T = SQLarray('t', records=arrays[:2], columns=['id', 'a', 'o'], dbfile=filename,
+                     compression={'a': 'zlib'})
+        T.merge(arrays[2:], columns=['id', 'a', 'o'])
+        T.close()
+        T = SQLarray('t', dbfile=filename)
+        assert T.compression == {'a': 'zlib'}
+        sizes = T.sql("SELECT length(a) FROM __self__", asrecarray=False)
+        assert all(size < 1600 for size, in sizes)
+
+    def test_reopen_odd_column_names(self, arrays, tmpdir):
+        filename = str(tmpdir.join('t.db'))
+        compression = {'"a,b=c"': 'zlib:9+shuffle', 'o': 'bz2'}
+        T = SQLarray('t', records=arrays, columns=['id', '"a,b=c"', 'o'], dbfile=filename,
+                     compression=compression)
+        T.close()
+        assert SQLarray('t', dbfile=filename).compression == {'a,b=c': 'zlib:9+shuffle', 'o': 'bz2'}
+
+    def test_pickle(self, arrays):
+        T = SQLarray('t', records=arrays, columns=['id', 'a', 'o'], compression={'a': 'zlib'})
+        U = pickle.loads(pickle.dumps(T))
+        assert U.compression == {'a': 'zlib'}
+
+    @pytest.mark.parametrize('compression', [{'x': 'zlib'}, {'a': 'nosuchcodec'}, {'a': 'zlib+foo'}])
+    def test_bad_compression(self, arrays, compression):
+        with pytest.raises(ValueError):
+            SQLarray('t', records=arrays, columns=['id', 'a', 'o'], compression=compression)
+
+
+class TestDescribe(object):
+    def test_describe(self, records):
+        T = SQLarray('t', records)
+        s = T.describe()
+        assert list(s.column) == ['a', 'b', 'c', 'd']
+        a = records.a
+        assert_equal(s[0].tolist()[1:], [25, a.mean(), a.std(ddof=1), a.min(),
+                                         numpy.percentile(a, 25), numpy.median(a),
+                                         numpy.percentile(a, 75), a.max()])
+
+    def test_where_and_text_columns(self):
+        T = SQLarray('t', [('x', 1.), ('y', 2.), ('z', None), ('w', 4.)], columns=['s', 'v'])
+        s = T.describe(where='v > ?', parameters=(1.5,))
+        assert list(s.column) == ['v']
+        assert s.n[0] == 2 and s.avg[0] == 3.
+        with pytest.raises(ValueError):
+            T.describe(['s'])
+
+    def test_cache(self, records):
+        T = SQLarray('t', records)
+        s = T.describe(['a'])
+        assert T.describe(['a']) is s
+        T.sql("INSERT INTO __self__ VALUES (1000, 0, 0, 0)")
+        s = T.describe(['a'])
+        assert s.n[0] == 26 and s.xmax[0] == 1000
+
+    def test_cache_size(self, records):
+        T = SQLarray('t', records, cachesize=3)
+        for i in range(10):
+            T.describe(['a'], where='a > ?', parameters=(i,))
+        assert len(T._SQLarray__summaries) <= 3
+        assert T.describe(['a'], where='a > ?', parameters=(9,)) is \
+            T.describe(['a'], where='a > ?', parameters=(9,))
+
+
+class TestHistogram(object):
+    @pytest.fixture
+    def table(self):
+        x = numpy.random.RandomState(6).randn(5000)
+        T = SQLarray('t', records=[(i, float(v)) for i, v in enumerate(x)] + [(5000, None)],
+                     columns=['i', 'x'])
+        return T, x
+
+    @pytest.mark.parametrize('bins,range', [(10, (-2, 2)), (7, None), (1, (0, 0.5))])
+    def test_numpy(self, table, bins, range):
+        T, x = table
+        hist, edges = T.histogram('x', bins=bins, range=range)
+        h, e = numpy.histogram(x, bins=bins, range=range)
+        assert_equal(hist, h)
+        assert_equal(edges, e)
+
+    def test_where(self, table):
+        T, x = table
+        hist, edges = T.histogram('x', 20, (-3, 3), where='i < ?', parameters=(1000,))
+        assert_equal(hist, numpy.histogram(x[:1000], 20, (-3, 3))[0])
+        hist, edges = T.histogram('x', 20, (-3, 3), where='i < 0')
+        assert_equal(hist, numpy.zeros(20))
+
+    def test_cache_and_rebinning(self, table, monkeypatch):
+        T, x = table
+        hist, edges = T.histogram('x', 64, (-4, 4))
+        hist[:] = 0         # results are copies of the cached histogram
+        queries = []
+        sql = T.sql
+        monkeypatch.setattr(T, 'sql', lambda *args, **kwargs: queries.append(args) or sql(*args, **kwargs))
+        for bins in (64, 32, 16, 8):
+            hist, edges = T.histogram('x', bins, (-4, 4))
+            assert_equal(hist, numpy.histogram(x, bins, (-4, 4))[0])
+        assert queries == []
+        T.sql("INSERT INTO __self__ VALUES (5001, 0.1)")
+        del queries[:]
+        hist, edges = T.histogram('x', 8, (-4, 4))
+        assert len([q for q in queries if not q[0].startswith('PRAGMA')]) == 1
+        assert hist.sum() == numpy.histogram(x, 8, (-4, 4))[0].sum() + 1
+
+    def test_quoted_names(self):
+        T = SQLarray('t', records=[(float(v), 'a%d' % v) for v in range(10)], columns=['"x y"', 's'])
+        T.sql('CREATE INDEX "x""index" ON __self__ ("x y")')
+        assert T._has_index('x y')
+        hist, edges = T.histogram('x y', 5, (0, 10), where="s LIKE 'a%'")
+        assert_equal(hist, [2, 2, 2, 2, 2])
+
+    def test_cache_size(self, table):
+        T, x = table
+        histograms = T._SQLarray__histograms
+        for i in range(20):
+            T.histogram('x', 10, (i, i + 1))
+            T.histogram('x', 10, (i, i + 1), where='i < ?', parameters=(i,))
+        assert len(histograms) <= 5
+        assert all([len(cache['histograms']) <= 5 for cache in histograms.values()])
+        hist, edges = T.histogram('x', 10, (-1, 1))
+        assert_equal(hist, numpy.histogram(x, 10, (-1, 1))[0])
+
+    @pytest.mark.parametrize('index', [False, True])
+    @pytest.mark.parametrize('bins,range', [(10, (0, 1)), (7, (-0.3, 0.7)), (100, (1e6, 1e6 + 1)),
+                                            (3, (0.5, 0.5)), (1000, (0, 1))])
+    def test_edges(self, bins, range, index):
+        # values on and next to the bin edges are binned exactly as by numpy
+        edges = numpy.histogram([], bins=bins, range=range)[1]
+        x = numpy.concatenate([edges, numpy.nextafter(edges, -numpy.inf),
+                               numpy.nextafter(edges, numpy.inf),
+                               numpy.random.RandomState(7).uniform(edges[0] - 0.1, edges[-1] + 0.1, 1000)])
+        T = SQLarray('t', records=[(float(v),) for v in x] + [(1,), (0,)], columns=['x'])
+        if index:
+            T.sql_index('x_index', ['x'], unique=False)
+        assert T._has_index('x') == index
+        hist, e = T.histogram('x', bins=bins, range=range)
+        h, e_numpy = numpy.histogram(numpy.concatenate([x, [1, 0]]), bins=bins, range=range)
+        assert_equal(hist, h)
+        assert_equal(e, e_numpy)
@@ -0,0 +1,665 @@
+# tests for recsql.sqlfunctions
+
+import sqlite3
+
+import numpy
+from numpy.testing import assert_almost_equal, assert_equal
+import pytest
+
+import recsql
+from recsql import SQLarray, sqlfunctions
+from recsql.sqlutil import convert_numpyarray
+
+
+@pytest.fixture
+def connection():
+    return sqlite3.connect(":memory:")
+
+
+def test_register(connection):
+    assert sqlfunctions.register(connection)
+    assert not sqlfunctions.register(connection)
+    assert connection.execute("SELECT sqr(3)").fetchone()[0] == 9
+
+
+def test_register_existing_connection(connection):
+    connection.execute("CREATE TABLE t (x)")
+    connection.executemany("INSERT INTO t (x) VALUES (?)", [(1.,), (2.,), (4.,)])
+    T = SQLarray('t', connection=connection)
+    assert T.SELECT("median(x) AS m").m[0] == 2.
+
+
+@pytest.fixture
+def offset_data():
+    return 1e9 + numpy.random.RandomState(42).randn(10000)
+
+
+class TestStdev(object):
+    @pytest.mark.parametrize('cls,ddof', [(sqlfunctions._Stdev, 1),
+                                          (sqlfunctions._StdevN, 0)])
+    def test_large_offset(self, offset_data, cls, ddof):
+        agg = cls()
+        for x in offset_data:
+            agg.step(x)
+        assert_almost_equal(agg.finalize(), numpy.std(offset_data, ddof=ddof), decimal=6)
+
+    def test_merge(self, offset_data):
+        parts = [sqlfunctions._Stdev() for i in range(3)]
+        for agg, chunk in zip(parts, numpy.array_split(offset_data, 3)):
+            for x in chunk:
+                agg.step(x)
+        merged = parts[0].merge(parts[1]).merge(parts[2])
+        assert_almost_equal(merged.finalize(), numpy.std(offset_data, ddof=1), decimal=6)
+
+    def test_sql(self):
+        T = SQLarray('t', records=[(1.,), (None,), (2.,), (3.,)], columns=['x'])
+        r = T.SELECT("std(x) AS s, stdN(x) AS sN")
+        assert_almost_equal(r.s[0], 1.)
+        assert_almost_equal(r.sN[0], numpy.sqrt(2./3))
+
+    def test_too_few(self):
+        T = SQLarray('t', records=[(1.,)], columns=['x'])
+        assert T.sql("SELECT std(x), stdN(x) FROM __self__", asrecarray=False) == [(0., 0.)]
+
+
+def test_moments_update(offset_data):
+    m = sqlfunctions.Moments().update(offset_data[:10]).update(offset_data[10:])
+    assert m.n == len(offset_data)
+    assert_almost_equal(m.mean, offset_data.mean())
+    assert_almost_equal(m.variance(), offset_data.var(), decimal=6)
+
+
+@pytest.fixture
+def table():
+    x = numpy.random.RandomState(7).randn(5000)
+    groups = numpy.arange(len(x)) % 3
+    return SQLarray('t', records=[(int(g), float(v)) for g, v in zip(groups, x)],
+                    columns=['g', 'x']), groups, x
+
+
+class TestQuantiles(object):
+    @pytest.mark.parametrize('q', [0, 0.1, 0.5, 0.77, 1])
+    def test_quantiles(self, q):
+        x = numpy.random.RandomState(3).rand(101)
+        assert_almost_equal(sqlfunctions.quantiles(x, q), numpy.percentile(x, 100 * q))
+
+    def test_quantiles_empty(self):
+        assert numpy.isnan(sqlfunctions.quantiles([], 0.5))
+
+    def test_sql(self, table):
+        T, groups, x = table
+        r = T.SELECT("g, median(x) AS m, quantile(x, 0.3) AS q, percentile(x, 90) AS p, "
+                     "iqr(x) AS i", "GROUP BY g ORDER BY g")
+        for g in range(3):
+            v = x[groups == g]
+            assert_almost_equal(r.m[g], numpy.median(v))
+            assert_almost_equal(r.q[g], numpy.percentile(v, 30))
+            assert_almost_equal(r.p[g], numpy.percentile(v, 90))
+            assert_almost_equal(r.i[g], numpy.subtract(*numpy.percentile(v, [75, 25])))
+
+    def test_median_text(self):
+        T = SQLarray('t', records=[(u'1.5',), (2,), (None,), (4.,)], columns=['x'])
+        assert T.sql("SELECT median(x) FROM __self__", asrecarray=False)[0][0] == 2.
+
+    def test_approx_merge_empty(self):
+        a, b = sqlfunctions._ApproxQuantile(), sqlfunctions._ApproxQuantile()
+        for x in range(10):
+            a.step(float(x), 0.5, 16)
+        assert b.merge(a).sketch.n == 10
+        assert a.merge(sqlfunctions._ApproxQuantile()).sketch.n == 10
+        # merge works in place
+        acc = sqlfunctions._ApproxQuantile()
+        acc.merge(a)
+        acc.merge(sqlfunctions._ApproxQuantile())
+        assert acc.finalize() == a.finalize()
+        acc.merge(a)
+        assert acc.sketch.n == 20 and a.sketch.n == 10
+
+    def test_approx_sql(self, table):
+        T, groups, x = table
+        k = 64
+        r = T.SELECT("g, approx_quantile(x, 0.3, %d) AS q, approx_percentile(x, 90, %d) AS p, "
+                     "approx_iqr(x, %d) AS i" % (k, k, k), "GROUP BY g ORDER BY g")
+        for g in range(3):
+            v = numpy.sort(x[groups == g])
+            # compare ranks with a loose bound (the exact bound is tested below)
+            for estimate, q in ((r.q[g], 0.3), (r.p[g], 0.9)):
+                rank = numpy.searchsorted(v, estimate, side='right')
+                assert abs(rank - q * len(v)) < 0.1 * len(v)
+            assert abs(r.i[g] - numpy.subtract(*numpy.percentile(v, [75, 25]))) < 0.3
+
+    def test_sketch_object(self, table):
+        T, groups, x = table
+        (sketch,), = T.sql('SELECT quantilesketch(x, 128) AS "s [Object]" FROM __self__',
+                           asrecarray=False)
+        assert len(sketch) == len(x)
+        assert sketch.k == 128
+
+
+class TestQuantileSketch(object):
+    @pytest.mark.parametrize('k', [16, 100, 1024])
+    def test_rank_error_bound(self, k):
+        x = numpy.random.RandomState(11).randn(20000)
+        sketch = sqlfunctions.QuantileSketch(k)
+        sketch.update_many(x)
+        sx = numpy.sort(x)
+        q = numpy.linspace(0, 1, 41)
+        ranks = numpy.searchsorted(sx, sketch.quantile(q), side='right')
+        assert numpy.all(numpy.abs(ranks - numpy.maximum(q * len(x), 1)) <= sketch.rank_error)
+        assert sketch.epsilon < 1
+
+    def test_merge(self):
+        x = numpy.random.RandomState(12).rand(30000)
+        parts = []
+        for chunk in numpy.array_split(x, 4):
+            sketch = sqlfunctions.QuantileSketch(200)
+            for v in chunk:
+                sketch.update(v)
+            parts.append(sketch)
+        merged = parts[0]
+        for sketch in parts[1:]:
+            merged.merge(sketch)
+        assert len(merged) == len(x)
+        ranks = numpy.searchsorted(numpy.sort(x), merged.quantile([0.1, 0.5, 0.9]), side='right')
+        assert numpy.all(numpy.abs(ranks - numpy.array([0.1, 0.5, 0.9]) * len(x)) <= merged.rank_error)
+        # memory stays bounded
+        assert len(merged.buffer) + sum(len(level) for level in merged.levels) < 200 * 10
+
+
+class TestHyperLogLog(object):
+    @pytest.mark.parametrize('p', [8, 12, 14])
+    @pytest.mark.parametrize('n', [10, 1000, 50000])
+    def test_error_bound(self, p, n):
+        x = numpy.random.RandomState(n).randint(0, 2**40, size=n)
+        sketch = sqlfunctions.HyperLogLog(p)
+        sketch.update_many(numpy.concatenate((x, x[:n//2])))
+        true = len(numpy.unique(x))
+        assert abs(sketch.count() - true) <= 4 * sketch.relative_error * true
+        assert sketch.registers.nbytes == 2**p
+
+    def test_update_and_types(self):
+        x = numpy.random.RandomState(3).rand(1000) * 100
+        a, b = sqlfunctions.HyperLogLog(), sqlfunctions.HyperLogLog()
+        a.update_many(numpy.concatenate((x, numpy.arange(50))))
+        for v in x.tolist() + range(50):
+            b.update(v)
+        assert_equal(a.registers, b.registers)
+        c = sqlfunctions.HyperLogLog()
+        for v in [1, 1.0, u'a', 'a', buffer('a'), -1]:
+            c.update(v)
+        assert c.count() == 3
+
+    def test_merge(self):
+        x = numpy.arange(30000)
+        parts = [sqlfunctions.HyperLogLog(10) for i in range(3)]
+        for sketch, chunk in zip(parts, numpy.array_split(x, 3)):
+            sketch.update_many(chunk)
+        whole = sqlfunctions.HyperLogLog(10)
+        whole.update_many(x)
+        merged = reduce(lambda a, b: a.merge(b), parts)
+        assert_equal(merged.registers, whole.registers)
+        with pytest.raises(ValueError):
+            merged.merge(sqlfunctions.HyperLogLog(12))
+
+    def test_merge_empty(self):
+        a, b = sqlfunctions._ApproxCountDistinct(), sqlfunctions._ApproxCountDistinct()
+        for x in range(100):
+            a.step(x, 10)
+        assert b.merge(a).finalize() == a.finalize()
+        assert a.merge(sqlfunctions._ApproxCountDistinct()).finalize() == a.finalize()
+        empty = sqlfunctions._ApproxCountDistinct()
+        assert empty.merge(sqlfunctions._ApproxCountDistinct()).finalize() == 0
+        # merge works in place
+        acc = sqlfunctions._ApproxCountDistinct()
+        acc.merge(a)
+        acc.merge(sqlfunctions._ApproxCountDistinct())
+        assert acc.finalize() == a.finalize()
+        assert acc.sketch is not a.sketch
+
+    def test_sql(self):
+        T = SQLarray('t', records=[(i % 2, i % 700 if i % 2 else str(i % 300)) for i in range(5000)]
+                     + [(0, None)], columns=['g', 'x'])
+        r = T.sql("SELECT g, approx_count_distinct(x), approx_count_distinct(x, 14) "
+                  "FROM __self__ GROUP BY g ORDER BY g", asrecarray=False)
+        for (g, n12, n14), true in zip(r, [150, 350]):
+            assert abs(n12 - true) <= 0.1 * true
+            assert abs(n14 - true) <= 0.05 * true
+        T.sql('CREATE TABLE sketches AS SELECT g, hllsketch(x) AS s FROM __self__ GROUP BY g')
+        (n,), = T.sql("SELECT hllsketch_count(hllsketch_union(s)) FROM sketches", asrecarray=False)
+        assert abs(n - 500) <= 0.1 * 500
+        (sketch,), = T.sql('SELECT hllsketch_union(s) AS "s [Object]" FROM sketches', asrecarray=False)
+        assert sketch.count() == n
+
+
+class TestHistogram(object):
+    def test_histogram(self, table):
+        T, groups, x = table
+        (hist, edges), = T.sql('SELECT histogram(x, 20, -2, 2) AS "h [Object]" FROM __self__',
+                               asrecarray=False)[0]
+        h, e = numpy.histogram(x, bins=20, range=(-2, 2))
+        assert_equal(hist, h)
+        assert_equal(edges, e)
+
+    def test_distribution(self, table):
+        T, groups, x = table
+        (hist, edges), = T.sql('SELECT distribution(x, 20, -2, 2) AS "h [Object]" FROM __self__',
+                               asrecarray=False)[0]
+        h, e = numpy.histogram(x, bins=20, range=(-2, 2), density=True)
+        assert_almost_equal(hist, h)
+
+    def test_chunks(self):
+        x = numpy.random.RandomState(5).rand(1000)
+        agg = sqlfunctions._NumpyHistogram()
+        agg.chunksize = 64
+        for v in x:
+            agg.step(v, 7, 0, 1)
+        agg.step(None, 7, 0, 1)
+        hist, edges = sqlfunctions.convert_object(agg.finalize())
+        assert_equal(hist, numpy.histogram(x, bins=7, range=(0, 1))[0])
+        assert len(agg.data) == 0
+
+    def test_merge(self):
+        x = numpy.random.RandomState(5).rand(1000)
+        parts = [sqlfunctions._NumpyHistogram() for i in range(2)]
+        for agg, chunk in zip(parts, numpy.array_split(x, 2)):
+            for v in chunk:
+                agg.step(v, 7, 0, 1)
+        hist, edges = sqlfunctions.convert_object(parts[0].merge(parts[1]).finalize())
+        assert_equal(hist, numpy.histogram(x, bins=7, range=(0, 1))[0])
+
+
+class TestWeightedHistogram(object):
+    @pytest.fixture
+    def data(self):
+        r = numpy.random.RandomState(11)
+        return r.rand(1000), r.randn(1000), r.rand(1000)
+
+    def test_whistogram(self, data):
+        x, y, w = data
+        agg = sqlfunctions._WeightedNumpyHistogram()
+        agg.chunksize = 64
+        for u, v in zip(x, w):
+            agg.step(u, v, 7, 0, 1)
+        agg.step(0.5, None, 7, 0, 1)
+        hist, edges = sqlfunctions.convert_object(agg.finalize())
+        assert_almost_equal(hist, numpy.histogram(x, bins=7, range=(0, 1), weights=w)[0])
+
+    def test_wmeanhistogram(self, data):
+        x, y, w = data
+        parts = [sqlfunctions._WeightedMeanHistogram() for i in range(2)]
+        for agg, chunk in zip(parts, numpy.array_split(numpy.arange(len(x)), 2)):
+            agg.chunksize = 64
+            for i in chunk:
+                agg.step(x[i], y[i], w[i], 7, 0, 2)
+        hist, edges = sqlfunctions.convert_object(parts[0].merge(parts[1]).finalize())
+        sumw = numpy.histogram(x, bins=7, range=(0, 2), weights=w)[0]
+        sumwy = numpy.histogram(x, bins=7, range=(0, 2), weights=w*y)[0]
+        assert_almost_equal(hist[:3], (sumwy/sumw)[:3])
+        assert numpy.all(numpy.isnan(hist[4:]))
+
+    def test_sql(self, table):
+        T, groups, x = table
+        result = T.sql('SELECT g, whistogram(x, 1.0, 10, -2, 2) AS "h [Object]" '
+                       'FROM __self__ GROUP BY g ORDER BY g', asrecarray=False)
+        for g, (hist, edges) in result:
+            assert_almost_equal(hist, numpy.histogram(x[groups == g], bins=10, range=(-2, 2))[0])
+
+
+class TestHistogram2D(object):
+    @pytest.fixture
+    def table2d(self):
+        r = numpy.random.RandomState(3)
+        records = [(g, x, y) for g, x, y in zip(r.randint(0, 2, 3000),
+                                                r.uniform(-180, 180, 3000),
+                                                r.uniform(-180, 180, 3000))]
+        records.append((0, None, 1.0))
+        return SQLarray('angles', records=records, columns=['g', 'phi', 'psi'])
+
+    def test_groupby(self, table2d):
+        result = table2d.sql('SELECT g, histogram2d(phi, psi, 12, -180, 180, 6, -180, 180) '
+                             'AS "h [Object]" FROM __self__ GROUP BY g ORDER BY g', asrecarray=False)
+        data = table2d.sql('SELECT g, phi, psi FROM __self__ WHERE phi NOT NULL', asrecarray=True)
+        for g, (hist, xedges, yedges) in result:
+            sel = data.g == g
+            h, xe, ye = numpy.histogram2d(data.phi[sel], data.psi[sel], bins=(12, 6),
+                                          range=[(-180, 180), (-180, 180)])
+            assert_equal(hist, h)
+            assert_equal(xedges, xe)
+            assert_equal(yedges, ye)
+
+    def test_distribution2d(self, table2d):
+        (hist, xedges, yedges), = table2d.sql(
+            'SELECT distribution2d(phi, psi, 12, -180, 180, 6, -180, 180) AS "h [Object]" '
+            'FROM __self__', asrecarray=False)[0]
+        assert_almost_equal(numpy.sum(hist * numpy.outer(numpy.diff(xedges), numpy.diff(yedges))), 1)
+
+    def test_chunks_and_merge(self):
+        r = numpy.random.RandomState(5)
+        x, y = r.rand(1000), r.rand(1000)
+        parts = [sqlfunctions._NumpyHistogram2D() for i in range(2)]
+        for agg, xs, ys in zip(parts, numpy.array_split(x, 2), numpy.array_split(y, 2)):
+            agg.chunksize = 64
+            for u, v in zip(xs, ys):
+                agg.step(u, v, 4, 0, 1, 5, 0, 1)
+        hist, xedges, yedges = sqlfunctions.convert_object(parts[0].merge(parts[1]).finalize())
+        assert_equal(hist, numpy.histogram2d(x, y, bins=(4, 5), range=[(0, 1), (0, 1)])[0])
+
+
+class TestRegularizedFunction(object):
+    @pytest.fixture
+    def data(self):
+        r = numpy.random.RandomState(17)
+        x = r.rand(2000)
+        x[:5] = [0.0, 0.1, 0.5, 1.0, 1.5]    # bin edges and outside of range
+        return x, r.randn(2000)
+
+    @pytest.mark.parametrize('func', [len, numpy.sum, numpy.mean, numpy.std, numpy.min,
+                                      numpy.max, numpy.median])
+    def test_fast_path(self, data, func):
+        x, y = data
+        F, edges = sqlfunctions.regularized_function(x, y, func, bins=10, range=(0, 1))
+        Fslow, e = sqlfunctions.regularized_function(x, y, lambda v: func(v), bins=10, range=(0, 1))
+        assert_almost_equal(F, Fslow)
+        assert_equal(edges, e)
+
+    def test_empty_bins(self, data):
+        x, y = data
+        for func, empty in (('count', 0), ('sum', 0), ('zscore', 0), ('mean', numpy.nan),
+                            ('std', numpy.nan), ('min', numpy.nan), ('max', numpy.nan),
+                            ('median', numpy.nan)):
+            F, edges = sqlfunctions.regularized_function(x, y, func, bins=10, range=(2, 3))
+            assert_equal(F, empty * numpy.ones(10))
+
+    def test_zscore(self, data):
+        x, y = data
+        def zscore(v):
+            return numpy.nan_to_num(numpy.mean(numpy.abs(v - v.mean()))/v.std())
+        F, edges = sqlfunctions.regularized_function(x, y, 'zscore', bins=10, range=(0, 1))
+        Fslow, e = sqlfunctions.regularized_function(x, y, zscore, bins=10, range=(0, 1))
+        assert_almost_equal(F, Fslow)
+
+    def test_sql(self, data):
+        x, y = data
+        T = SQLarray('t', records=zip(x.tolist(), y.tolist()), columns=['x', 'y'])
+        (F, edges), = T.sql('SELECT medianhistogram(x, y, 10, 0, 1) AS "h [Object]" FROM __self__',
+                            asrecarray=False)[0]
+        Fslow, e = sqlfunctions.regularized_function(x, y, lambda v: numpy.median(v),
+                                                     bins=10, range=(0, 1))
+        assert_almost_equal(F, Fslow)
+
+
+class TestArrayFunctions(object):
+    @pytest.fixture
+    def arrays(self):
+        T = SQLarray('t', records=[(1, numpy.arange(5.)), (2, numpy.arange(12).reshape(3, 4)),
+                                   (3, numpy.zeros(0)), (4, None)], columns=['id', 'a'])
+        return T
+
+    def test_reductions(self, arrays):
+        r = arrays.sql("SELECT array_len(a), array_sum(a), array_mean(a), array_min(a), array_max(a) "
+                       "FROM __self__ ORDER BY id", asrecarray=False)
+        assert r == [(5, 10., 2., 0., 4.), (12, 66, 5.5, 0, 11),
+                     (0, 0., None, None, None), (None, None, None, None, None)]
+
+    def test_get(self, arrays):
+        r = arrays.sql("SELECT array_get(a, 1), array_get(a, -1), array_get(a, 12) FROM __self__ "
+                       "ORDER BY id", asrecarray=False)
+        assert r == [(1., 4., None), (1, 11, None), (None, None, None), (None, None, None)]
+
+    def test_filter(self, arrays):
+        r = arrays.sql("SELECT id FROM __self__ WHERE array_max(a) > 5", asrecarray=False)
+        assert r == [(2,)]
+
+    def test_slice(self, arrays):
+        (a,), = arrays.sql('SELECT array_slice(a, 1, -1) AS "a [NumpyArray]" FROM __self__ '
+                           'WHERE id = 1', asrecarray=False)
+        assert_equal(a, [1., 2., 3.])
+        (a,), = arrays.sql('SELECT array_slice(a, NULL, 2) AS "a [NumpyArray]" FROM __self__ '
+                           'WHERE id = 2', asrecarray=False)
+        assert_equal(a, [0, 1])
+
+    def test_aggregate_result(self, table):
+        T, groups, x = table
+        (n, s), = T.sql("SELECT array_len(array(x)), array_sum(array(x)) FROM __self__",
+                        asrecarray=False)
+        assert n == len(x)
+        assert_almost_equal(s, x.sum())
+
+    @pytest.mark.parametrize('values,dtype,expected', [
+        ([1, 2, 3], None, numpy.array([1, 2, 3])),
+        ([1, 2.5, 3], None, numpy.array([1, 2.5, 3])),
+        ([1., None, 3.], None, numpy.array([1., None, 3.])),
+        ([u'a', u'bc'], None, numpy.array([u'a', u'bc'])),
+        ([1, 2**70], None, numpy.array([1, 2**70])),
+        ([1, 2, 3], 'f4', numpy.array([1, 2, 3], dtype='f4')),
+        ([1.5, 2.5], 'int32', numpy.array([1.5, 2.5], dtype='int32')),
+        ([1., 2.], '>f8', numpy.array([1., 2.], dtype='>f8')),
+    ])
+    def test_array_aggregate(self, values, dtype, expected):
+        a = sqlfunctions._NumpyArray()
+        for x in values:
+            a.step(x, dtype)
+        result = convert_numpyarray(str(a.finalize()))
+        assert result.dtype == expected.dtype
+        assert_equal(result, expected)
+
+    def test_array_aggregate_sql(self):
+        T = SQLarray('t', records=[(1, 1.), (1, 2.), (2, 3.)], columns=['g', 'x'])
+        r = T.sql('SELECT g, array(x, \'f4\') AS "a [NumpyArray]" FROM __self__ GROUP BY g ORDER BY g',
+                  asrecarray=False)
+        assert_equal(r[0][1], numpy.array([1., 2.], dtype='f4'))
+        assert r[1][1].dtype == numpy.float32
+
+    @pytest.mark.parametrize('func,order', [('topk', -1), ('bottomk', 1)])
+    def test_topk(self, func, order):
+        x = numpy.random.RandomState(11).randint(0, 50, size=300).astype(float)
+        g = numpy.arange(len(x)) % 3
+        T = SQLarray('t', records=[(int(i), int(gi), float(xi)) for i, gi, xi in zip(range(len(x)), g, x)]
+                     + [(300, 0, None)], columns=['id', 'g', 'x'])
+        r = T.sql('SELECT g, %(f)s(x, 5) AS "v [NumpyArray]", arg%(f)s(id, x, 5) AS "i [NumpyArray]" '
+                  'FROM __self__ GROUP BY g ORDER BY g' % {'f': func}, asrecarray=False)
+        for gi, values, ids in r:
+            xg, idg = x[g == gi], numpy.arange(len(x))[g == gi]
+            best = numpy.argsort(order * xg, kind='mergesort')[:5]   # stable: earliest rows win ties
+            assert_equal(values, xg[best])
+            assert_equal(ids, idg[best])
+
+    def test_topk_small(self):
+        a = sqlfunctions._TopK()
+        for x in [3, 1, 2]:
+            a.step(x, 10)
+        assert_equal(convert_numpyarray(str(a.finalize())), [3, 2, 1])
+        a = sqlfunctions._TopK()
+        a.step(1., 0)
+        assert len(convert_numpyarray(str(a.finalize()))) == 0
+
+    @pytest.mark.parametrize('func,expected,ids', [('topk', ['z', 'y'], [1, 2]),
+                                                   ('bottomk', ['a', 'b'], [3, 4])])
+    def test_topk_text(self, func, expected, ids):
+        T = SQLarray('t', records=[(1, 'z'), (2, 'y'), (3, 'a'), (4, 'b')], columns=['id', 's'])
+        (values, i), = T.sql('SELECT %(f)s(s, 2) AS "v [NumpyArray]", arg%(f)s(id, s, 2) AS "i [NumpyArray]" '
+                             'FROM __self__' % {'f': func}, asrecarray=False)
+        assert list(values) == expected
+        assert list(i) == ids
+
+    def test_topk_mixed(self):
+        # as SQLite's ORDER BY: numbers < TEXT < BLOB
+        records = [(1, 2.5), (2, u'b'), (3, 10), (4, buffer('\x00')), (5, u'a'), (6, -1)]
+        T = SQLarray('t', records=records, columns=['id', 'x'])
+        order = [i for i, in T.sql('SELECT id FROM __self__ ORDER BY x', asrecarray=False)]
+        (top, bottom), = T.sql('SELECT argtopk(id, x, 6) AS "t [NumpyArray]", '
+                               'argbottomk(id, x, 6) AS "b [NumpyArray]" FROM __self__', asrecarray=False)
+        assert list(bottom) == order
+        assert list(top) == order[::-1]
+        (values,), = T.sql('SELECT bottomk(x, 3) AS "v [NumpyArray]" FROM __self__', asrecarray=False)
+        assert list(values) == [-1, 2.5, 10]
+        (values,), = T.sql('SELECT topk(x, 3) AS "v [NumpyArray]" FROM __self__ WHERE id != 4',
+                           asrecarray=False)
+        assert values.dtype == object
+        assert list(values) == [u'b', u'a', 10]
+
+    def test_histogram_accessors(self, table):
+        T, groups, x = table
+        T.sql("CREATE TABLE hists AS SELECT g, histogram(x, 10, -2, 2) AS h FROM __self__ GROUP BY g")
+        r = T.sql('SELECT g, histogram_counts(h) AS "c [NumpyArray]", histogram_edges(h) AS "e [NumpyArray]", '
+                  'histogram_total(h), histogram_at(h, 0.1), histogram_at(h, 3) FROM hists ORDER BY g',
+                  asrecarray=False)
+        for g, counts, edges, total, at, outside in r:
+            h, e = numpy.histogram(x[groups == g], bins=10, range=(-2, 2))
+            assert_equal(counts, h)
+            assert_equal(edges, e)
+            assert total == h.sum()
+            assert at == h[5]
+            assert outside is None
+
+
+class TestRegexp(object):
+    def test_cache(self):
+        regexp, match = sqlfunctions._regexp_functions(maxsize=2)
+        assert regexp(u'b+', u'abbc')
+        assert not match(u'b+', u'abbc')
+        assert match(u'a', u'abbc')
+        assert regexp(u'^1', 12)
+        for pattern in u'xyz':
+            regexp(pattern, u'x')
+        assert regexp(u'b+', u'abbc')
+
+    def test_sql(self):
+        T = SQLarray('t', records=[(u'alpha',), (u'beta',), (u'gamma',)], columns=['s'])
+        r = T.sql("SELECT s FROM __self__ WHERE s REGEXP 'm+a$' OR s MATCH 'b'", asrecarray=False)
+        assert sorted(r) == [(u'beta',), (u'gamma',)]
+
+
+class TestWindowAggregates(object):
+    @pytest.fixture
+    def series(self):
+        return 1e6 + numpy.random.RandomState(8).randn(300)
+
+    @staticmethod
+    def rolling(agg, x, w):
+        """Drive a window aggregate like SQLite does for ROWS w-1 PRECEDING."""
+        values = []
+        for i, v in enumerate(x):
+            agg.step(v)
+            if i >= w:
+                agg.inverse(x[i - w])
+            values.append(agg.value())
+        return numpy.array(values)
+
+    @pytest.mark.parametrize('cls,func', [
+        (sqlfunctions._MovingMean, numpy.mean),
+        (sqlfunctions._MovingStd, lambda v: numpy.std(v, ddof=1)),
+        (sqlfunctions._MovingMedian, numpy.median),
+        (sqlfunctions._MovingZscore, lambda v: (v[-1] - v.mean()) / v.std(ddof=1))])
+    def test_rolling(self, series, cls, func):
+        w = 25
+        values = self.rolling(cls(), series, w)
+        expected = [func(series[max(0, i - w + 1):i + 1]) for i in range(w, len(series))]
+        assert_almost_equal(values[w:], expected, decimal=6)
+
+    def test_null_and_empty(self):
+        agg = sqlfunctions._MovingStd()
+        assert agg.value() is None
+        agg.step(None)
+        agg.step(2.)
+        assert agg.value() == 0.
+        agg.inverse(2.)
+        assert agg.value() is None
+
+    @pytest.mark.parametrize('func', ['mean', 'std', 'median', 'zscore'])
+    def test_moving(self, series, func):
+        w = 25
+        cls = sqlfunctions.MOVING[func]
+        x = series.tolist()
+        x[10] = None
+        expected = self.rolling(cls(), x, w)
+        assert_almost_equal(sqlfunctions.moving(x, w, func)[w:], expected[w:].astype(float))
+
+    def test_moving_zscore_null(self):
+        z = sqlfunctions.moving([5., 6., None, 7.], 3, 'zscore')
+        assert_almost_equal(z[:2], [0., numpy.sqrt(0.5)])
+        assert numpy.isnan(z[2])
+        assert_almost_equal(z[3], (7. - 6.5) / numpy.sqrt(0.5))     # window 6, None, 7
+
+    def test_moving_table(self):
+        x = numpy.random.RandomState(9).rand(50)
+        T = SQLarray('t', records=[(float(50 - i), float(v)) for i, v in enumerate(x)],
+                     columns=['t', 'x'])
+        m = T.moving('x', 3, order_by='t', where='t > ?', parameters=(5,))
+        y = x[:45][::-1]
+        assert_almost_equal(m[2:], [y[i-2:i+1].mean() for i in range(2, len(y))])
+        assert_almost_equal(m[:2], [y[0], y[:2].mean()])
+        with pytest.raises(ValueError):
+            T.moving('x', 3, func='mode')
+
+    def test_not_an_aggregate(self, connection):
+        # without window functions moving_*() must not pose as whole-table aggregates
+        if sqlfunctions.create_window_function(connection, "moving_mean", 1,
+                                               sqlfunctions._MovingMean):
+            pytest.skip("sqlite module has window functions")
+        sqlfunctions.register(connection)
+        with pytest.raises(sqlite3.OperationalError):
+            connection.execute("SELECT moving_mean(1)")
+
+    def test_window(self, connection):
+        if not sqlfunctions.create_window_function(connection, "moving_mean", 1,
+                                                   sqlfunctions._MovingMean):
+            pytest.skip("sqlite module cannot create window functions")
+        connection.execute("CREATE TABLE t (i, x)")
+        connection.executemany("INSERT INTO t VALUES (?, ?)", [(i, float(i*i)) for i in range(10)])
+        r = connection.execute("SELECT moving_mean(x) OVER (ORDER BY i ROWS 2 PRECEDING) "
+                               "FROM t ORDER BY i").fetchall()
+        x = numpy.arange(10.)**2
+        assert_almost_equal([v for v, in r][2:], [x[i-2:i+1].mean() for i in range(2, 10)])
+
+
+def test_describe():
+    x = numpy.random.RandomState(4).randn(1000)
+    T = SQLarray('t', records=[(float(v),) for v in x] + [(None,)], columns=['x'])
+    s, = T.sql('SELECT describe(x) AS "s [Object]" FROM __self__', asrecarray=False)[0]
+    assert s.n == 1000
+    assert_almost_equal([s.avg, s.stdev, s.xmin, s.q25, s.median, s.q75, s.xmax],
+                        [x.mean(), x.std(ddof=1), x.min(), numpy.percentile(x, 25),
+                         numpy.median(x), numpy.percentile(x, 75), x.max()])
+    assert sqlfunctions.describe([]).n == 0
+
+
+class TestRegisterAggregate(object):
+    @pytest.fixture(autouse=True)
+    def registry(self, monkeypatch):
+        # keep the test aggregates out of the global registry
+        monkeypatch.setattr(sqlfunctions, '_AGGREGATES', list(sqlfunctions._AGGREGATES))
+
+    def test_reducer(self):
+        recsql.register_aggregate('test_rms', lambda x: numpy.sqrt(numpy.mean(x*x)))
+        x = numpy.random.RandomState(5).randn(100)
+        T = SQLarray('t', records=[(float(v),) for v in x] + [(None,)], columns=['x'])
+        assert_almost_equal(T.sql("SELECT test_rms(x) FROM __self__", asrecarray=False)[0][0],
+                            numpy.sqrt(numpy.mean(x*x)))
+
+    def test_merge_in_chunks(self, monkeypatch):
+        cls = recsql.register_aggregate('test_wsum', lambda x, w: numpy.dot(x, w), nargs=2,
+                                        dtype=[numpy.float64, numpy.int64],
+                                        merge=lambda a, b: a + b)
+        monkeypatch.setattr(cls, 'chunksize', 7)
+        T = SQLarray('t', records=[(float(i), i % 3) for i in range(100)], columns=['x', 'w'])
+        assert T.sql("SELECT test_wsum(x, w) FROM __self__", asrecarray=False)[0][0] == \
+            sum([i * (i % 3) for i in range(100)])
+        a, b = cls(), cls()
+        for i in range(10):
+            a.step(float(i), 1)
+            b.step(float(i), 2)
+        assert a.merge(b).finalize() == 3 * 45.
+
+    def test_array_result_and_reregistration(self):
+        recsql.register_aggregate('test_cumsum', numpy.cumsum)
+        T = SQLarray('t', records=[(float(i),) for i in range(10)], columns=['x'])
+        r, = T.sql('SELECT test_cumsum(x) AS "c [NumpyArray]" FROM __self__', asrecarray=False)[0]
+        assert_equal(r, numpy.cumsum(numpy.arange(10.)))
+        recsql.register_aggregate('test_cumsum', len)
+        T2 = SQLarray('t2', records=[(1.,)], columns=['x'], connection=T.connection)
+        assert T2.sql("SELECT test_cumsum(x) FROM t", asrecarray=False)[0][0] == 10
+
+    def test_bad_dtype(self):
+        with pytest.raises(ValueError):
+            recsql.register_aggregate('test_bad', len, dtype=numpy.complex128)
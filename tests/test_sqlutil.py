@@ -0,0 +1,120 @@
+# tests for recsql.sqlutil
+
+import cPickle
+
+import numpy
+from numpy.testing import assert_equal
+import pytest
+
+from recsql import SQLarray, sqlutil
+
+
+@pytest.mark.parametrize('a', [numpy.arange(10.),
+                               numpy.arange(12, dtype=numpy.int32).reshape(3, 4),
+                               numpy.arange(12.).reshape(3, 4).T,
+                               numpy.zeros(0, dtype=numpy.float32),
+                               numpy.array(3.5),
+                               numpy.array([True, False])])
+def test_array_blob(a):
+    s = sqlutil.adapt_numpyarray(a)
+    assert sqlutil.is_array_blob(s)
+    b = sqlutil.convert_numpyarray(str(s))
+    assert b.dtype == a.dtype
+    assert_equal(b, a)
+
+
+def test_array_blob_size():
+    a = numpy.random.RandomState(1).rand(1000)
+    assert len(sqlutil.adapt_numpyarray(a)) < a.nbytes + 32
+
+
+def test_array_blob_zero_copy():
+    s = str(sqlutil.adapt_numpyarray(numpy.arange(10.)))
+    b = sqlutil.convert_numpyarray(s)
+    assert not b.flags.writeable
+    assert not b.flags.owndata
+
+
+@pytest.mark.parametrize('a', [numpy.rec.fromrecords([(1, 2.)], names='a,b'),
+                               numpy.array([None, 'x'], dtype=object)])
+def test_array_pickle_fallback(a):
+    s = sqlutil.adapt_numpyarray(a)
+    assert not sqlutil.is_array_blob(s)
+    b = sqlutil.convert_numpyarray(str(s))
+    assert type(b) is type(a)
+    assert_equal(b, a)
+
+
+def test_legacy_ascii_pickle():
+    a = numpy.arange(5.)
+    assert_equal(sqlutil.convert_numpyarray(cPickle.dumps(a, protocol=0)), a)
+    assert_equal(sqlutil.convert_object(cPickle.dumps((a, 1), protocol=0))[0], a)
+
+
+def test_arrays_blob():
+    arrays = (numpy.arange(6.).reshape(2, 3), numpy.arange(4, dtype=numpy.int32), numpy.zeros(0))
+    s = sqlutil.adapt_arrays(arrays)
+    for blob in (str(s), s):
+        result = sqlutil.convert_object(blob)
+        assert type(result) is tuple and len(result) == 3
+        for a, b in zip(arrays, result):
+            assert b.dtype == a.dtype
+            assert not b.flags.owndata
+            assert_equal(b, a)
+    # tuples with other objects are pickled
+    assert sqlutil.convert_object(str(sqlutil.adapt_arrays((numpy.arange(2), 'x'))))[1] == 'x'
+
+
+def test_histogram_blobs():
+    T = SQLarray('t', records=[(float(x),) for x in range(10)], columns=['x'])
+    (h,), = T.sql('SELECT histogram(x, 5, 0, 10) FROM __self__', asrecarray=False)
+    assert str(h).startswith(sqlutil.ARRAYS_MAGIC)
+    # pickled histograms of older versions are still understood
+    T.sql("CREATE TABLE h (h Object)")
+    T.sql("INSERT INTO h VALUES (?)", (sqlutil.adapt_object((numpy.ones(2), numpy.arange(3.))),))
+    T.sql("INSERT INTO h SELECT histogram(x, 5, 0, 10) FROM t")
+    r = T.sql("SELECT histogram_total(h), histogram_counts(h) AS \"c [NumpyArray]\" FROM h",
+              asrecarray=False)
+    assert [n for n, c in r] == [2, 10]
+    assert_equal(r[1][1], [2, 2, 2, 2, 2])
+
+
+def test_sql_columns():
+    T = SQLarray('t', records=[(1, numpy.arange(3.))], columns=['id', 'a'])
+    T.sql("CREATE TABLE arrays (a NumpyArray, o Object)")
+    T.sql("INSERT INTO arrays (a, o) VALUES (?, ?)", (numpy.arange(5.), (1, 'x')))
+    (a, o), = T.sql("SELECT a, o FROM arrays", asrecarray=False)
+    assert_equal(a, numpy.arange(5.))
+    assert o == (1, 'x')
+    (a,), = T.sql('SELECT array(id) AS "a [NumpyArray]" FROM __self__', asrecarray=False)
+    assert_equal(a, [1])
+
+
+@pytest.mark.parametrize('codec', sorted(sqlutil.CODECS))
+@pytest.mark.parametrize('shuffle', ['', '+shuffle'])
+@pytest.mark.parametrize('a', [numpy.linspace(0, 1, 1000).reshape(10, 100),
+                               numpy.arange(100, dtype=numpy.int16),
+                               numpy.zeros(0),
+                               numpy.arange(10, dtype=numpy.uint8)])
+def test_compressed_array(codec, shuffle, a):
+    s = sqlutil.adapt_compressed(sqlutil.Compressed(a, codec + shuffle))
+    assert sqlutil.is_array_blob(s)
+    for convert in sqlutil.convert_numpyarray, sqlutil.convert_object:
+        b = convert(str(s))
+        assert b.dtype == a.dtype
+        assert_equal(b, a)
+
+
+def test_compressed_object():
+    obj = (numpy.arange(1000.), 'x')
+    s = sqlutil.adapt_compressed(sqlutil.Compressed(obj, 'zlib:9'))
+    assert len(s) < len(sqlutil.adapt_object(obj))
+    b = sqlutil.convert_object(str(s))
+    assert_equal(b[0], obj[0])
+    assert b[1] == 'x'
+
+
+@pytest.mark.parametrize('spec', ['nosuchcodec', 'zlib:x', 'zlib+other', ''])
+def test_bad_compression(spec):
+    with pytest.raises(ValueError):
+        sqlutil.Compressed(numpy.arange(3), spec)